@@ -0,0 +1,199 @@
+"""実績（アチーブメント）
+
+ゲームの結果・ログイン・新規登録などのイベントを submit() でキューに積み（リクエスト処理中はこれだけ）、
+バックグラウンドのジョブが process_batch() でまとめて処理する。
+
+イベントごとに、まずユーザーごとのカウンターを差分で更新し（トピックごとの回数と、TRACKERS の集計）、
+次にそのイベントのトピックを購読している実績の条件だけを調べる。
+トピックはイベントの種類（'game_result'）と、ゲームごとの種類（'game_result:memory'）。
+実績がいくつ増えても、1件のイベントで調べるのは購読している実績だけで、すでに解除済みなら条件も見ない。
+"""
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import date
+
+Event = namedtuple('Event', 'kind player data time')
+
+GAME_BITS = {'memory': 1, 'number': 2, 'rps': 4, 'quiz': 8, 'color': 16, 'reaction': 32}
+ALL_GAMES = sum(GAME_BITS.values())
+
+
+class Achievement:
+    """topic のイベントが来るたびに check(カウンター, イベント) を調べ、True なら解除する"""
+
+    __slots__ = ('achievement_id', 'name', 'description', 'topic', 'check')
+
+    def __init__(self, achievement_id, name, description, topic, check):
+        self.achievement_id = achievement_id
+        self.name = name
+        self.description = description
+        self.topic = topic
+        self.check = check
+
+    def to_dict(self):
+        return {'id': self.achievement_id, 'name': self.name, 'description': self.description}
+
+
+def _score_at_most(limit):
+    return lambda counters, event: event.data['score'] <= limit
+
+
+def _score_at_least(limit):
+    return lambda counters, event: event.data['score'] >= limit
+
+
+def _counter_at_least(name, limit):
+    return lambda counters, event: counters.get(name, 0) >= limit
+
+
+ACHIEVEMENTS = [
+    Achievement('welcome', 'ようこそ！', 'ユーザー登録をした', 'register', lambda counters, event: True),
+    Achievement('first_game', 'はじめの一歩', 'ミニゲームを1回遊んだ', 'game_result',
+                _counter_at_least('game_result', 1)),
+    Achievement('hundred_games', 'ゲーム好き', 'ミニゲームの結果を100回記録した', 'game_result',
+                _counter_at_least('game_result', 100)),
+    Achievement('all_games', '全ゲーム制覇', '6つのミニゲームをすべて遊んだ', 'game_result',
+                lambda counters, event: counters.get('games_played', 0) == ALL_GAMES),
+    Achievement('memory_master', '記憶の達人', '記憶ゲームを12回以内の試行でクリアした', 'game_result:memory',
+                _score_at_most(12)),
+    Achievement('number_lucky', '勘が冴えてる', '数字当てゲームを3回以内で当てた', 'game_result:number',
+                _score_at_most(3)),
+    Achievement('quiz_ace', 'クイズ王', 'クイズで10問以上正解した', 'game_result:quiz', _score_at_least(10)),
+    Achievement('color_100', '色彩感覚', 'カラーマッチングで100点以上取った', 'game_result:color', _score_at_least(100)),
+    Achievement('reaction_200', '反射神経', 'リアクションで200ミリ秒を切った', 'game_result:reaction',
+                _score_at_most(199)),
+    Achievement('rps_first_win', '初勝利', 'オンライン対戦じゃんけんで初めて勝った', 'rps_match',
+                _counter_at_least('rps_wins', 1)),
+    Achievement('rps_streak_5', '連勝街道', 'オンライン対戦じゃんけんで5連勝した', 'rps_match',
+                _counter_at_least('rps_streak', 5)),
+    Achievement('rps_veteran', '歴戦の勇者', 'オンライン対戦じゃんけんを50試合遊んだ', 'rps_match',
+                _counter_at_least('rps_match', 50)),
+    Achievement('regular', '常連さん', '7日連続でログインした', 'login', _counter_at_least('login_streak', 7)),
+]
+
+
+def track_games_played(counters, event):
+    counters['games_played'] = counters.get('games_played', 0) | GAME_BITS.get(event.data['game'], 0)
+
+
+def track_rps(counters, event):
+    if event.data['outcome'] == 'win':
+        counters['rps_wins'] = counters.get('rps_wins', 0) + 1
+        counters['rps_streak'] = counters.get('rps_streak', 0) + 1
+    else:
+        counters['rps_streak'] = 0
+
+
+def track_login_streak(counters, event):
+    day = date.fromtimestamp(event.time).toordinal()
+    last = counters.get('login_day')
+    if last == day:
+        return
+    counters['login_streak'] = counters.get('login_streak', 0) + 1 if last == day - 1 else 1
+    counters['login_day'] = day
+
+
+# カウンターの集計（トピック → 更新する関数）。トピックごとの回数はエンジンが数える
+TRACKERS = {
+    'game_result': [track_games_played],
+    'rps_match': [track_rps],
+    'login': [track_login_streak],
+}
+
+
+class AchievementEngine:
+    """イベントのキューと、ユーザーごとのカウンター・解除済みの実績
+
+    on_unlock(プレイヤー, Achievement) は実績を解除したときに呼ばれる。
+    """
+
+    def __init__(self, achievements=ACHIEVEMENTS, trackers=TRACKERS, batch_size=1000, on_unlock=None):
+        self.achievements = {a.achievement_id: a for a in achievements}
+        self.subscriptions = {}        # {トピック: [Achievement]}
+        for achievement in achievements:
+            self.subscriptions.setdefault(achievement.topic, []).append(achievement)
+        self.trackers = trackers
+        self.batch_size = batch_size
+        self.on_unlock = on_unlock
+        self._queue = deque()          # append / popleft はスレッドセーフ
+        self._counters = {}            # {プレイヤー: {カウンター名: 値}}
+        self._unlocked = {}            # {プレイヤー: {実績 ID: 解除した時刻}}
+        self.recent = deque(maxlen=100)
+        self.processed = 0
+        self.checks = 0
+        self.unlocks = 0
+        self._process_lock = threading.Lock()
+
+    def submit(self, kind, player, now=None, **data):
+        """イベントをキューに積む（リクエスト処理中はこれだけ）"""
+        self._queue.append(Event(kind, player, data, time.time() if now is None else now))
+
+    def pending(self):
+        return len(self._queue)
+
+    def process_batch(self):
+        """キューから最大 batch_size 件を取り出して処理し、件数を返す"""
+        with self._process_lock:
+            count = 0
+            while self._queue and count < self.batch_size:
+                self._process(self._queue.popleft())
+                count += 1
+            self.processed += count
+            return count
+
+    def process_all(self):
+        while self.process_batch():
+            pass
+
+    def _process(self, event):
+        counters = self._counters.get(event.player)
+        if counters is None:
+            counters = self._counters[event.player] = {}
+        game = event.data.get('game')
+        topics = (event.kind, ) if game is None else (event.kind, f"{event.kind}:{game}")
+        for topic in topics:
+            counters[topic] = counters.get(topic, 0) + 1
+            for tracker in self.trackers.get(topic, ()):
+                tracker(counters, event)
+
+        unlocked = self._unlocked.get(event.player)
+        for topic in topics:
+            for achievement in self.subscriptions.get(topic, ()):
+                if unlocked is not None and achievement.achievement_id in unlocked:
+                    continue
+                self.checks += 1
+                if achievement.check(counters, event):
+                    if unlocked is None:
+                        unlocked = self._unlocked[event.player] = {}
+                    self._unlock(event, achievement, unlocked)
+
+    def _unlock(self, event, achievement, unlocked):
+        unlocked[achievement.achievement_id] = event.time
+        self.unlocks += 1
+        self.recent.append((event.time, event.player, achievement.achievement_id))
+        if self.on_unlock is not None:
+            self.on_unlock(event.player, achievement)
+
+    def unlocked(self, player):
+        """{実績 ID: 解除した時刻}"""
+        return dict(self._unlocked.get(player, {}))
+
+    def counters(self, player):
+        return dict(self._counters.get(player, {}))
+
+    def summary(self, player):
+        """全実績の一覧に、player が解除した時刻を付けたもの"""
+        unlocked = self._unlocked.get(player, {})
+        return [dict(a.to_dict(), unlocked_at=unlocked.get(a.achievement_id))
+                for a in self.achievements.values()]
+
+    def metrics(self):
+        return {
+            'pending': len(self._queue),
+            'processed': self.processed,
+            'checks': self.checks,
+            'unlocks': self.unlocks,
+            'players': len(self._counters),
+            'achievements': len(self.achievements),
+        }
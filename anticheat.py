@@ -0,0 +1,181 @@
+"""クライアントから送られたゲーム結果の不正チェック
+
+検証はキューに積んでバックグラウンドでまとめて行い、通ったスコアだけをランキングに載せる。
+ありえない結果（ルール違反）は捨て、本人の普段の成績から大きく外れた結果は要確認として記録する。
+"""
+import math
+import threading
+import time
+from collections import deque
+
+# 人間の反応速度の下限（ミリ秒）
+MIN_REACTION_MS = 100
+# クイズ1問を読んで答えるのに最低限かかる秒数
+MIN_QUIZ_SECONDS_PER_QUESTION = 1.5
+# カラーマッチングの制限時間と、回答後に次の色が出るまでの待ち時間（秒）
+COLOR_TIME_LIMIT = 30
+COLOR_ANSWER_DELAY = 0.8
+
+
+def max_color_score():
+    """制限時間内に全問正解し続けた場合の最高得点（n問目の得点は n 点）"""
+    answers = int(COLOR_TIME_LIMIT / COLOR_ANSWER_DELAY)
+    return answers * (answers + 1) // 2
+
+
+def check_reaction(score, context):
+    if score < MIN_REACTION_MS:
+        return f"反応時間 {score}ms は人間の限界（{MIN_REACTION_MS}ms）より速い"
+    return None
+
+
+def check_quiz(score, context):
+    correct = context.get('correct')
+    if correct is not None and score > correct:
+        return f"正解数 {score} がサーバーで確認した正解数 {correct} を超えている"
+    elapsed = context.get('elapsed')
+    if elapsed is not None and score * MIN_QUIZ_SECONDS_PER_QUESTION > elapsed:
+        return f"{score}問の正解に {elapsed:.1f}秒しかかかっていない"
+    return None
+
+
+def check_color(score, context):
+    if score > max_color_score():
+        return f"得点 {score} が {COLOR_TIME_LIMIT}秒で取れる最高得点 {max_color_score()} を超えている"
+    return None
+
+
+GAME_RULES = {
+    'reaction': check_reaction,
+    'quiz': check_quiz,
+    'color': check_color,
+}
+
+
+class RollingStats:
+    """直近 window 件のスコアの平均と標準偏差"""
+
+    __slots__ = ('values', 'total', 'total_sq')
+
+    def __init__(self, window):
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, value):
+        if len(self.values) == self.values.maxlen:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+
+    def mean_and_std(self):
+        count = len(self.values)
+        mean = self.total / count
+        variance = max(self.total_sq / count - mean * mean, 0.0)
+        return mean, math.sqrt(variance)
+
+
+class Submission:
+    __slots__ = ('game', 'player', 'score', 'higher_is_better', 'context', 'received')
+
+    def __init__(self, game, player, score, higher_is_better, context):
+        self.game = game
+        self.player = player
+        self.score = score
+        self.higher_is_better = higher_is_better
+        self.context = context
+        self.received = time.time()
+
+
+class ResultValidator:
+    """送信されたスコアをキューに積み、まとめて検証する
+
+    on_reject(submission, reason) はルール違反のスコアごとに呼ばれる。
+    on_accept(submission) はルールを満たしたスコア（要確認のものも含む）ごとに呼ばれる。
+    """
+
+    def __init__(self, on_reject, on_accept=None, rules=GAME_RULES, batch_size=1000, window=20,
+                 min_samples=10, outlier_sigma=4.0):
+        self.on_reject = on_reject
+        self.on_accept = on_accept
+        self.rules = rules
+        self.batch_size = batch_size
+        self.window = window
+        self.min_samples = min_samples
+        self.outlier_sigma = outlier_sigma
+        self._queue = deque()          # append / popleft はスレッドセーフ
+        self._stats = {}               # {(ゲーム, プレイヤー): RollingStats}
+        self.flags = deque(maxlen=1000)
+        self.validated = 0
+        self.rejected = 0
+        self.flagged = 0
+        self._process_lock = threading.Lock()
+
+    def submit(self, game, player, score, higher_is_better, context=None):
+        """検証待ちに追加する（リクエスト処理中はこれだけ）"""
+        self._queue.append(Submission(game, player, score, higher_is_better, context or {}))
+
+    def pending(self):
+        return len(self._queue)
+
+    def process_batch(self):
+        """キューから最大 batch_size 件を取り出して検証し、件数を返す"""
+        with self._process_lock:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            for submission in batch:
+                self._validate(submission)
+            self.validated += len(batch)
+            return len(batch)
+
+    def process_all(self):
+        while self.process_batch():
+            pass
+
+    def _validate(self, submission):
+        key = (submission.game, submission.player)
+        rule = self.rules.get(submission.game)
+        reason = rule(submission.score, submission.context) if rule else None
+        if reason:
+            self.rejected += 1
+            self._flag(submission, 'rejected', reason)
+            self.on_reject(submission, reason)
+            return
+
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = RollingStats(self.window)
+        if len(stats.values) >= self.min_samples:
+            mean, std = stats.mean_and_std()
+            # 普段より極端に良い結果だけを要確認にする
+            improvement = submission.score - mean if submission.higher_is_better else mean - submission.score
+            if std > 0 and improvement > self.outlier_sigma * std:
+                self.flagged += 1
+                self._flag(submission, 'outlier',
+                           f"普段の成績（平均 {mean:.1f}, 標準偏差 {std:.1f}）から大きく外れている")
+        stats.add(submission.score)
+        if self.on_accept is not None:
+            self.on_accept(submission)
+
+    def _flag(self, submission, kind, reason):
+        self.flags.append({
+            'game': submission.game,
+            'player': submission.player,
+            'score': submission.score,
+            'kind': kind,
+            'reason': reason,
+            'received': submission.received,
+        })
+
+    def metrics(self):
+        return {
+            'pending': self.pending(),
+            'validated': self.validated,
+            'rejected': self.rejected,
+            'flagged': self.flagged,
+            'recent_flags': list(self.flags)[-20:],
+        }
@@ -0,0 +1,93 @@
+"""実績エンジンのベンチマーク
+
+1. リクエスト側の submit() にかかる時間（キューに積むだけ）。
+2. バックグラウンドでの処理速度を、実績の総数を増やしながら測る。
+   増やす実績は別のトピック（イベントが来ないゲーム）を購読しているので、購読方式なら1件あたりの時間は変わらない。
+   比較として、イベントごとに全実績の条件を調べる方式の時間も表示する。
+
+使い方: python bench/achievement_bench.py [--events 件数] [--players 人数]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from achievements import ACHIEVEMENTS, GAME_BITS, Achievement, AchievementEngine
+
+
+def make_events(count, players, seed=1):
+    rng = random.Random(seed)
+    games = list(GAME_BITS)
+    events = []
+    for _ in range(count):
+        player = f"user{rng.randrange(players)}"
+        roll = rng.random()
+        if roll < 0.8:
+            events.append(('game_result', player, {'game': rng.choice(games), 'score': rng.randrange(1, 300)}))
+        elif roll < 0.95:
+            events.append(('rps_match', player, {'outcome': rng.choice(('win', 'lose', 'draw'))}))
+        else:
+            events.append(('login', player, {}))
+    return events
+
+
+def extra_rules(count):
+    """イベントの来ないトピックを購読する実績"""
+    return [Achievement(f"extra{i}", f"extra{i}", '', f"game_result:extra{i % 100}",
+                        lambda counters, event: event.data['score'] > 10 ** 9)
+            for i in range(count)]
+
+
+class ScanAllEngine(AchievementEngine):
+    """比較用: イベントごとに全実績を見て、トピックが合うものの条件を調べる"""
+
+    def _process(self, event):
+        self.subscriptions = {}
+        super()._process(event)
+        game = event.data.get('game')
+        topics = (event.kind, ) if game is None else (event.kind, f"{event.kind}:{game}")
+        counters = self._counters[event.player]
+        unlocked = self._unlocked.setdefault(event.player, {})
+        for achievement in self.achievements.values():
+            self.checks += 1
+            if (achievement.topic in topics and achievement.achievement_id not in unlocked
+                    and achievement.check(counters, event)):
+                self._unlock(event, achievement, unlocked)
+
+
+def measure(events, rules, scan_all=False):
+    engine = (ScanAllEngine if scan_all else AchievementEngine)(achievements=rules, batch_size=len(events))
+    started = time.perf_counter()
+    for kind, player, data in events:
+        engine.submit(kind, player, **data)
+    submitted = time.perf_counter() - started
+    started = time.perf_counter()
+    engine.process_all()
+    processed = time.perf_counter() - started
+    return submitted / len(events), processed / len(events), engine
+
+
+def main(count, players):
+    events = make_events(count, players)
+    print(f"{count} events from {players} players")
+    for extra in (0, 1000, 10000):
+        rules = ACHIEVEMENTS + extra_rules(extra)
+        submit, process, engine = measure(events, rules)
+        line = (f"  {len(rules):6d} achievements: submit {submit * 1e6:.2f} µs/event, "
+                f"process {process * 1e6:6.2f} µs/event, {engine.checks / count:.2f} checks/event, "
+                f"{engine.unlocks} unlocks")
+        if extra <= 1000:
+            _, scan, _ = measure(events[:count // 10], rules, scan_all=True)
+            line += f"; checking every achievement {scan * 1e6:8.2f} µs/event"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='実績エンジンのベンチマーク')
+    parser.add_argument('--events', type=int, default=200_000)
+    parser.add_argument('--players', type=int, default=10_000)
+    args = parser.parse_args()
+    main(args.events, args.players)
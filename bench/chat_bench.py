@@ -0,0 +1,99 @@
+"""ロビーチャットのベンチマーク
+
+1. SSE の購読者を N 本つなぎ、HTTP で投稿したメッセージが全員に届くまでの時間を測る。
+2. 投稿の頻度制限（トークンバケット）が 1人あたりに使うメモリと、1回の判定時間を測る。
+
+使い方: python bench/chat_bench.py [--subscribers 本数] [--messages 件数]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chat import RateLimiter
+from game_gateway import create_gateway
+
+
+async def subscribe(port, received, index):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET /chat/events?room=lobby HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode())
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            received[index] += data.count(b'\nevent: message\n')
+    finally:
+        writer.close()
+
+
+async def post(port, text):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = text.encode()
+    writer.write((f"POST /chat/messages?room=lobby HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+                  f"Cookie: user=poster\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body)
+    status = (await reader.readline()).split()[1]
+    writer.close()
+    return int(status)
+
+
+async def fanout(subscribers, messages):
+    gateway = create_gateway(identify=lambda request: request.cookie('user') or 'guest_bench')
+    gateway.chat.limiter = RateLimiter(rate=1e9, burst=1e9)   # 計測のため頻度制限は外す
+    server = await gateway.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    received = [0] * subscribers
+    tasks = [asyncio.ensure_future(subscribe(port, received, i)) for i in range(subscribers)]
+    while sum(len(room.subscribers) for room in gateway.chat.rooms.values()) < subscribers:
+        await asyncio.sleep(0.01)
+
+    latencies = []
+    for n in range(messages):
+        started = time.perf_counter()
+        assert await post(port, f"message {n}") == 200
+        while min(received) < n + 1:
+            await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - started)
+
+    for task in tasks:
+        task.cancel()
+    while sum(len(room.subscribers) for room in gateway.chat.rooms.values()):
+        await asyncio.sleep(0.01)
+    server.close()
+    latencies.sort()
+    print(f"{subscribers} SSE subscribers, {messages} messages: post -> delivered to everyone "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"  chat: {gateway.chat.metrics()}")
+
+
+def limiter(users=100_000):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    limiter = RateLimiter()
+    now = time.monotonic()
+    names = [f"user{i}" for i in range(users)]
+    started = time.perf_counter()
+    for name in names:
+        limiter.allow(name, now)
+    for name in names:
+        limiter.allow(name, now)
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"rate limiter: {users} users, {used / users:.0f} bytes/user (including the name), "
+          f"{elapsed / (users * 2) * 1e6:.2f} µs/check; "
+          f"prune after idle removes {limiter.prune(now + 60)} buckets")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ロビーチャットのベンチマーク')
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(fanout(args.subscribers, args.messages))
+    limiter()
@@ -0,0 +1,183 @@
+"""カラーレースのティック処理のベンチマーク（1コアで何部屋回せるか）
+
+満員の部屋を用意し、各プレイヤーが約0.8秒ごとに回答する状態で1ティックの処理時間を測る。
+ネットワークは使わず、送信は送ったバイト数を数えるだけの接続で置き換える。
+実際には同じコアで受信したメッセージの解析や送信も行うので、ティックの半分を部屋の処理に
+使える目安とし、その部屋数で実際の固定間隔ループを回してティック超過がないか確かめる。
+
+最後に、受信確認が遅れて届く場合（片道 0.2〜1秒）でも、クライアントが差分の基準を手元に持っていて
+差分を1件も捨てないことを確かめる。クライアントの手順は minigame_template の storeColorRaceSnapshot と同じ。
+
+使い方: python bench/color_race_bench.py [部屋数]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import color_race
+import protocol
+from color_race import ColorRaceServer, RacePlayer, MAX_PLAYERS, TICK, COUNTDOWN_TICKS, ACK_EVERY_TICKS
+
+
+class CountingConnection:
+    """送信したバイト数だけ数える接続"""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = 0
+
+    def send_prepared(self, frame, kind='control'):
+        self.sent += len(frame)
+        return True
+
+
+def build(rooms):
+    server = ColorRaceServer()
+    players = []
+    for r in range(rooms):
+        for p in range(MAX_PLAYERS):
+            player = RacePlayer(CountingConnection(), f"bot{r}_{p}")
+            server.join(player)
+            players.append(player)
+    # 満員の部屋はすぐ始まるので、カウントダウンが終わるまで進める
+    for _ in range(COUNTDOWN_TICKS + 1):
+        server.tick()
+    return server, players
+
+
+def feed_inputs(server, players, rng):
+    """各プレイヤーが平均 COLOR_ANSWER_DELAY 秒に1回答え、ACK_EVERY_TICKS ごとに受信確認を返す"""
+    chance = TICK / color_race.COLOR_ANSWER_DELAY
+    last_tick = server.tick_count - 1
+    ack = last_tick % ACK_EVERY_TICKS == 0
+    for player in players:
+        if player.room is None:
+            continue
+        if rng.random() < chance:
+            player.room.answer(player, player.index, rng.random() < 0.5)
+        if ack:
+            player.room.ack(player, last_tick)
+
+
+def measure(rooms, ticks=100, seed=1):
+    rng = random.Random(seed)
+    server, players = build(rooms)
+    elapsed = 0.0
+    for _ in range(ticks):
+        feed_inputs(server, players, rng)
+        started = time.perf_counter()
+        server.tick()
+        elapsed += time.perf_counter() - started
+    per_tick = elapsed / ticks
+    sent = sum(p.connection.sent for p in players)
+    room = next(iter(server.rooms.values()))
+    print(f"{rooms} rooms x {MAX_PLAYERS} players: {per_tick * 1000:.2f} ms/tick "
+          f"({per_tick / rooms * 1e6:.1f} µs/room), {sent / ticks / 1024:.0f} KiB sent/tick")
+    print(f"  per room: {room.metrics()}")
+    return per_tick / rooms
+
+
+async def run_loop(rooms, seconds=3, seed=1):
+    rng = random.Random(seed)
+    server, players = build(rooms)
+    first_tick = server.tick_count
+    loop_task = asyncio.ensure_future(server.tick_forever())
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        feed_inputs(server, players, rng)
+        await asyncio.sleep(TICK)
+    loop_task.cancel()
+    metrics = server.metrics()
+    print(f"fixed-step loop with {rooms} rooms for {seconds}s: {metrics['ticks'] - first_tick} ticks, "
+          f"{metrics['tick_overruns']} overruns, tick p99 {metrics['tick_ms_p99']} ms, "
+          f"max {metrics['tick_ms_max']} ms")
+
+
+class DelayedAckClient:
+    """受け取ったフレームをブラウザと同じ手順で処理し、受信確認を latency 秒後にサーバーへ届ける接続"""
+
+    def __init__(self, latency):
+        self.closed = False
+        self.delay_ticks = round(2 * latency / TICK)   # 状態が届くまでと、受信確認が戻るまで
+        self.player = None
+        self.snapshots = {}
+        self.last_ack = -1
+        self.ack_every = self.history_ticks = None
+        self.pending_acks = []                         # [(サーバーに届く tick, 確認する tick)]
+        self.deltas = self.lost = 0
+
+    def send_prepared(self, frame, kind='control'):
+        length = frame[1] & 0x7F
+        payload = frame[2 + {126: 2, 127: 8}.get(length, 0):]
+        if frame[0] & 0x0F == 1:
+            message = json.loads(payload)
+            if message['type'] == 'start':
+                self.ack_every = message['ack_every']
+                self.history_ticks = message['history_ticks']
+            return True
+        message = protocol.decode(payload)
+        if message['type'] == 'delta':
+            self.deltas += 1
+            base = self.snapshots.get(message['base'])
+            if base is None:
+                self.lost += 1
+                return True
+            players = protocol.apply_delta(base, message['changes'])
+        else:
+            players = {slot: list(fields) for slot, *fields in message['players']}
+        self._store(message['tick'], players)
+        return True
+
+    def _store(self, tick, players):
+        self.snapshots[tick] = players
+        if tick - self.last_ack >= self.ack_every:
+            self.pending_acks.append((tick + self.delay_ticks, tick))
+            self.last_ack = tick
+            for old in [t for t in self.snapshots if t < tick - self.history_ticks]:
+                del self.snapshots[old]
+
+    def deliver(self, now):
+        while self.pending_acks and self.pending_acks[0][0] <= now:
+            _, tick = self.pending_acks.pop(0)
+            if self.player.room is not None:
+                self.player.room.ack(self.player, tick)
+
+
+def delayed_acks(latency, seed=1):
+    """受信確認が遅れて届く1部屋のレースを最後まで進め、捨てた差分の数を数える"""
+    rng = random.Random(seed)
+    server = ColorRaceServer(spectator_delay=0)
+    clients = []
+    for p in range(MAX_PLAYERS):
+        client = DelayedAckClient(latency)
+        client.player = RacePlayer(client, f"bot{p}")
+        server.join(client.player)
+        clients.append(client)
+    room = clients[0].player.room
+    chance = TICK / color_race.COLOR_ANSWER_DELAY
+    while room.room_id in server.rooms:
+        for client in clients:
+            client.deliver(server.tick_count)
+            if client.player.room is room and rng.random() < chance:
+                room.answer(client.player, client.player.index, rng.random() < 0.5)
+        server.tick()
+    deltas = sum(c.deltas for c in clients)
+    lost = sum(c.lost for c in clients)
+    print(f"ack latency {latency * 1000:4.0f} ms one way: {lost}/{deltas} deltas without a base")
+    assert lost == 0
+
+
+if __name__ == '__main__':
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    per_room = measure(rooms)
+    capacity = int(TICK / 2 / per_room)
+    print(f"estimated capacity (half of each tick): {capacity} rooms ({capacity * MAX_PLAYERS} players) "
+          f"per core at {color_race.TICK_RATE} ticks/s")
+    asyncio.run(run_loop(capacity))
+    for latency in (0.2, 0.3, 0.5, 1.0):
+        delayed_acks(latency)
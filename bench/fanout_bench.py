@@ -0,0 +1,126 @@
+"""遅いクライアントが混ざったブロードキャストのベンチマーク
+
+ゲートウェイにテスト用のパスを足し、全接続へ一定間隔で状態（coalesce）とチャット（drop_oldest）、
+ときどき捨てられない通知を送る。受信するクライアントの中に、まったく読まない接続を1本混ぜ、
+  - 速いクライアントの受信数が落ちないか
+  - 1回のブロードキャストにかかる時間が伸びないか
+  - 遅い接続のキューが間引かれ、--lag 秒後に切断されるか
+を確かめる。--no-queue では送信キューを使わない場合（送信バッファが際限なく伸びる）と比べる。
+
+使い方: python bench/fanout_bench.py [--clients 接続数] [--duration 秒] [--lag 秒] [--no-queue]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ws
+from game_gateway import Gateway
+
+RATE = 20                      # 1秒あたりのブロードキャスト回数
+STATE = ws.prepare(b'\x01' * 4096)
+CHAT = ws.prepare(json.dumps({'type': 'chat', 'text': 'x' * 200}))
+NOTICE = ws.prepare(json.dumps({'type': 'notice'}))
+
+
+async def reader(connection, counts, index):
+    try:
+        async for _ in connection:
+            counts[index] += 1
+    except ws.ConnectionClosed:
+        pass
+
+
+async def run(clients, duration, lag, use_queue):
+    gateway = Gateway()
+    gateway.max_lag = lag
+    members = set()
+
+    @gateway.route('/bench')
+    async def handle(connection, player):
+        if not use_queue:
+            connection.outbox = None
+        members.add(connection)
+        try:
+            async for _ in connection:
+                pass
+        finally:
+            members.discard(connection)
+
+    server = await gateway.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    fast = [await ws.connect('127.0.0.1', port, '/bench') for _ in range(clients)]
+    slow = await ws.connect('127.0.0.1', port, '/bench')   # 受信しない
+    while len(members) < clients + 1:
+        await asyncio.sleep(0.01)
+    slow_server_side = next(c for c in members if c.writer.get_extra_info('peername') ==
+                            slow.writer.get_extra_info('sockname'))
+    # 受信を止め、途中の経路（カーネルのソケットバッファ、数 MB）を先に埋めておく。
+    # これで計測の最初から「回線が詰まった端末」と同じ状態になる
+    slow.writer.transport.pause_reading()
+    filler = ws.prepare(b'\0' * 60000)
+    transport = slow_server_side.writer.transport
+    while transport.get_write_buffer_size() == 0:
+        transport.write(filler)
+        await asyncio.sleep(0.001)
+
+    counts = [0] * clients
+    readers = [asyncio.ensure_future(reader(c, counts, i)) for i, c in enumerate(fast)]
+
+    broadcast_times = []
+    slow_disconnected = None
+    peak_buffer = 0
+    started = time.monotonic()
+    sent = 0
+    while time.monotonic() - started < duration:
+        tick_started = time.perf_counter()
+        for connection in list(members):
+            connection.send_prepared(STATE, 'race_state')
+            connection.send_prepared(CHAT, 'chat')
+            if sent % RATE == 0:
+                connection.send_prepared(NOTICE)
+        broadcast_times.append(time.perf_counter() - tick_started)
+        sent += 1
+        if slow_disconnected is None and slow_server_side not in members:
+            slow_disconnected = time.monotonic() - started
+        peak_buffer = max(peak_buffer, slow_server_side.writer.transport.get_write_buffer_size())
+        await asyncio.sleep(1 / RATE)
+    elapsed = time.monotonic() - started
+
+    await asyncio.sleep(0.5)
+    for connection in fast + [slow]:
+        connection.writer.close()
+    await asyncio.gather(*readers)
+    server.close()
+    while members:
+        await asyncio.sleep(0.01)
+
+    # 1ブロードキャストで 2 + (通知) メッセージ届くはず
+    expected = sent * 2 + (sent + RATE - 1) // RATE
+    times = sorted(broadcast_times)
+    print(f"{'send queue' if use_queue else 'no queue'}: {clients} fast clients + 1 stalled client, "
+          f"{sent} broadcasts in {elapsed:.1f}s")
+    print(f"  fast clients received {min(counts)}..{max(counts)} of {expected} messages "
+          f"(median {statistics.median(counts):.0f})")
+    print(f"  broadcast time p50 {times[len(times) // 2] * 1000:.2f} ms, "
+          f"p99 {times[int(len(times) * 0.99)] * 1000:.2f} ms, max {times[-1] * 1000:.2f} ms")
+    print(f"  stalled client: transport buffer peak {peak_buffer / 1024:.0f} KiB, "
+          + (f"disconnected after {slow_disconnected:.1f}s" if slow_disconnected is not None
+             else "still connected"))
+    print(f"  gateway: {gateway.metrics()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=8)
+    parser.add_argument('--lag', type=float, default=3)
+    parser.add_argument('--no-queue', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(run(args.clients, args.duration, args.lag, not args.no_queue))
@@ -0,0 +1,41 @@
+"""サーバー側ゲームセッションのメモリ使用量ベンチマーク
+
+使い方: python bench/game_sessions_bench.py [同時セッション数]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from game_sessions import GameSessionStore, NumberSession, MemorySession, memory_layout
+
+
+def run(sessions=500_000):
+    store = GameSessionStore(ttl=600)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for i in range(sessions):
+        store.create(MemorySession if i % 2 else NumberSession, f"player{i % 1000}")
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print(f"{sessions} sessions: {used / 2**20:.1f} MiB ({used / sessions:.0f} bytes/session), "
+          f"created in {elapsed:.2f}s")
+
+    # 盤面はシードだけから再現できる
+    session_id, game = store.create(MemorySession, None, seed=12345)
+    assert game.layout == memory_layout(12345)
+
+    for game in list(store._sessions.values()):
+        game.expires = 0
+    started = time.perf_counter()
+    removed = store.evict_expired()
+    print(f"evicted {removed} expired sessions in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    run(*[int(a) for a in sys.argv[1:2]])
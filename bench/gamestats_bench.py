@@ -0,0 +1,166 @@
+"""ゲーム結果の列ストアのベンチマーク
+
+1. --compare 行の結果を、行ごとの dict のリストで集計した場合と列ストアで集計した場合で比べ、結果が一致するかを確かめる。
+2. --rows 行（既定は1億行）のリアクションの結果を列ストアに書き込み、次の時間を測る。
+   - 書き込み（まとめて追加と、1行ずつの record()）
+   - 全期間の集計: 1回目（確定済みの CHUNK をすべて集計してキャッシュする）と2回目以降（最後の未確定の部分だけ）
+   - 直近24時間の集計（bisect で開始位置を求めて、その後ろだけ）
+   - 1人のプレイヤーの集計（プレイヤーの列から番号をバイト列として探す）
+3. --answers 行のクイズの回答から、問題ごとの正解率を求める。
+
+使い方: python bench/gamestats_bench.py [--rows 行数] [--answers 行数] [--compare 行数]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gamestats import GameStats, histogram
+
+BLOCK = 1_000_000
+START = 1_700_000_000
+PLAYERS = 100_000
+
+
+def pools(seed=1):
+    """1ブロック分の乱数（ブロックごとにずらして使い回す）"""
+    rng = random.Random(seed)
+    scores = array('i', (max(100, int(rng.gauss(280, 60))) for _ in range(BLOCK)))
+    players = array('I', (rng.randrange(PLAYERS) for _ in range(BLOCK)))
+    return scores, players
+
+
+def blocks(rows, scores, players):
+    """1秒に1行ずつの時刻と、ずらしたスコア・プレイヤーの列を BLOCK 行ずつ返す"""
+    for offset in range(0, rows, BLOCK):
+        count = min(BLOCK, rows - offset)
+        shift = offset // BLOCK * 7919 % BLOCK
+        yield (array('I', range(START + offset, START + offset + count)),
+               (players[shift:] + players[:shift])[:count],
+               (scores[shift:] + scores[:shift])[:count])
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def compare(directory, rows, scores, players):
+    """行ごとの dict と列ストアで同じ集計をして、結果と時間を比べる"""
+    dicts = [{'time': t, 'player': p, 'score': s}
+             for block in blocks(rows, scores, players) for t, p, s in zip(*block)]
+    stats = GameStats(directory, ['reaction'])
+    for block in blocks(rows, scores, players):
+        stats.tables['reaction'].extend(block)
+
+    def row_wise():
+        values = sorted(row['score'] for row in dicts)
+        count = len(values)
+        hours = {}
+        for row in dicts:
+            hour = time.localtime(row['time']).tm_hour
+            seen = hours.get(hour, (0, 0))
+            hours[hour] = (seen[0] + 1, seen[1] + row['score'])
+        return {
+            'mean': statistics.fmean(values),
+            'percentiles': {str(p): values[max(1, -(-p * count // 100)) - 1] for p in (50, 90, 99)},
+            'histogram': histogram(Counter(values), 20)['counts'],
+            'by_hour': {hour: score_sum / n for hour, (n, score_sum) in hours.items()},
+        }
+
+    def columnar():
+        summary = stats.summary('reaction')
+        return {
+            'mean': summary['mean'],
+            'percentiles': summary['percentiles'],
+            'histogram': stats.histogram('reaction', 20)['counts'],
+            'by_hour': {entry['hour']: entry['mean'] for entry in stats.by_hour('reaction') if entry['count']},
+        }
+
+    expected, row_time = timed(row_wise)
+    actual, column_time = timed(columnar)
+    assert expected['percentiles'] == actual['percentiles'] and expected['histogram'] == actual['histogram']
+    assert abs(expected['mean'] - actual['mean']) < 1e-6
+    assert all(abs(expected['by_hour'][hour] - actual['by_hour'][hour]) < 1e-6 for hour in expected['by_hour'])
+    print(f"{rows:,} rows: row-wise dicts {row_time:.2f}s, columns {column_time:.2f}s "
+          f"({row_time / column_time:.1f}x), results match")
+    stats.close()
+
+
+def scale(directory, rows, scores, players):
+    stats = GameStats(directory, ['reaction'])
+    table = stats.tables['reaction']
+    started = time.perf_counter()
+    for block in blocks(rows, scores, players):
+        table.extend(block)
+    table.flush()
+    elapsed = time.perf_counter() - started
+    print(f"wrote {rows:,} rows ({stats.metrics()['bytes'] / 2 ** 30:.2f} GiB mapped) in {elapsed:.1f}s "
+          f"({rows / elapsed / 1e6:.1f}M rows/s)")
+
+    now = table.last_time
+    count = 100_000
+    _, elapsed = timed(lambda: [stats.record('reaction', f"user{i % 1000}", 250, now=now) for i in range(count)])
+    print(f"record(): {elapsed / count * 1e6:.2f} µs/row")
+
+    summary, cold = timed(stats.summary, 'reaction')
+    _, warm = timed(stats.summary, 'reaction')
+    _, hist = timed(stats.histogram, 'reaction', 50)
+    hours, by_hour = timed(stats.by_hour, 'reaction')
+    print(f"all time ({summary['count']:,} rows): first query {cold:.2f}s (builds the chunk cache), "
+          f"then summary {warm * 1000:.1f} ms, histogram {hist * 1000:.1f} ms, by hour {by_hour * 1000:.1f} ms")
+    print(f"  mean {summary['mean']:.1f} ms, percentiles {summary['percentiles']}, "
+          f"busiest hour {max(hours, key=lambda entry: entry['count'])['hour']}")
+
+    window, elapsed = timed(stats.summary, 'reaction', now - 86400)
+    print(f"last 24 hours ({window['count']:,} rows): {elapsed * 1000:.1f} ms")
+
+    player, elapsed = timed(stats.player_summary, 'reaction', 'user7')
+    print(f"one player ({player['count']:,} rows): {elapsed:.2f}s")
+    stats.close()
+
+
+def answers(directory, rows, seed=2):
+    rng = random.Random(seed)
+    questions = array('I', (rng.randrange(500) for _ in range(BLOCK)))
+    correct = array('B', (rng.random() < 0.3 + questions[i] % 5 / 10 for i in range(BLOCK)))
+    stats = GameStats(directory, [])
+    for offset in range(0, rows, BLOCK):
+        count = min(BLOCK, rows - offset)
+        stats.answers.extend((array('I', range(START + offset, START + offset + count)),
+                              questions[:count], correct[:count]))
+    accuracy, cold = timed(stats.quiz_accuracy)
+    _, warm = timed(stats.quiz_accuracy)
+    hardest = min(accuracy, key=lambda entry: entry['accuracy'])
+    print(f"quiz accuracy over {rows:,} answers: first query {cold:.2f}s, then {warm * 1000:.1f} ms "
+          f"({len(accuracy)} questions, hardest {hardest['question']} at {hardest['accuracy']:.1%})")
+    stats.close()
+
+
+def main(rows, answer_rows, compare_rows):
+    scores, players = pools()
+    directory = tempfile.mkdtemp(prefix='gamestats_bench_')
+    try:
+        compare(os.path.join(directory, 'compare'), compare_rows, scores, players)
+        scale(os.path.join(directory, 'scale'), rows, scores, players)
+        answers(os.path.join(directory, 'answers'), answer_rows)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ゲーム結果の列ストアのベンチマーク')
+    parser.add_argument('--rows', type=int, default=100_000_000)
+    parser.add_argument('--answers', type=int, default=10_000_000)
+    parser.add_argument('--compare', type=int, default=1_000_000)
+    args = parser.parse_args()
+    main(args.rows, args.answers, args.compare)
@@ -0,0 +1,51 @@
+"""ランキング（順序統計付きスキップリスト）のベンチマーク
+
+使い方: python bench/leaderboard_bench.py [プレイヤー数]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from leaderboard import Leaderboard
+
+
+def timed(label, count, func):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {count:>9} ops  {elapsed:8.2f}s  {elapsed / count * 1e6:8.2f} us/op")
+
+
+def run(players=1_000_000, queries=100_000):
+    random.seed(1)
+    board = Leaderboard(higher_is_better=True)
+    names = [f"player{i}" for i in range(players)]
+
+    def insert_all():
+        for name in names:
+            board.submit(name, random.randrange(1_000_000))
+
+    def improve_scores():
+        for name in random.sample(names, queries):
+            board.submit(name, random.randrange(1_000_000, 2_000_000))
+
+    def rank_queries():
+        for name in random.sample(names, queries):
+            board.rank(name)
+
+    def top_queries():
+        for _ in range(queries // 10):
+            board.top(100)
+
+    timed("insert", players, insert_all)
+    timed("submit (best improved)", queries, improve_scores)
+    timed("rank of player", queries, rank_queries)
+    timed("top 100", queries // 10, top_queries)
+    assert len(board) == players
+
+
+if __name__ == '__main__':
+    run(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,82 @@
+"""対戦待ちキューのベンチマーク
+
+待機人数を変えながら1回の参加にかかる時間を測り、待ち時間に応じた範囲の拡大で
+全員が組み合わさるまでの時間（シミュレーション上の秒数）を表示する。
+
+使い方: python bench/matchmaking_bench.py [最大待機人数]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from matchmaking import Matchmaker
+from ratings import RatingBook
+
+
+def enqueue_cost(waiting, trials=20000):
+    """waiting 人が待っている（互いに組み合わない）状態での1回の参加の平均時間"""
+    matchmaker = Matchmaker(window=0, widen_per_second=0, max_window=0)
+    rng = random.Random(1)
+    for i in range(waiting):
+        # 整数のレーティングを重複なく並べ、範囲0では誰とも組み合わないようにする
+        matchmaker.enqueue(('waiting', i), i * 0.5 + rng.random() * 0.1, now=0)
+    started = time.perf_counter()
+    for i in range(trials):
+        pair = matchmaker.enqueue(('probe', i), rng.uniform(0, waiting * 0.5), now=0)
+        if pair is None:
+            matchmaker.cancel(('probe', i))
+    return (time.perf_counter() - started) / trials
+
+
+def simulate(players=10000, arrivals_per_second=200, seed=1):
+    """レーティングが正規分布する players 人が順に参加したときの待ち時間"""
+    rng = random.Random(seed)
+    matchmaker = Matchmaker()
+    now = 0.0
+    gaps = []
+    for i in range(players):
+        now += rng.expovariate(arrivals_per_second)
+        pair = matchmaker.enqueue(i, rng.gauss(1500, 300), now=now)
+        if pair:
+            gaps.append(abs(pair[0].rating - pair[1].rating))
+        for first, second in matchmaker.sweep(now=now):
+            gaps.append(abs(first.rating - second.rating))
+    # 範囲が最大まで広がるのを待って残りを組み合わせる
+    for _ in range(int(matchmaker.max_window / matchmaker.widen_per_second) + 1):
+        now += 1
+        for first, second in matchmaker.sweep(now=now):
+            gaps.append(abs(first.rating - second.rating))
+    gaps.sort()
+    metrics = matchmaker.metrics()
+    print(f"{players} players at {arrivals_per_second}/s: {metrics['matched']} matches "
+          f"({len(matchmaker)} left unmatched), "
+          f"median wait {metrics['median_time_to_match']}s, "
+          f"rating gap median {gaps[len(gaps) // 2]:.0f} / p99 {gaps[int(len(gaps) * 0.99)]:.0f}")
+
+
+def rating_sanity(games=2000, seed=1):
+    """強さの違うプレイヤー同士を対戦させ、レーティングの順位が強さの順になるか確かめる"""
+    rng = random.Random(seed)
+    book = RatingBook()
+    strength = {f"p{i}": i for i in range(10)}
+    players = list(strength)
+    for _ in range(games):
+        a, b = rng.sample(players, 2)
+        p_a = 1 / (1 + 10 ** ((strength[b] - strength[a]) * 40 / 400))
+        book.record(a, b, 1.0 if rng.random() < p_a else 0.0)
+    ranked = sorted(players, key=lambda p: book.get(p).rating)
+    print("rating order (weakest first):", ' '.join(ranked))
+    print("ratings:", ' '.join(f"{book.get(p).rating:.0f}±{book.get(p).rd:.0f}" for p in ranked))
+
+
+if __name__ == '__main__':
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    size = 1000
+    while size <= limit:
+        print(f"{size:>9} waiting: {enqueue_cost(size) * 1e6:.2f} µs/enqueue")
+        size *= 10
+    simulate()
+    rating_sanity()
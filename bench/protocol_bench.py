@@ -0,0 +1,75 @@
+"""バイナリメッセージ形式と JSON の比較ベンチマーク
+
+8人部屋の状態メッセージと回答メッセージについて、1件あたりのバイト数と
+エンコード・デコードの速度を比べる。JSON はプレイヤー名入り（以前の形式）とスロット番号入りの2通り。
+
+使い方: python bench/protocol_bench.py [件数]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+
+
+def sample_players(rng, count=8):
+    return [(slot, rng.randint(0, 400), rng.randint(0, 20), rng.randint(0, 37)) for slot in range(count)]
+
+
+def throughput(func, items):
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    return len(items) / (time.perf_counter() - started)
+
+
+def compare(name, formats, messages):
+    print(name)
+    for label, (encode, decode) in formats.items():
+        encoded = [encode(m) for m in messages]
+        size = sum(len(e) for e in encoded) / len(encoded)
+        encode_rate = throughput(encode, messages)
+        decode_rate = throughput(decode, encoded)
+        print(f"  {label:<14} {size:6.1f} bytes  encode {encode_rate / 1000:7.0f}k/s  "
+              f"decode {decode_rate / 1000:7.0f}k/s")
+
+
+def json_encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def run(count=200_000, seed=1):
+    rng = random.Random(seed)
+    states = [(rng.randint(0, 10**6), 'racing', rng.randint(0, 300) / 10, sample_players(rng))
+              for _ in range(count)]
+    names = [f"user_{i:03d}" for i in range(8)]
+
+    compare('state message (8 players)', {
+        'json (names)': (lambda s: json_encode({
+            'type': 'state', 'tick': s[0], 'state': s[1], 'remaining': s[2],
+            'players': [[names[p[0]], p[1], p[2], p[3]] for p in s[3]]}), json.loads),
+        'json (slots)': (lambda s: json_encode({
+            'type': 'state', 'tick': s[0], 'state': s[1], 'remaining': s[2], 'players': s[3]}), json.loads),
+        'binary': (lambda s: protocol.encode_state(*s), protocol.decode),
+    }, states)
+
+    answers = [(rng.randint(0, 37), rng.random() < 0.5) for _ in range(count)]
+    compare('answer message', {
+        'json': (lambda a: json_encode({'type': 'answer', 'item': a[0], 'match': a[1]}), json.loads),
+        'binary': (lambda a: protocol.encode_answer(*a), protocol.decode),
+    }, answers)
+
+    # 往復して同じ内容に戻ること
+    for tick, state, remaining, players in states[:1000]:
+        decoded = protocol.decode(protocol.encode_state(tick, state, remaining, players))
+        assert decoded['tick'] == tick and decoded['state'] == state
+        assert decoded['players'] == [list(p) for p in players]
+    assert protocol.decode(protocol.encode_answer(300, True)) == {'type': 'answer', 'item': 300, 'match': True}
+
+
+if __name__ == '__main__':
+    run(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,79 @@
+"""クイズの問題バンクのベンチマーク
+
+1. data/quiz_questions.json（数千問）を読み込む時間と、カテゴリ・難易度で候補を引く時間を測る。
+2. --users 人に --rounds 回ずつ10問を配り、1回の draw() の時間と、出題済みビットマップが使うメモリを測る。
+3. 1人に同じ条件で配り続けて、条件に合う問題を出し尽くすまで同じ問題が出ないことと、
+   同じ seed なら同じ出題になることを確かめる。
+
+使い方: python bench/quiz_bench.py [--users 人数] [--rounds 回数]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from quiz import QuestionBank, QuestionDealer
+
+BANK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'quiz_questions.json')
+
+
+def load():
+    started = time.perf_counter()
+    bank = QuestionBank.load(BANK_PATH)
+    elapsed = time.perf_counter() - started
+    sizes = {(category, difficulty): len(bank.candidates(category, difficulty))
+             for category in bank.categories for difficulty in (1, 2, 3)}
+    started = time.perf_counter()
+    for _ in range(100):
+        bank.candidates()
+        bank.candidates(bank.categories[0], 2)
+    lookup = (time.perf_counter() - started) / 200
+    print(f"loaded {len(bank)} questions in {elapsed * 1000:.1f} ms; candidates() {lookup * 1e6:.0f} µs")
+    print(f"  smallest category/difficulty {min(sizes.items(), key=lambda item: item[1])}, "
+          f"largest {max(sizes.items(), key=lambda item: item[1])}")
+    return bank
+
+
+def deal(bank, users, rounds):
+    dealer = QuestionDealer(bank, max_users=users)
+    started = time.perf_counter()
+    for round_number in range(rounds):
+        for user in range(users):
+            dealer.draw(f"user{user}", 10, user * rounds + round_number)
+    elapsed = time.perf_counter() - started
+    # メモリは別のディーラーで測る（tracemalloc は時間の計測を遅くする）
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    other = QuestionDealer(bank, max_users=users)
+    for user in range(users):
+        other.draw(f"user{user}", 10, user)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{users} users x {rounds} rounds of 10: {elapsed / (users * rounds) * 1e6:.0f} µs/draw, "
+          f"{used / users:.0f} bytes/user for the seen bitmaps ({len(dealer)} users kept)")
+
+
+def no_repeats(bank):
+    dealer = QuestionDealer(bank)
+    for category in bank.categories:
+        candidates = bank.candidates(category, 2)
+        seen = set()
+        for seed in range(len(candidates) // 10):
+            chosen = dealer.draw('player', 10, seed, category, 2)
+            assert not seen.intersection(chosen), (category, seed)
+            seen.update(chosen)
+        print(f"  {category}/2: {len(seen)} of {len(candidates)} questions dealt without a repeat")
+    assert QuestionDealer(bank).draw('a', 10, 7) == QuestionDealer(bank).draw('b', 10, 7)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='クイズの問題バンクのベンチマーク')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    bank = load()
+    deal(bank, args.users, args.rounds)
+    no_repeats(bank)
@@ -0,0 +1,146 @@
+"""リプレイ記録のベンチマーク
+
+1. カラーレース: ボットで満員の部屋を最後まで進め、記録ありとなしで1ティックの処理時間を比べる。
+2. じゃんけん: ボット同士の試合を記録する（切断も混ぜる）。
+3. 書き込んだファイルを読み直し、全試合をゲームのロジックで再生して結果が一致するかと、
+   実際の試合時間に対して何倍速で再生できたかを表示する。
+
+使い方: python bench/replay_bench.py [--races 部屋数] [--matches 試合数] [--max-bytes ファイルの上限]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import replay
+from color_race import ColorRaceServer, RacePlayer, MAX_PLAYERS, TICK, MIN_ANSWER_TICKS
+from rps import RPSMatch, RPSPlayer, MOVES, ROUND_TIME
+
+
+class NullConnection:
+    closed = False
+
+    def send_prepared(self, frame, kind='control'):
+        return True
+
+
+def run_races(races, recorder, seed):
+    """races 部屋分のレースを最後まで進め、ティックの処理時間の合計とティック数を返す"""
+    rng = random.Random(seed)
+    server = ColorRaceServer(spectator_delay=0, recorder=recorder)
+    elapsed = 0.0
+    ticks = 0
+    for _ in range(races):
+        players = [RacePlayer(NullConnection(), f"bot{p}") for p in range(MAX_PLAYERS)]
+        for player in players:
+            server.join(player)
+        room = players[0].room
+        while room.room_id in server.rooms:
+            for player in players:
+                if player.room is room and rng.random() < 1.5 / MIN_ANSWER_TICKS:
+                    # 正解・不正解・古い問題への回答・途中で抜けるプレイヤーを混ぜる
+                    item = player.index - (rng.random() < 0.05)
+                    room.answer(player, item, rng.random() < 0.6)
+                if player.room is room and room.state == 'racing' and rng.random() < 0.0005:
+                    room.leave(player)
+            started = time.perf_counter()
+            server.tick()
+            elapsed += time.perf_counter() - started
+            ticks += 1
+    return elapsed, ticks
+
+
+class BotConnection:
+    """RPSMatch からのメッセージに、すぐに手を返すだけの接続"""
+
+    closed = False
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.player = None
+
+    async def send(self, text):
+        message = json.loads(text)
+        if message['type'] == 'round':
+            match = self.player.match
+            if self.rng.random() < 0.02:
+                asyncio.get_running_loop().call_soon(match.leave, self.player)
+            else:
+                asyncio.get_running_loop().call_soon(match.play, self.player, self.rng.choice(MOVES))
+
+
+async def run_matches(matches, recorder, seed):
+    rng = random.Random(seed)
+    rounds = 0
+
+    async def one(match_id):
+        nonlocal rounds
+        players = []
+        for p in range(2):
+            connection = BotConnection(rng)
+            player = connection.player = RPSPlayer(connection, f"bot{match_id}_{p}")
+            player.rating = 1500
+            players.append(player)
+        match = RPSMatch(match_id, players, lambda match, winner: None, recorder)
+        for player in players:
+            player.match = match
+        await match.run()
+        rounds += match.round
+
+    await asyncio.gather(*(one(m) for m in range(matches)))
+    return rounds
+
+
+def main(races, matches, max_bytes):
+    directory = tempfile.mkdtemp(prefix='replay_bench_')
+    recorder = replay.ReplayWriter(directory, max_bytes=max_bytes, max_files=10_000)
+
+    plain, ticks = run_races(races, None, seed=1)
+    recorded, _ = run_races(races, recorder, seed=1)
+    print(f"color race: {races} rooms x {MAX_PLAYERS} players, {ticks} ticks")
+    print(f"  tick without recording {plain / ticks * 1e6:7.1f} µs, with recording {recorded / ticks * 1e6:7.1f} µs "
+          f"({(recorded - plain) / ticks * 1e6:+.1f} µs/tick)")
+
+    started = time.perf_counter()
+    rounds = asyncio.run(run_matches(matches, recorder, seed=2))
+    print(f"rps: {matches} matches, {rounds} rounds in {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    recorder.close()
+    metrics = recorder.metrics()
+    print(f"writer: {metrics['blocks_written']} replays, {metrics['bytes_written'] / 1024:.0f} KiB in "
+          f"{metrics['files']} files ({metrics['rotations']} rotations), "
+          f"{metrics['bytes_written'] / metrics['blocks_written']:.0f} bytes/replay, "
+          f"final flush {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    totals = {}
+    for path in replay.replay_files(directory):
+        for record in replay.iter_file(path):
+            started = time.perf_counter()
+            outcome = replay.run(record)
+            elapsed = time.perf_counter() - started
+            name = replay.GAME_NAMES[record.game]
+            count, ok, spent, real = totals.get(name, (0, 0, 0.0, 0.0))
+            # 実際の試合時間: カラーレースはティック数、じゃんけんは1ラウンドを制限時間の半分として見積もる
+            duration = outcome['ticks'] * TICK if 'ticks' in outcome else outcome['rounds'] * ROUND_TIME / 2
+            totals[name] = (count + 1, ok + outcome['verified'], spent + elapsed, real + duration)
+    for name, (count, ok, spent, real) in totals.items():
+        print(f"replay {name}: {ok}/{count} verified, {spent / count * 1000:.2f} ms/replay, "
+              f"{real / spent:,.0f}x real time")
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='リプレイ記録のベンチマーク')
+    parser.add_argument('--races', type=int, default=50)
+    parser.add_argument('--matches', type=int, default=2000)
+    parser.add_argument('--max-bytes', type=int, default=64 * 1024)
+    args = parser.parse_args()
+    main(args.races, args.matches, args.max_bytes)
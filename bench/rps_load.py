@@ -0,0 +1,129 @@
+"""オンライン対戦じゃんけんの負荷テスト
+
+待機しているだけの接続を大量に張ったまま、ボット同士に対戦を繰り返させる。
+--spawn を付けるとゲートウェイを別プロセスで起動し、そのメモリ使用量も表示する。
+
+使い方: python bench/rps_load.py [--idle 接続数] [--bots ボット数] [--duration 秒] [--spawn]
+（接続数はプロセスのファイルディスクリプタ上限 ulimit -n に収まるようにする）
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import ws
+from rps import MOVES
+
+QUEUE = json.dumps({'type': 'queue'})
+
+
+def rss_mib(pid):
+    """/proc から常駐メモリ量を読む（Linux のみ）"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def open_idle(host, port, count, batch=500):
+    """count 本の接続を batch 本ずつ張る"""
+    connections = []
+    for start in range(0, count, batch):
+        size = min(batch, count - start)
+        opened = await asyncio.gather(*(ws.connect(host, port, '/ws/rps') for _ in range(size)),
+                                      return_exceptions=True)
+        for result in opened:
+            if isinstance(result, Exception):
+                print(f"connect failed: {result!r}")
+            else:
+                connections.append(result)
+    return connections
+
+
+async def bot(host, port, stop, counters):
+    """キューに入り、ラウンドごとにランダムな手を出し、試合が終わったらまたキューに入る"""
+    connection = await ws.connect(host, port, '/ws/rps')
+    await connection.send(QUEUE)
+    round_started = None
+    async for raw in connection:
+        message = json.loads(raw)
+        if message['type'] == 'round':
+            round_started = time.perf_counter()
+            await connection.send(json.dumps({'type': 'move', 'move': random.choice(MOVES)}))
+        elif message['type'] == 'result' and round_started is not None:
+            counters['rounds'] += 1
+            counters['round_time'] += time.perf_counter() - round_started
+        elif message['type'] == 'match_end':
+            counters['matches'] += 1
+            if stop.is_set():
+                break
+            await connection.send(QUEUE)
+    await connection.close()
+
+
+async def run(host, port, idle, bots, duration, server_pid):
+    started = time.perf_counter()
+    connections = await open_idle(host, port, idle)
+    print(f"{len(connections)} idle connections opened in {time.perf_counter() - started:.1f}s")
+    if server_pid:
+        print(f"gateway RSS: {rss_mib(server_pid):.1f} MiB")
+
+    stop = asyncio.Event()
+    counters = {'matches': 0, 'rounds': 0, 'round_time': 0.0}
+    tasks = [asyncio.ensure_future(bot(host, port, stop, counters)) for _ in range(bots)]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.wait(tasks, timeout=15)
+
+    # 1試合を両方のボットが数えるので2で割る
+    matches = counters['matches'] // 2
+    rounds = counters['rounds'] // 2
+    print(f"{bots} bots: {matches} matches ({matches / duration:.1f}/s), {rounds} rounds, "
+          f"mean round latency {counters['round_time'] / max(counters['rounds'], 1) * 1000:.2f}ms")
+    if server_pid:
+        print(f"gateway RSS: {rss_mib(server_pid):.1f} MiB "
+              f"({len(connections) + bots} connections)")
+
+    alive = sum(1 for c in connections if not c.closed)
+    print(f"{alive}/{len(connections)} idle connections still open")
+    for connection in connections:
+        connection.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='オンライン対戦じゃんけんの負荷テスト')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--idle', type=int, default=20000)
+    parser.add_argument('--bots', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--spawn', action='store_true', help='ゲートウェイを別プロセスで起動する')
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'game_gateway.py'),
+                                   '--host', args.host, '--port', str(args.port)])
+        time.sleep(1)
+    try:
+        asyncio.run(run(args.host, args.port, args.idle, args.bots, args.duration,
+                        server.pid if server else None))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""観戦配信のベンチマーク（1部屋を大勢で観戦する）
+
+1. ネットワークなし: 満員の部屋に観戦者を N 人付け、1ティックの処理時間を測る。
+   フレームを1回だけ作って全員に書く方式と、観戦者ごとにエンコードし直す方式を比べる。
+2. --spawn: ゲートウェイを別プロセスで起動し、ボット2人の対戦を N 本の実際の接続で観戦する。
+   観戦側は受信したバイト数を数えるだけの軽いクライアント（selectors）で、
+   ゲートウェイのプロセスが使った CPU 時間を /proc から読み、1コアのうち何割かを表示する。
+
+使い方: python bench/spectator_bench.py [--spectators 人数] [--spawn] [--port ポート]
+（--spawn では接続数の2倍がファイルディスクリプタ上限 ulimit -n に収まるよう、プロセスを分けて計る）
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import protocol
+import ws
+from color_race import (ColorRaceServer, RacePlayer, MAX_PLAYERS, TICK, TICK_RATE, COUNTDOWN_TICKS,
+                        SPECTATOR_EVERY_TICKS)
+
+
+class CountingConnection:
+    """送信したバイト数だけ数える接続"""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = 0
+
+    def send_prepared(self, frame, kind='control'):
+        self.sent += len(frame)
+        return True
+
+
+def measure(spectators, ticks=100, seed=1):
+    rng = random.Random(seed)
+    server = ColorRaceServer(spectator_delay=1)
+    players = [RacePlayer(CountingConnection(), f"bot{p}") for p in range(MAX_PLAYERS)]
+    for player in players:
+        server.join(player)
+    room = players[0].room
+    viewers = [CountingConnection() for _ in range(spectators)]
+    for viewer in viewers:
+        room.feed.add(viewer)
+    for _ in range(COUNTDOWN_TICKS + 1):
+        server.tick()
+
+    elapsed = 0.0
+    for _ in range(ticks):
+        for player in players:
+            if rng.random() < 0.15:
+                room.answer(player, player.index, rng.random() < 0.5)
+        started = time.perf_counter()
+        server.tick()
+        elapsed += time.perf_counter() - started
+    shared = elapsed / ticks
+
+    # 比較: 観戦者ごとに状態をエンコードし直す（同じ SPECTATOR_EVERY_TICKS ごとに送るとして1ティックあたり）
+    current = room._snapshot()
+    fields = [(slot, *f) for slot, f in enumerate(current) if f is not None]
+    started = time.perf_counter()
+    for _ in range(10):
+        for viewer in viewers:
+            viewer.send_prepared(ws.prepare(protocol.encode_state(0, 'racing', 10.0, fields)), 'race_state')
+    per_viewer = (time.perf_counter() - started) / 10 / SPECTATOR_EVERY_TICKS
+
+    print(f"1 room, {MAX_PLAYERS} players, {spectators} spectators (no network):")
+    print(f"  shared frame:        {shared * 1000:7.2f} ms/tick ({shared / TICK * 100:.1f}% of a tick)")
+    print(f"  re-encode per viewer: {per_viewer * 1000:7.2f} ms/tick ({per_viewer / TICK * 100:.1f}% of a tick)")
+    print(f"  spectator bytes per frame: {room.feed.bytes_sent / room.feed.frames_sent / 1024:.0f} KiB")
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def run_bots(host, port, done):
+    """ボット2人を別スレッドのイベントループで対戦させる"""
+    async def racer():
+        connection = await ws.connect(host, port, '/ws/color-race')
+        await connection.send(json.dumps({'type': 'join'}))
+        async for raw in connection:
+            if isinstance(raw, bytes):
+                message = protocol.decode(raw)
+                await connection.send(protocol.encode_ack(message['tick']))
+                if random.random() < 0.15:
+                    await connection.send(protocol.encode_answer(0, True))
+            elif json.loads(raw)['type'] == 'finish':
+                break
+        await connection.close()
+
+    async def main():
+        await asyncio.gather(racer(), racer())
+        done.set()
+
+    threading.Thread(target=lambda: asyncio.run(main()), daemon=True).start()
+
+
+def open_spectators(host, port, count, batch=500):
+    """ハンドシェイクを先にまとめて送り、応答はあとで selectors で読む"""
+    sockets = []
+    for start in range(0, count, batch):
+        for _ in range(min(batch, count - start)):
+            sock = socket.create_connection((host, port))
+            key = base64.b64encode(os.urandom(16)).decode()
+            sock.sendall((f"GET /ws/color-race/spectate HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                          "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+            sock.setblocking(False)
+            sockets.append(sock)
+    return sockets
+
+
+def drain(selector, received, interval):
+    """interval 秒ごとに、読めるソケットからまとめて読んでバイト数だけ数える"""
+    time.sleep(interval)
+    for key, _ in selector.select(timeout=0):
+        try:
+            data = key.fileobj.recv(65536)
+        except (BlockingIOError, ConnectionError):
+            continue
+        received[key.data] += len(data)
+
+
+def run_spawned(host, port, spectators, window=10.0):
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'game_gateway.py'),
+                               '--host', host, '--port', str(port), '--spectator-delay', '1'])
+    try:
+        time.sleep(1)
+        done = threading.Event()
+        run_bots(host, port, done)
+        time.sleep(0.5)   # ボットが部屋に入ってから観戦者をつなぐ
+
+        started = time.monotonic()
+        sockets = open_spectators(host, port, spectators)
+        selector = selectors.DefaultSelector()
+        received = [0] * len(sockets)
+        for index, sock in enumerate(sockets):
+            selector.register(sock, selectors.EVENT_READ, index)
+        print(f"{len(sockets)} spectators connected in {time.monotonic() - started:.1f}s")
+
+        # カウントダウンが終わり、遅延分の配信が始まるまで待つ
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            drain(selector, received, 0.25)
+
+        before = list(received)
+        cpu_before = cpu_seconds(server.pid)
+        window_started = time.monotonic()
+        while time.monotonic() - window_started < window and not done.is_set():
+            drain(selector, received, 0.25)
+        elapsed = time.monotonic() - window_started
+        cpu = cpu_seconds(server.pid) - cpu_before
+
+        rates = sorted((r - b) / elapsed for r, b in zip(received, before))
+        ticks = elapsed * TICK_RATE
+        print(f"over {elapsed:.1f}s of racing: gateway CPU {cpu / elapsed * 100:.1f}% of one core, "
+              f"{cpu / ticks * 1000:.2f} ms per tick ({cpu / ticks / TICK * 100:.1f}% of a tick; "
+              f"budget is half of each tick)")
+        print(f"  per spectator: min {rates[0]:.0f} B/s, median {rates[len(rates) // 2]:.0f} B/s, "
+              f"{sum(1 for r in rates if r == 0)} received nothing")
+        for sock in sockets:
+            sock.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='観戦配信のベンチマーク')
+    parser.add_argument('--spectators', type=int, default=10000)
+    parser.add_argument('--spawn', action='store_true', help='ゲートウェイを別プロセスで起動して実際の接続で計る')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5011)
+    args = parser.parse_args()
+    measure(args.spectators)
+    if args.spawn:
+        run_spawned(args.host, args.port, args.spectators)
@@ -0,0 +1,57 @@
+"""state.py の同時更新ストレステスト
+
+多数のスレッドから同時に更新し、更新が1件も失われないことを確認する。
+使い方: python bench/stress_state.py [スレッド数] [スレッドあたりの操作数]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from state import AtomicCounter, StripedDict, UserStore, SettingsStore
+
+
+def run(threads=64, ops=5000):
+    counter = AtomicCounter()
+    hits = StripedDict()
+    users = UserStore()
+    settings = SettingsStore({'a': 0, 'b': 0})
+    torn_reads = []
+    start_barrier = threading.Barrier(threads)
+
+    def worker(index):
+        start_barrier.wait()
+        for i in range(ops):
+            counter.increment()
+            hits.update_value(i % 100, lambda v: v + 1, 0)
+            hits[f"{index}_{i}"] = i
+            users.register(f"user{i % 500}", {'user_id': f"id{i % 500}"})
+            # a と b は常に同時に更新されるので、読み取り側で食い違ってはいけない
+            snapshot = settings.snapshot()
+            if snapshot['a'] != snapshot['b']:
+                torn_reads.append(snapshot)
+            if i % 50 == 0:
+                settings.update({'a': index * ops + i, 'b': index * ops + i})
+
+    started = time.time()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - started
+
+    total = threads * ops
+    assert counter.value == total, (counter.value, total)
+    assert sum(hits.get(k, 0) for k in range(100)) == total
+    assert len(hits) == total + 100
+    assert len(users) == 500
+    assert not torn_reads, torn_reads[:3]
+    print(f"{threads} threads x {ops} ops: no lost updates ({elapsed:.2f}s)")
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
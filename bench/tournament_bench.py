@@ -0,0 +1,97 @@
+"""トーナメントのベンチマーク
+
+参加者 N 人のトーナメントを、対戦できるようになった試合から順に結果を入れて最後まで進める。
+結果1件の反映にかかる時間が参加者数によらないこと（シングルエリミネーション）と、
+組み合わせ表の読み出しがキャッシュから返ること（結果が入った直後の作り直しとの比較）と、
+作り直しの間にロックを持つのが材料を写す間だけなこと（その間は report() が待たされる）を確かめる。
+
+使い方: python bench/tournament_bench.py [--players 人数]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tournament import TournamentDirector
+
+
+def run(format, players, seed=1, read_every=10):
+    rng = random.Random(seed)
+    ratings = {f"player{i}": rng.gauss(1500, 200) for i in range(players)}
+    director = TournamentDirector(ratings.__getitem__)
+    ready = []
+    director.on_ready = lambda tournament, matches: ready.extend(matches)
+    tournament = director.create('bench', format)
+    for name in ratings:
+        director.join(tournament.tournament_id, name)
+
+    started = time.perf_counter()
+    director.start(tournament.tournament_id, now=0)
+    setup = time.perf_counter() - started
+
+    report_times = []
+    rebuild_times = []
+    locked_times = []
+    cached_times = []
+    results = 0
+    while ready:
+        match = ready.pop(rng.randrange(len(ready)))
+        first, second = match.players
+        # レーティングの高い方が勝ちやすい。1割は引き分け（シングルエリミネーションではやり直し）
+        if rng.random() < 0.1:
+            winner = None
+        else:
+            winner = 0 if rng.random() < 1 / (1 + 10 ** ((ratings[second] - ratings[first]) / 400)) else 1
+        started = time.perf_counter()
+        director.report(tournament, match, winner, now=0)
+        report_times.append(time.perf_counter() - started)
+        results += 1
+        if results % read_every == 0:
+            started = time.perf_counter()
+            with director.lock:
+                tournament.snapshot()
+            locked_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            director.view(tournament.tournament_id)
+            rebuild_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            view = director.view(tournament.tournament_id)
+            cached_times.append(time.perf_counter() - started)
+
+    assert tournament.status == 'finished', tournament.status
+    report_times.sort()
+    mean = sum(report_times) / len(report_times)
+    print(f"{format} {players} players: {results} results ({tournament.round_count} rounds), "
+          f"setup {setup * 1000:.1f} ms, champion {tournament.champion} (seed {tournament.seeds[tournament.champion]})")
+    print(f"  report: mean {mean * 1e6:.1f} µs, p99 {report_times[int(len(report_times) * 0.99)] * 1e6:.1f} µs, "
+          f"max {report_times[-1] * 1000:.2f} ms (round pairing included)")
+    print(f"  view ({len(view) / 1024:.0f} KiB): rebuild after a result {sum(rebuild_times) / len(rebuild_times) * 1000:.2f} ms, "
+          f"cached {sum(cached_times) / len(cached_times) * 1e6:.2f} µs, "
+          f"lock held {sum(locked_times) / len(locked_times) * 1000:.2f} ms (max {max(locked_times) * 1000:.2f} ms)")
+
+
+def no_show(players=64):
+    """誰もチェックインしない試合は、時間切れで上位シードが勝ち上がって最後まで進む"""
+    director = TournamentDirector(lambda player: 1500, no_show_timeout=60)
+    tournament = director.create('no-show')
+    for i in range(players):
+        director.join(tournament.tournament_id, f"player{i}")
+    director.start(tournament.tournament_id, now=0)
+    now = 0
+    while tournament.status != 'finished':
+        now += 60
+        director.expire(lambda player: False, now=now)
+    print(f"no-show: {players} players finished after {now // 60} timeouts, champion {tournament.champion}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='トーナメントのベンチマーク')
+    parser.add_argument('--players', type=int, default=4096)
+    args = parser.parse_args()
+    for count in (256, args.players):
+        run('single_elimination', count)
+    run('swiss', args.players)
+    no_show()
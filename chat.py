@@ -0,0 +1,241 @@
+"""ロビーチャット
+
+部屋ごとに直近 HISTORY_SIZE 件のメッセージを固定長のリングバッファに持ち、新しいメッセージは
+SSE（GET /chat/events?room=...）で購読者全員に流す。ゲートウェイのイベントループで動くので、
+ページを返す Flask のリクエストスレッドには負荷がかからない。
+
+メッセージは受け付けたときに SSE のフレームを1回だけ作り、リングバッファにも購読者にも同じバイト列を使う。
+再接続したクライアントは最後に受け取った id（EventSource が自動で送る Last-Event-ID か ?since=）
+より後の分をリングバッファから受け取る。古すぎて残っていない分は gap イベントで知らせる。
+id は「起動ごとの epoch-連番」なので、サーバーが再起動して連番が振り直されていれば、前の起動の id で
+再接続してきたクライアントには reset イベントを送ってから履歴を最初から送る。
+投稿の頻度はユーザーごとのトークンバケット（1人あたり数値2つ）で制限し、満タンに戻ったバケットは投稿のついでに
+PRUNE_INTERVAL ごとに消す。
+"""
+import asyncio
+import time
+
+from sse import prepare_event
+
+ROOMS = ('lobby', 'rps', 'color')
+HISTORY_SIZE = 100
+MAX_LENGTH = 200             # 1メッセージの最大文字数
+RATE = 0.5                   # 1秒あたりに回復する投稿数
+BURST = 5                    # 続けて投稿できる数
+KEEPALIVE_INTERVAL = 15      # 途中のプロキシに切られないよう、コメント行を送る間隔（秒）
+PRUNE_INTERVAL = 60          # 頻度制限のバケットを掃除する間隔（秒）
+
+KEEPALIVE = b": keepalive\n\n"
+
+
+class ChatRoom:
+    """1部屋分のチャット。直近 size 件の SSE フレームを連番 % size の位置に持つ
+
+    クライアントに見せる id は「epoch-連番」（epoch は起動ごとに変わる）。
+    """
+
+    __slots__ = ('name', 'epoch', 'size', 'ring', 'next_id', 'subscribers')
+
+    def __init__(self, name, epoch, size=HISTORY_SIZE):
+        self.name = name
+        self.epoch = epoch
+        self.size = size
+        self.ring = [None] * size
+        self.next_id = 1
+        self.subscribers = set()
+
+    @property
+    def oldest_id(self):
+        """リングバッファに残っている一番古い id"""
+        return max(1, self.next_id - self.size)
+
+    def append(self, message):
+        """メッセージに id を付けてフレームを作り、リングバッファに入れる。(id, フレーム) を返す"""
+        number = self.next_id
+        event_id = f"{self.epoch}-{number}"
+        frame = prepare_event(dict(message, id=event_id, room=self.name), 'message', event_id)
+        self.ring[number % self.size] = frame
+        self.next_id += 1
+        return event_id, frame
+
+    def parse_id(self, event_id):
+        """この起動で振った id なら連番を返す。前の起動の id や、まだ振っていない・読めない id なら None"""
+        epoch, _, number = event_id.rpartition('-')
+        if epoch != self.epoch:
+            return None
+        try:
+            number = int(number)
+        except ValueError:
+            return None
+        return number if 0 <= number < self.next_id else None
+
+    def since(self, last_id):
+        """last_id より後のフレームと、取りこぼしがあるか（リングバッファから押し出されたか）を返す"""
+        start = max(last_id + 1, self.oldest_id)
+        ring, size = self.ring, self.size
+        return [ring[i % size] for i in range(start, self.next_id)], start > last_id + 1
+
+
+class RateLimiter:
+    """ユーザーごとのトークンバケット（{ユーザー: [残りトークン, 最後に更新した時刻]}）"""
+
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def allow(self, user, now):
+        """1回分を使えれば True。使えなければ False"""
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            self.buckets[user] = [self.burst - 1, now]
+            return True
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def retry_after(self, user, now):
+        """次に投稿できるまでの秒数"""
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            return 0
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        return max(0, (1 - tokens) / self.rate)
+
+    def prune(self, now):
+        """満タンまで回復したバケットを消す（消しても次の投稿の結果は変わらない）"""
+        full = [user for user, (tokens, updated) in self.buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for user in full:
+            del self.buckets[user]
+        return len(full)
+
+
+class LobbyChat:
+    """部屋ごとのチャットと、SSE の購読・投稿のハンドラー
+
+    can_post(プレイヤー名) が False のプレイヤー（ゲストなど）は読むだけ。
+    """
+
+    def __init__(self, rooms=ROOMS, history=HISTORY_SIZE, limiter=None, can_post=None, epoch=None):
+        self.epoch = epoch if epoch is not None else format(time.time_ns(), 'x')
+        self.rooms = {name: ChatRoom(name, self.epoch, history) for name in rooms}
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self._pruned_at = time.monotonic()
+        self.can_post = can_post
+        self.messages = 0
+        self.rate_limited = 0
+        self.resumed = 0
+        self.gaps = 0
+        self._keepalive = None
+
+    def _room(self, request):
+        return self.rooms.get(request.query.get('room', 'lobby'))
+
+    async def events(self, request, player):
+        """GET /chat/events?room=...&since=id: 履歴の続きを送ってから、新しいメッセージを流し続ける"""
+        room = self._room(request)
+        if room is None:
+            await request.respond(404, {'error': '不明なチャットルームです。'})
+            return
+        if self._keepalive is None:
+            self._keepalive = asyncio.get_running_loop().create_task(self._keepalive_forever())
+
+        cursor = request.headers.get('last-event-id') or request.query.get('since')
+        await request.start_events()
+        request.send_prepared(prepare_event({'room': room.name, 'player': player,
+                                             'can_post': self._may_post(player)}, 'hello'))
+        last_id = room.parse_id(cursor) if cursor else None
+        if cursor and last_id is None:
+            # サーバーが再起動して id が振り直されている（前の起動の id）
+            request.send_prepared(prepare_event({'room': room.name}, 'reset'))
+        if last_id is None:
+            frames = room.since(0)[0]
+        else:
+            self.resumed += 1
+            frames, missed = room.since(last_id)
+            if missed:
+                self.gaps += 1
+                request.send_prepared(prepare_event({'oldest': room.oldest_id}, 'gap'))
+        for frame in frames:
+            request.send_prepared(frame, 'chat')
+
+        room.subscribers.add(request)
+        try:
+            await request.wait_closed()
+        finally:
+            room.subscribers.discard(request)
+
+    async def post(self, request, player):
+        """POST /chat/messages?room=...: 本文（テキスト）を投稿する"""
+        if request.method != 'POST':
+            await request.respond(405)
+            return
+        room = self._room(request)
+        if room is None:
+            await request.respond(404, {'error': '不明なチャットルームです。'})
+            return
+        if not request.same_site or not self._may_post(player):
+            await request.respond(403, {'error': 'チャットに投稿するにはログインしてください。'})
+            return
+        body = await request.read_body(MAX_LENGTH * 4)
+        if body is None:
+            await request.respond(413, {'error': 'メッセージが長すぎます。'})
+            return
+        text = body.decode('utf-8', 'replace').strip()
+        if not text or len(text) > MAX_LENGTH:
+            await request.respond(400, {'error': f'メッセージは1〜{MAX_LENGTH}文字で入力してください。'})
+            return
+
+        now = time.monotonic()
+        if now - self._pruned_at >= PRUNE_INTERVAL:
+            # バケットが増えるのは投稿のときだけなので、掃除も投稿のついでにする
+            self._pruned_at = now
+            self.limiter.prune(now)
+        if not self.limiter.allow(player, now):
+            self.rate_limited += 1
+            retry = self.limiter.retry_after(player, now)
+            await request.respond(429, {'error': '投稿が速すぎます。少し待ってから送ってください。',
+                                        'retry_after': round(retry, 1)},
+                                  headers={'Retry-After': max(1, round(retry))})
+            return
+        event_id = self.publish(room.name, player, text)
+        await request.respond(200, {'id': event_id})
+
+    def _may_post(self, player):
+        return self.can_post is None or self.can_post(player)
+
+    def publish(self, room_name, player, text):
+        """メッセージを部屋の履歴に入れて購読者全員に送り、id を返す"""
+        room = self.rooms[room_name]
+        event_id, frame = room.append({'player': player, 'text': text, 'time': int(time.time())})
+        self.messages += 1
+        closed = [s for s in room.subscribers if not s.send_prepared(frame, 'chat')]
+        for subscriber in closed:
+            room.subscribers.discard(subscriber)
+        return event_id
+
+    async def _keepalive_forever(self):
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            for room in self.rooms.values():
+                for subscriber in list(room.subscribers):
+                    subscriber.send_prepared(KEEPALIVE, 'chat_keepalive')
+
+    def metrics(self):
+        return {
+            'rooms': {name: {'subscribers': len(room.subscribers), 'last_id': room.next_id - 1}
+                      for name, room in self.rooms.items()},
+            'messages': self.messages,
+            'rate_limited': self.rate_limited,
+            'rate_limit_buckets': len(self.limiter),
+            'resumed': self.resumed,
+            'gaps': self.gaps,
+        }
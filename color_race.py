@@ -0,0 +1,499 @@
+"""オンライン対戦カラーマッチング（レース）
+
+最大 MAX_PLAYERS 人の部屋で、全員に同じ色の並びを配り、制限時間内の得点を競う。
+プロセスに1本の固定間隔（TICK 秒）のループが全部屋を進める。
+回答はティックごとにまとめて処理し、部屋の状態はティックごとに1回だけ作って全員に送る。
+毎ティックの状態と回答は protocol.py のバイナリ形式、それ以外のメッセージは JSON で送る。
+状態は各クライアントが最後に受信確認した状態との差分だけを送り、一定間隔で全体（キーフレーム）を送る。
+同じ基準の tick を確認済みのクライアントには同じフレームを使い回す。
+観戦者には SPECTATOR_EVERY_TICKS ごとに全体の状態を1回だけ作り、SPECTATOR_DELAY 秒遅らせて
+全員に同じフレームを送る。
+recorder（replay.ReplayWriter）を渡すと、レースごとにシードと入力を記録し、replay() で再生できる。
+"""
+import asyncio
+import itertools
+import json
+import logging
+import random
+import secrets
+import time
+from collections import deque
+
+import protocol
+import ws
+from spectate import SpectatorFeed
+from replay import MatchRecord, ReplayError, GAME_COLOR_RACE
+from anticheat import COLOR_TIME_LIMIT, COLOR_ANSWER_DELAY
+
+logger = logging.getLogger(__name__)
+
+TICK_RATE = 10
+TICK = 1 / TICK_RATE
+MAX_PLAYERS = 8
+COLOR_COUNT = 8
+MATCH_PROBABILITY = 0.7
+LOBBY_WAIT_TICKS = 5 * TICK_RATE      # 2人目が来てから開始までの待ち
+COUNTDOWN_TICKS = 3 * TICK_RATE
+RACE_TICKS = COLOR_TIME_LIMIT * TICK_RATE
+# 次の色が出るまでの待ち時間。通信のゆらぎの分だけ短めに受け付ける
+MIN_ANSWER_TICKS = round((COLOR_ANSWER_DELAY - 0.2) * TICK_RATE)
+SEQUENCE_LENGTH = int(COLOR_TIME_LIMIT / COLOR_ANSWER_DELAY) + 1
+KEYFRAME_TICKS = 5 * TICK_RATE      # 差分が途切れても復帰できるよう全体を送る間隔
+HISTORY_TICKS = 3 * TICK_RATE       # 差分の基準として保持する過去の状態
+ACK_EVERY_TICKS = 3                 # クライアントが受信確認を返す間隔
+SPECTATOR_DELAY = 5                 # 観戦の遅延（秒）
+# 観戦者に状態を送る間隔。得点は0.8秒に1回しか動かないので、観戦は毎秒5回で十分
+SPECTATOR_EVERY_TICKS = 2
+
+
+def color_sequence(seed, length=SEQUENCE_LENGTH):
+    """シードから [文字の色, 書かれた色名] の並びを作る（7割は一致）"""
+    rng = random.Random(seed)
+    sequence = []
+    for _ in range(length):
+        ink = rng.randrange(COLOR_COUNT)
+        word = ink if rng.random() < MATCH_PROBABILITY else rng.randrange(COLOR_COUNT)
+        sequence.append((ink, word))
+    return sequence
+
+
+class RacePlayer:
+    __slots__ = ('connection', 'name', 'room', 'slot', 'index', 'score', 'combo', 'ready_tick', 'acked')
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.room = None
+        self.slot = 0           # 部屋の中の番号（開始時に決まり、状態メッセージではこれで区別する）
+        self.index = 0          # 何問目に答えているか（全員同じ並び）
+        self.score = 0
+        self.combo = 0
+        self.ready_tick = 0     # 次の回答を受け付けるティック
+        self.acked = -1         # 最後に受信確認された状態の tick
+
+
+class RaceRoom:
+    """1部屋分の状態。tick() はループから1ティックごとに呼ばれる"""
+
+    def __init__(self, room_id, on_finish, spectator_delay_ticks=SPECTATOR_DELAY * TICK_RATE,
+                 recorder=None, seed=None):
+        self.room_id = room_id
+        self.on_finish = on_finish
+        self.feed = SpectatorFeed(spectator_delay_ticks)
+        self.recorder = recorder
+        self.record = None           # 開始時に作る MatchRecord（recorder がなければ None）
+        self.players = []
+        self.inputs = deque()        # (プレイヤー, 問題番号, 一致と答えたか)
+        self.seed = secrets.randbits(64) if seed is None else seed
+        self.sequence = color_sequence(self.seed)
+        self.state = 'waiting'       # waiting / countdown / racing / finished
+        self.start_tick = None
+        self.end_tick = None
+        self.fill_deadline = None
+        self.started_tick = None     # _start() したティック（記録の tick はここからの数）
+        self.last_tick = None
+        self.slot_count = 0
+        self.history = {}            # {tick: スロット番号ごとの (得点, コンボ, 問題数)}
+        self.bytes_sent = 0
+        self.tick_bytes = 0
+        self.state_ticks = 0
+        self.keyframes = 0
+        self.deltas = 0
+
+    @property
+    def full(self):
+        return len(self.players) >= MAX_PLAYERS
+
+    def join(self, player, tick):
+        player.room = self
+        player.index = player.score = player.combo = 0
+        player.acked = -1
+        self.players.append(player)
+        if len(self.players) == 2:
+            self.fill_deadline = tick + LOBBY_WAIT_TICKS
+        self._broadcast(tick, {'type': 'waiting', 'room': self.room_id,
+                               'players': [p.name for p in self.players], 'max_players': MAX_PLAYERS},
+                        kind='race_lobby', intro=True)
+
+    def leave(self, player):
+        if player in self.players:
+            self.players.remove(player)
+            if self.record is not None and self.state in ('countdown', 'racing'):
+                # 次のティックの入力より前に抜けたものとして記録する
+                self.record.add(self.last_tick + 1 - self.started_tick, player.slot, 0)
+        player.room = None
+        if len(self.players) < 2 and self.state == 'waiting':
+            self.fill_deadline = None
+
+    def answer(self, player, item, match):
+        self.inputs.append((player, item, match))
+
+    def ack(self, player, tick):
+        if player.acked < tick and tick in self.history:
+            player.acked = tick
+
+    def tick(self, tick):
+        """1ティック進める。部屋が終わったら False を返す"""
+        self.tick_bytes = 0
+        self.last_tick = tick
+        try:
+            if self.state == 'waiting':
+                if self.full or (self.fill_deadline is not None and tick >= self.fill_deadline):
+                    self._start(tick)
+                return bool(self.players)
+            if not self.players:
+                return False
+
+            self._apply_inputs(tick)
+            if self.state == 'countdown' and tick >= self.start_tick:
+                self.state = 'racing'
+            if self.state == 'racing' and tick >= self.end_tick:
+                self._finish(tick)
+                return False
+            self._broadcast_state(tick)
+            return True
+        finally:
+            self.feed.release(tick)
+
+    def _start(self, tick):
+        self.state = 'countdown'
+        self.started_tick = tick
+        self.start_tick = tick + COUNTDOWN_TICKS
+        self.end_tick = self.start_tick + RACE_TICKS
+        self.slot_count = len(self.players)
+        for slot, player in enumerate(self.players):
+            player.slot = slot
+            player.ready_tick = self.start_tick
+        if self.recorder is not None:
+            self.record = MatchRecord(GAME_COLOR_RACE, [p.name for p in self.players],
+                                      [self.seed, COUNTDOWN_TICKS, RACE_TICKS, MIN_ANSWER_TICKS])
+        self._broadcast(tick, {'type': 'start', 'room': self.room_id, 'sequence': self.sequence,
+                               'countdown': COUNTDOWN_TICKS * TICK, 'time_limit': COLOR_TIME_LIMIT,
+                               'tick_rate': TICK_RATE, 'ack_every': ACK_EVERY_TICKS,
+                               'history_ticks': HISTORY_TICKS,
+                               'players': [p.name for p in self.players]}, intro=True)
+
+    def _apply_inputs(self, tick):
+        inputs = self.inputs
+        record = self.record
+        while inputs:
+            player, item, match = inputs.popleft()
+            if (record is not None and self.state == 'racing' and player.room is self
+                    and 0 <= item < len(self.sequence)):
+                # 受け付けるかどうかの判定も再生で確かめられるよう、判定の前に記録する
+                record.add(tick - self.started_tick, player.slot, 1 + item * 2 + bool(match))
+            # 古い問題への回答や、次の色が出る前の回答は無視する
+            if (self.state != 'racing' or player.room is not self or item != player.index
+                    or tick < player.ready_tick or player.index >= len(self.sequence)):
+                continue
+            ink, word = self.sequence[item]
+            if match == (ink == word):
+                player.combo += 1
+                player.score += player.combo
+            else:
+                player.combo = 0
+            player.index += 1
+            player.ready_tick = tick + MIN_ANSWER_TICKS
+
+    def _snapshot(self):
+        snapshot = [None] * self.slot_count
+        for p in self.players:
+            snapshot[p.slot] = (p.score, p.combo, p.index)
+        return tuple(snapshot)
+
+    def _broadcast_state(self, tick):
+        remaining = (self.end_tick - max(tick, self.start_tick)) * TICK
+        current = self._snapshot()
+        history = self.history
+        history[tick] = current
+        history.pop(tick - HISTORY_TICKS, None)
+        keyframe_due = self.state_ticks % KEYFRAME_TICKS == 0
+        self.state_ticks += 1
+
+        # 確認済みの tick ごとに1回だけ作る（キーフレームの基準は None）
+        frames = {}
+        sent = 0
+        for player in self.players:
+            acked = player.acked
+            frame = frames.get(acked)
+            if frame is None:
+                base_tick = None if keyframe_due or acked not in history else acked
+                frame = frames.get(base_tick)
+                if frame is None:
+                    frame = frames[base_tick] = self._state_frame(tick, remaining, current, base_tick)
+                frames[acked] = frame
+            if player.connection.send_prepared(frame, 'race_state'):
+                sent += len(frame)
+        self.tick_bytes += sent
+        self.bytes_sent += sent
+
+        # 観戦者には全体の状態を送る（見ている人がいるときだけ作り、全員で同じフレームを使う）
+        if self.feed.spectators and tick % SPECTATOR_EVERY_TICKS == 0:
+            frame = frames.get(None) or self._state_frame(tick, remaining, current, None)
+            self.feed.push(tick, frame, 'race_state')
+
+    def _state_frame(self, tick, remaining, current, base_tick):
+        if base_tick is None:
+            self.keyframes += 1
+            message = protocol.encode_state(tick, self.state, remaining, [
+                (slot, *fields) for slot, fields in enumerate(current) if fields is not None])
+        else:
+            self.deltas += 1
+            message = protocol.encode_delta(tick, base_tick, self.state, remaining,
+                                            self.history[base_tick], current)
+        return ws.prepare(message)
+
+    def results(self):
+        """スロットごとの 得点 + 1（途中で抜けたプレイヤーは 0）"""
+        results = [0] * self.slot_count
+        for p in self.players:
+            results[p.slot] = p.score + 1
+        return results
+
+    def _finish(self, tick):
+        self.state = 'finished'
+        standings = sorted(self.players, key=lambda p: p.score, reverse=True)
+        message = {'type': 'finish', 'standings': [[p.name, p.score] for p in standings]}
+        if self.record is not None:
+            self.recorder.submit(self.record.encode(self.results()))
+            message['replay'] = self.record.replay_id
+        self._broadcast(tick, message)
+        for player in self.players:
+            player.room = None
+        self.on_finish(self, standings)
+
+    def _broadcast(self, tick, message, kind='control', intro=False):
+        """部屋の全員と観戦者に同じ JSON メッセージを送る（シリアライズは1回だけ）"""
+        frame = ws.prepare(json.dumps(message, ensure_ascii=False, separators=(',', ':')))
+        self._send_frame(frame, kind)
+        self.feed.push(tick, frame, kind, intro)
+
+    def _send_frame(self, frame, kind):
+        sent = 0
+        for player in self.players:
+            if player.connection.send_prepared(frame, kind):
+                sent += len(frame)
+        self.tick_bytes += sent
+        self.bytes_sent += sent
+
+    def metrics(self):
+        return {
+            'room': self.room_id,
+            'state': self.state,
+            'players': len(self.players),
+            'spectators': len(self.feed),
+            'bytes_sent': self.bytes_sent,
+            'bytes_per_tick': round(self.bytes_sent / self.state_ticks) if self.state_ticks else None,
+            'keyframes': self.keyframes,
+            'deltas': self.deltas,
+        }
+
+
+class ColorRaceServer:
+    """部屋の割り振りと、全部屋を進める固定間隔のループ
+
+    on_result(プレイヤー名, 得点) はレースが終わるたびに各プレイヤーについて呼ばれる。
+    spectator_delay は観戦の遅延（秒）。関数を渡すと部屋を作るたびに読み直す。
+    """
+
+    def __init__(self, on_result=None, samples=600, spectator_delay=SPECTATOR_DELAY, recorder=None):
+        self.on_result = on_result
+        self.spectator_delay = spectator_delay
+        self.recorder = recorder
+        self.rooms = {}
+        self.draining = []           # 部屋が終わった後も遅延分の配信が残っている観戦配信
+        self.open_room = None
+        self.tick_count = 0
+        self.overruns = 0
+        self.races_finished = 0
+        self._tick_durations = deque(maxlen=samples)
+        self._tick_bytes = deque(maxlen=samples)
+        self._room_ids = itertools.count(1)
+        self._loop_task = None
+
+    def _ensure_loop(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.get_running_loop().create_task(self.tick_forever())
+
+    async def handle(self, connection, name):
+        self._ensure_loop()
+        player = RacePlayer(connection, name)
+        await connection.send(json.dumps({'type': 'hello', 'player': name, 'protocol': protocol.PROTOCOL_VERSION},
+                                         ensure_ascii=False))
+        try:
+            async for raw in connection:
+                try:
+                    message = protocol.decode(raw) if isinstance(raw, bytes) else json.loads(raw)
+                except protocol.ProtocolVersionError:
+                    # 回答も受信確認も通じないので、つないだままにしない
+                    await connection.close(1008)
+                    break
+                except ValueError:
+                    continue
+                kind = message.get('type') if isinstance(message, dict) else None
+                if kind == 'join' and player.room is None:
+                    self.join(player)
+                elif kind == 'answer' and player.room is not None:
+                    item = message.get('item')
+                    if isinstance(item, int):
+                        player.room.answer(player, item, bool(message.get('match')))
+                elif kind == 'ack' and player.room is not None:
+                    if isinstance(message.get('tick'), int):
+                        player.room.ack(player, message['tick'])
+                elif kind == 'leave' and player.room is not None:
+                    player.room.leave(player)
+        finally:
+            if player.room is not None:
+                player.room.leave(player)
+
+    async def spectate(self, connection, name):
+        """観戦。?room=番号 で部屋を選ぶ（なければ観戦者の多い部屋）。{"type": "watch"} で見る部屋を変える"""
+        self._ensure_loop()
+        feed = self.watch(connection, connection.query.get('room'))
+        try:
+            async for raw in connection:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    continue
+                if isinstance(message, dict) and message.get('type') == 'watch':
+                    if feed is not None:
+                        feed.discard(connection)
+                    feed = self.watch(connection, message.get('room'))
+        finally:
+            if feed is not None:
+                feed.discard(connection)
+
+    def watch(self, connection, room_id=None):
+        """接続を部屋の観戦者に加えて、その観戦配信を返す（見られる部屋がなければ None）"""
+        room = None
+        if room_id is not None:
+            try:
+                room = self.rooms.get(int(room_id))
+            except (TypeError, ValueError):
+                pass
+        if room is None and self.rooms:
+            # 対戦中で観戦者・プレイヤーの多い部屋を優先する
+            room = max(self.rooms.values(),
+                       key=lambda r: (r.state != 'waiting', len(r.feed), len(r.players)))
+        connection.send_prepared(ws.prepare(json.dumps({
+            'type': 'spectate', 'room': room.room_id if room else None, 'protocol': protocol.PROTOCOL_VERSION,
+            'delay': room.feed.delay_ticks * TICK if room else None,
+        })))
+        if room is None:
+            return None
+        room.feed.add(connection)
+        return room.feed
+
+    def join(self, player):
+        room = self.open_room
+        if room is None or room.full or room.state != 'waiting':
+            delay = self.spectator_delay() if callable(self.spectator_delay) else self.spectator_delay
+            room = self.open_room = RaceRoom(next(self._room_ids), self._finished,
+                                             max(0, round(delay * TICK_RATE)), self.recorder)
+            self.rooms[room.room_id] = room
+        room.join(player, self.tick_count)
+
+    def tick(self):
+        """全部屋を1ティック進める"""
+        tick = self.tick_count
+        sent = 0
+        for room in list(self.rooms.values()):
+            alive = room.tick(tick)
+            sent += room.tick_bytes
+            if not alive:
+                self.rooms.pop(room.room_id, None)
+                if room is self.open_room:
+                    self.open_room = None
+                if room.feed.spectators and not room.feed.done:
+                    self.draining.append(room.feed)
+            elif room is self.open_room and room.state != 'waiting':
+                self.open_room = None
+        if self.draining:
+            for feed in self.draining:
+                feed.release(tick)
+            self.draining = [feed for feed in self.draining if not feed.done and feed.spectators]
+        self._tick_bytes.append(sent)
+        self.tick_count += 1
+
+    async def tick_forever(self):
+        """固定間隔でティックを進める。処理が間隔を超えたら超過として数え、遅れは取り戻さない"""
+        next_tick = time.monotonic()
+        while True:
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("カラーレースのティック処理でエラーが発生しました")
+            finished = time.monotonic()
+            self._tick_durations.append(finished - started)
+            next_tick += TICK
+            if finished > next_tick:
+                self.overruns += 1
+                next_tick = finished
+            await asyncio.sleep(next_tick - finished)
+
+    def _finished(self, room, standings):
+        self.races_finished += 1
+        if self.on_result is None:
+            return
+        for player in standings:
+            try:
+                self.on_result(player.name, player.score)
+            except Exception:
+                logger.exception("カラーレースの結果の記録に失敗しました")
+
+    def metrics(self):
+        durations = sorted(self._tick_durations)
+        tick_bytes = list(self._tick_bytes)
+        rooms = list(self.rooms.values())
+        return {
+            'rooms': len(rooms),
+            'players': sum(len(room.players) for room in rooms),
+            'spectators': sum(len(room.feed) for room in rooms) + sum(len(feed) for feed in self.draining),
+            'races_finished': self.races_finished,
+            'ticks': self.tick_count,
+            'tick_overruns': self.overruns,
+            'tick_ms_mean': round(sum(durations) / len(durations) * 1000, 3) if durations else None,
+            'tick_ms_p99': round(durations[int(len(durations) * 0.99)] * 1000, 3) if durations else None,
+            'tick_ms_max': round(durations[-1] * 1000, 3) if durations else None,
+            'bytes_per_tick': round(sum(tick_bytes) / len(tick_bytes)) if tick_bytes else None,
+            'room_stats': [room.metrics() for room in rooms[:20]],
+        }
+
+
+class _ReplayConnection:
+    """再生用の、何も送らない接続"""
+
+    closed = False
+
+    def send_prepared(self, frame, kind='control'):
+        return True
+
+
+def replay(record):
+    """記録した入力を RaceRoom にそのまま流し直し、{'results': スロットごとの 得点 + 1, 'ticks': ティック数} を返す"""
+    if record.params[1:] != [COUNTDOWN_TICKS, RACE_TICKS, MIN_ANSWER_TICKS]:
+        raise ReplayError(f'color race parameters changed since recording: {record.params[1:]}')
+    room = RaceRoom(0, lambda room, standings: None, 0, seed=record.params[0])
+    players = [RacePlayer(_ReplayConnection(), name) for name in record.players]
+    for player in players:
+        player.room = room
+        room.players.append(player)
+    room._start(0)
+
+    inputs = record.inputs
+    position = 0
+    tick = 0
+    alive = True
+    while alive:
+        tick += 1
+        while position < len(inputs) and inputs[position][0] == tick:
+            _, slot, value = inputs[position]
+            position += 1
+            if value == 0:
+                room.leave(players[slot])
+            else:
+                room.answer(players[slot], (value - 1) >> 1, bool((value - 1) & 1))
+        alive = room.tick(tick)
+    return {'results': room.results(), 'ticks': tick}
@@ -0,0 +1,249 @@
+"""クイズの問題バンク（data/quiz_questions.json）に、規則から作れる問題を足す
+
+手で書いた問題はそのまま残し、まだない問題（問題文が同じものがない問題）だけを末尾に足す。
+問題番号は配列の位置なので、すでにある問題の番号（回答の統計や出題済みのビットマップが指す番号）は変わらない。
+選択肢の並びは乱数の種で決まるので、何度実行しても同じファイルになる。
+
+作る問題:
+    数学      足し算・引き算（難易度1）、かけ算・わり算（2）、2桁どうしのかけ算・平方・百分率（3）
+    一般常識  曜日の計算、単位の換算
+    地理      都道府県の県庁所在地と地方、国の首都
+    科学      元素記号と原子番号
+    歴史      和暦と西暦の換算
+
+使い方: python data/generate_quiz_questions.py [--output パス] [--check]
+"""
+import argparse
+import json
+import os
+import random
+
+BANK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quiz_questions.json')
+SEED = 36
+
+WEEKDAYS = ['月曜日', '火曜日', '水曜日', '木曜日', '金曜日', '土曜日', '日曜日']
+
+# (都道府県, 県庁所在地, 地方)。東京都は都庁の所在地が区なので除く
+PREFECTURES = [
+    ('北海道', '札幌市', '北海道地方'), ('青森県', '青森市', '東北地方'), ('岩手県', '盛岡市', '東北地方'),
+    ('宮城県', '仙台市', '東北地方'), ('秋田県', '秋田市', '東北地方'), ('山形県', '山形市', '東北地方'),
+    ('福島県', '福島市', '東北地方'), ('茨城県', '水戸市', '関東地方'), ('栃木県', '宇都宮市', '関東地方'),
+    ('群馬県', '前橋市', '関東地方'), ('埼玉県', 'さいたま市', '関東地方'), ('千葉県', '千葉市', '関東地方'),
+    ('神奈川県', '横浜市', '関東地方'), ('新潟県', '新潟市', '中部地方'), ('富山県', '富山市', '中部地方'),
+    ('石川県', '金沢市', '中部地方'), ('福井県', '福井市', '中部地方'), ('山梨県', '甲府市', '中部地方'),
+    ('長野県', '長野市', '中部地方'), ('岐阜県', '岐阜市', '中部地方'), ('静岡県', '静岡市', '中部地方'),
+    ('愛知県', '名古屋市', '中部地方'), ('三重県', '津市', '近畿地方'), ('滋賀県', '大津市', '近畿地方'),
+    ('京都府', '京都市', '近畿地方'), ('大阪府', '大阪市', '近畿地方'), ('兵庫県', '神戸市', '近畿地方'),
+    ('奈良県', '奈良市', '近畿地方'), ('和歌山県', '和歌山市', '近畿地方'), ('鳥取県', '鳥取市', '中国地方'),
+    ('島根県', '松江市', '中国地方'), ('岡山県', '岡山市', '中国地方'), ('広島県', '広島市', '中国地方'),
+    ('山口県', '山口市', '中国地方'), ('徳島県', '徳島市', '四国地方'), ('香川県', '高松市', '四国地方'),
+    ('愛媛県', '松山市', '四国地方'), ('高知県', '高知市', '四国地方'), ('福岡県', '福岡市', '九州地方'),
+    ('佐賀県', '佐賀市', '九州地方'), ('長崎県', '長崎市', '九州地方'), ('熊本県', '熊本市', '九州地方'),
+    ('大分県', '大分市', '九州地方'), ('宮崎県', '宮崎市', '九州地方'), ('鹿児島県', '鹿児島市', '九州地方'),
+    ('沖縄県', '那覇市', '九州地方'),
+]
+REGIONS = ['北海道地方', '東北地方', '関東地方', '中部地方', '近畿地方', '中国地方', '四国地方', '九州地方']
+
+# (国, 首都, 難易度)
+CAPITALS = [
+    ('フランス', 'パリ', 1), ('イギリス', 'ロンドン', 1), ('イタリア', 'ローマ', 1), ('中国', '北京', 1),
+    ('韓国', 'ソウル', 1), ('ロシア', 'モスクワ', 1), ('ドイツ', 'ベルリン', 1), ('エジプト', 'カイロ', 1),
+    ('スペイン', 'マドリード', 2), ('ポルトガル', 'リスボン', 2), ('オランダ', 'アムステルダム', 2),
+    ('ベルギー', 'ブリュッセル', 2), ('オーストリア', 'ウィーン', 2), ('スウェーデン', 'ストックホルム', 2),
+    ('ノルウェー', 'オスロ', 2), ('フィンランド', 'ヘルシンキ', 2), ('デンマーク', 'コペンハーゲン', 2),
+    ('ポーランド', 'ワルシャワ', 2), ('ギリシャ', 'アテネ', 2), ('アイルランド', 'ダブリン', 2),
+    ('ハンガリー', 'ブダペスト', 2), ('チェコ', 'プラハ', 2), ('アメリカ', 'ワシントンD.C.', 2),
+    ('メキシコ', 'メキシコシティ', 2), ('アルゼンチン', 'ブエノスアイレス', 2), ('ペルー', 'リマ', 2),
+    ('チリ', 'サンティアゴ', 2), ('タイ', 'バンコク', 2), ('ベトナム', 'ハノイ', 2), ('インド', 'ニューデリー', 2),
+    ('インドネシア', 'ジャカルタ', 2), ('フィリピン', 'マニラ', 2), ('マレーシア', 'クアラルンプール', 2),
+    ('ケニア', 'ナイロビ', 2), ('サウジアラビア', 'リヤド', 2), ('イラン', 'テヘラン', 2),
+    ('モンゴル', 'ウランバートル', 2), ('オーストラリア', 'キャンベラ', 3), ('カナダ', 'オタワ', 3),
+    ('ブラジル', 'ブラジリア', 3), ('トルコ', 'アンカラ', 3), ('スイス', 'ベルン', 3),
+    ('ニュージーランド', 'ウェリントン', 3), ('ナイジェリア', 'アブジャ', 3),
+]
+
+# (原子番号, 元素記号, 元素名)
+ELEMENTS = [
+    (1, 'H', '水素'), (2, 'He', 'ヘリウム'), (3, 'Li', 'リチウム'), (4, 'Be', 'ベリリウム'), (5, 'B', 'ホウ素'),
+    (6, 'C', '炭素'), (7, 'N', '窒素'), (8, 'O', '酸素'), (9, 'F', 'フッ素'), (10, 'Ne', 'ネオン'),
+    (11, 'Na', 'ナトリウム'), (12, 'Mg', 'マグネシウム'), (13, 'Al', 'アルミニウム'), (14, 'Si', 'ケイ素'),
+    (15, 'P', 'リン'), (16, 'S', '硫黄'), (17, 'Cl', '塩素'), (18, 'Ar', 'アルゴン'), (19, 'K', 'カリウム'),
+    (20, 'Ca', 'カルシウム'), (26, 'Fe', '鉄'), (28, 'Ni', 'ニッケル'), (29, 'Cu', '銅'), (30, 'Zn', '亜鉛'),
+    (47, 'Ag', '銀'), (50, 'Sn', 'スズ'), (53, 'I', 'ヨウ素'), (78, 'Pt', '白金'), (79, 'Au', '金'),
+    (80, 'Hg', '水銀'), (82, 'Pb', '鉛'), (92, 'U', 'ウラン'),
+]
+COMMON_ELEMENTS = {'H', 'He', 'C', 'N', 'O', 'Na', 'Fe', 'Cu', 'Ag', 'Au'}
+
+# (元号, 元年の前の年（元号N年 = この年 + N）, 最後の年, 難易度)
+ERAS = [('令和', 2018, 7, 1), ('平成', 1988, 31, 1), ('昭和', 1925, 64, 2), ('大正', 1911, 15, 3), ('明治', 1867, 45, 3)]
+
+# (大きい単位, 小さい単位, 倍率, 難易度)
+UNITS = [
+    ('km', 'm', 1000, 1), ('m', 'cm', 100, 1), ('kg', 'g', 1000, 1), ('L', 'mL', 1000, 1),
+    ('時間', '分', 60, 2), ('分', '秒', 60, 2), ('日', '時間', 24, 2), ('m', 'mm', 1000, 2),
+    ('t', 'kg', 1000, 2), ('L', 'dL', 10, 3), ('時間', '秒', 3600, 3), ('週間', '時間', 168, 3),
+]
+
+
+def question(rng, text, answer, wrong, category, difficulty):
+    """正解と誤答3つを乱数で並べた問題"""
+    options = [answer] + list(wrong)
+    rng.shuffle(options)
+    return {'question': text, 'options': options, 'correct': options.index(answer),
+            'category': category, 'difficulty': difficulty}
+
+
+def near_numbers(rng, answer, spread):
+    """正解の近くの、正解と重ならない正の数を3つ"""
+    wrong = set()
+    while len(wrong) < 3:
+        value = answer + rng.choice((-1, 1)) * rng.randint(1, spread)
+        if value > 0 and value != answer:
+            wrong.add(value)
+    return sorted(wrong)
+
+
+def others(rng, answer, pool):
+    return rng.sample([item for item in dict.fromkeys(pool) if item != answer], 3)
+
+
+def arithmetic(rng):
+    for a in range(2, 31):
+        for b in range(2, 21):
+            yield question(rng, f"{a} + {b} = ?", str(a + b),
+                           map(str, near_numbers(rng, a + b, 3)), '数学', 1)
+            if a > b:
+                yield question(rng, f"{a} - {b} = ?", str(a - b),
+                               map(str, near_numbers(rng, a - b, 3)), '数学', 1)
+    for a in range(11, 40):
+        for b in range(3, 10):
+            yield question(rng, f"{a} × {b} = ?", str(a * b),
+                           map(str, near_numbers(rng, a * b, 12)), '数学', 2)
+            yield question(rng, f"{a * b} ÷ {b} = ?", str(a),
+                           map(str, near_numbers(rng, a, 4)), '数学', 2)
+    for a in range(12, 30):
+        for b in range(12, 30, 3):
+            yield question(rng, f"{a} × {b} = ?", str(a * b),
+                           map(str, near_numbers(rng, a * b, 30)), '数学', 3)
+    for a in range(11, 51):
+        yield question(rng, f"{a} の2乗は？", str(a * a), map(str, near_numbers(rng, a * a, 40)), '数学', 3)
+    for percent in (5, 10, 15, 20, 25, 30, 40, 50, 60, 75):
+        for base in range(40, 1001, 40):
+            if percent * base % 100 == 0:
+                answer = percent * base // 100
+                yield question(rng, f"{base} の {percent}% は？", str(answer),
+                               map(str, near_numbers(rng, answer, max(3, answer // 4))), '数学', 3)
+
+
+def weekdays(rng):
+    for start, name in enumerate(WEEKDAYS):
+        for days in range(2, 101):
+            answer = WEEKDAYS[(start + days) % 7]
+            yield question(rng, f"今日が{name}なら、{days}日後は何曜日？", answer,
+                           others(rng, answer, WEEKDAYS), '一般常識', 1 if days < 7 else 2 if days <= 30 else 3)
+
+
+def units(rng):
+    for large, small, factor, difficulty in UNITS:
+        for amount in range(2, 31):
+            answer = amount * factor
+            # 桁の取り違えと、1つずれた量
+            wrong = [value for value in dict.fromkeys((answer // 10, answer * 10, (amount + 1) * factor,
+                                                       (amount - 1) * factor))
+                     if value > 0 and value != answer]
+            wrong = rng.sample(wrong, 3)
+            yield question(rng, f"{amount}{large} は何{small}？", f"{answer}{small}",
+                           [f"{value}{small}" for value in wrong], '一般常識', difficulty)
+
+
+def geography(rng):
+    capitals = [capital for _, capital, _ in PREFECTURES]
+    names = [name for name, _, _ in PREFECTURES]
+    for name, capital, region in PREFECTURES:
+        # 都道府県名と同じ名前の市は易しい
+        difficulty = 1 if capital[:-1] == name[:-1] else 2
+        yield question(rng, f"{name}の{'道' if name == '北海道' else name[-1]}庁所在地は？", capital,
+                       others(rng, capital, capitals), '地理', difficulty)
+        if difficulty == 2:
+            yield question(rng, f"{capital}が{'道' if name == '北海道' else name[-1]}庁所在地の都道府県は？", name,
+                           others(rng, name, names), '地理', 2)
+        if name != '北海道':
+            yield question(rng, f"{name}は何地方？", region, others(rng, region, REGIONS), '地理', 2)
+    countries = [country for country, _, _ in CAPITALS]
+    cities = [capital for _, capital, _ in CAPITALS]
+    for country, capital, difficulty in CAPITALS:
+        yield question(rng, f"{country}の首都は？", capital, others(rng, capital, cities), '地理', difficulty)
+        yield question(rng, f"{capital}が首都の国は？", country, others(rng, country, countries), '地理', difficulty)
+
+
+def elements(rng):
+    symbols = [symbol for _, symbol, _ in ELEMENTS]
+    names = [name for _, _, name in ELEMENTS]
+    for number, symbol, name in ELEMENTS:
+        difficulty = 1 if symbol in COMMON_ELEMENTS else 2
+        yield question(rng, f"元素記号 {symbol} の元素は？", name, others(rng, name, names), '科学', difficulty)
+        yield question(rng, f"{name}の元素記号は？", symbol, others(rng, symbol, symbols), '科学', difficulty)
+        if number <= 20:
+            yield question(rng, f"原子番号{number}の元素は？", name, others(rng, name, names[:20]), '科学', 3)
+
+
+def eras(rng):
+    for era, base, last, difficulty in ERAS:
+        for year in range(1, last + 1):
+            label = '元年' if year == 1 else f"{year}年"
+            answer = base + year
+            yield question(rng, f"{era}{label}は西暦何年？", f"{answer}年",
+                           [f"{value}年" for value in near_numbers(rng, answer, 3)], '歴史', difficulty)
+
+
+GENERATORS = (arithmetic, weekdays, units, geography, elements, eras)
+
+
+def generate(seed=SEED):
+    rng = random.Random(seed)
+    for generator in GENERATORS:
+        yield from generator(rng)
+
+
+def merge(existing, generated):
+    """すでにある問題の後ろに、問題文が重ならない生成した問題を足す"""
+    texts = {q['question'] for q in existing}
+    merged = list(existing)
+    for q in generated:
+        if q['question'] not in texts:
+            texts.add(q['question'])
+            merged.append(q)
+    return merged
+
+
+def validate(questions):
+    for q in questions:
+        options = q['options']
+        assert len(options) == 4 and len(set(options)) == 4, q
+        assert 0 <= q['correct'] < 4 and q['difficulty'] in (1, 2, 3), q
+
+
+def dump(questions):
+    # 1行に1問（差分が読みやすいように）
+    lines = ',\n'.join('  ' + json.dumps(q, ensure_ascii=False) for q in questions)
+    return f"[\n{lines}\n]\n"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='クイズの問題バンクに規則から作れる問題を足す')
+    parser.add_argument('--output', default=BANK_PATH)
+    parser.add_argument('--check', action='store_true', help='書き込まずに、ファイルが最新かだけを確かめる')
+    args = parser.parse_args()
+    with open(BANK_PATH, encoding='utf-8') as f:
+        existing = json.load(f)
+    questions = merge(existing, generate())
+    validate(questions)
+    text = dump(questions)
+    if args.check:
+        with open(args.output, encoding='utf-8') as f:
+            up_to_date = f.read() == text
+        print(f"{len(questions)} questions, {'up to date' if up_to_date else 'out of date'}")
+        raise SystemExit(0 if up_to_date else 1)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(text)
+    print(f"{len(existing)} existing + {len(questions) - len(existing)} generated = {len(questions)} questions")
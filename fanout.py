@@ -0,0 +1,171 @@
+"""遅いクライアントに引きずられない送信キュー
+
+接続ごとに上限付きの送信キューを持ち、送信側（ブロードキャスト）は積むだけで待たない。
+ソケットが詰まっている間に溜まったメッセージは、種類ごとの方針で間引く。
+
+    COALESCE     同じ種類の未送信メッセージを最新のものに置き換える（部屋の状態など）
+    DROP_OLDEST  キューが一杯なら古いものから捨てる（チャットなど）
+    RELIABLE     捨てない（開始・終了の通知など）。入りきらなければ切断する
+
+送信がまったく進まない状態か、キューが一杯のままの状態が max_lag 秒続いた接続は、
+追いつけないものとして切断する。
+"""
+import asyncio
+import time
+from collections import deque
+
+COALESCE = 'coalesce'
+DROP_OLDEST = 'drop_oldest'
+RELIABLE = 'reliable'
+
+# メッセージの種類ごとの方針（載っていない種類は RELIABLE）
+MESSAGE_POLICIES = {
+    'race_state': COALESCE,
+    'race_lobby': COALESCE,
+    'chat': DROP_OLDEST,
+    'chat_keepalive': COALESCE,
+}
+
+# これを超えてトランスポートに溜まったら書き込みを止めてキューに積む
+TRANSPORT_HIGH_WATER = 16 * 1024
+
+
+class FanoutMetrics:
+    """ゲートウェイ全体の送信キューの統計"""
+
+    def __init__(self):
+        self.queued = 0            # 全接続のキューに溜まっているメッセージ数
+        self.peak_depth = 0        # 1接続のキューの最大の深さ
+        self.drops = {}            # {種類: 捨てた数}
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def dropped(self, kind):
+        self.drops[kind] = self.drops.get(kind, 0) + 1
+
+    def snapshot(self):
+        return {
+            'queued': self.queued,
+            'peak_depth': self.peak_depth,
+            'drops': dict(self.drops),
+            'coalesced': self.coalesced,
+            'slow_disconnects': self.slow_disconnects,
+        }
+
+
+class SendQueue:
+    """1接続分の送信キュー（イベントループのスレッドからだけ使う）"""
+
+    __slots__ = ('writer', 'transport', 'metrics', 'max_depth', 'max_lag', 'policies',
+                 '_queue', '_latest', '_flusher', '_stalled_since', '_full_since', 'closed')
+
+    def __init__(self, writer, metrics, max_depth=64, max_lag=10.0, policies=MESSAGE_POLICIES):
+        self.writer = writer
+        self.transport = writer.transport
+        self.metrics = metrics
+        self.max_depth = max_depth
+        self.max_lag = max_lag
+        self.policies = policies
+        self._queue = deque()          # [種類, フレーム]
+        self._latest = {}              # {COALESCE の種類: キュー内のエントリ}
+        self._flusher = None
+        self._stalled_since = None     # 詰まり始めた・最後に送信が進んだ時刻（キューが空なら None）
+        self._full_since = None        # キューが一杯になった時刻
+        self.closed = False
+        self.transport.set_write_buffer_limits(high=TRANSPORT_HIGH_WATER)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, frame, kind='control'):
+        """フレームを送る（または積む）。接続を閉じたら False"""
+        if self.closed:
+            return False
+        queue = self._queue
+        transport = self.transport
+        if not queue and transport.get_write_buffer_size() < TRANSPORT_HIGH_WATER:
+            # 詰まっていなければそのまま書き込む（観戦配信などで接続数だけ呼ばれるので寄り道しない）
+            transport.write(frame)
+            return True
+
+        policy = self.policies.get(kind, RELIABLE)
+        entry = self._latest.get(kind) if policy == COALESCE else None
+        if entry is not None:
+            entry[1] = frame
+            self.metrics.coalesced += 1
+        elif len(queue) >= self.max_depth and not self._drop_oldest():
+            if policy == RELIABLE:
+                self.abort()
+                return False
+            # 積んであるのが全部捨てられないものなら、新しい方を捨てる
+            self.metrics.dropped(kind)
+        else:
+            entry = [kind, frame]
+            queue.append(entry)
+            if policy == COALESCE:
+                self._latest[kind] = entry
+            self.metrics.queued += 1
+            if len(queue) > self.metrics.peak_depth:
+                self.metrics.peak_depth = len(queue)
+
+        now = time.monotonic()
+        if self._stalled_since is None:
+            self._stalled_since = now
+        if len(queue) >= self.max_depth:
+            self._full_since = self._full_since or now
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush())
+        return self._check_lag(now)
+
+    def _drop_oldest(self):
+        """DROP_OLDEST の一番古いメッセージを1件捨てる。なければ False
+
+        COALESCE の種類は各1件しか積まれず、捨てると最新の状態が届かなくなるので残す。
+        """
+        for index, (kind, _) in enumerate(self._queue):
+            if self.policies.get(kind, RELIABLE) == DROP_OLDEST:
+                del self._queue[index]
+                self._latest.pop(kind, None)
+                self.metrics.queued -= 1
+                self.metrics.dropped(kind)
+                return True
+        return False
+
+    def _check_lag(self, now):
+        """送信が進まない・キューが一杯のままの状態が max_lag 秒続いたら切断する"""
+        stalled = now - self._stalled_since > self.max_lag
+        full = self._full_since is not None and now - self._full_since > self.max_lag
+        if stalled or full:
+            self.metrics.slow_disconnects += 1
+            self.abort()
+            return False
+        return True
+
+    async def _flush(self):
+        queue = self._queue
+        try:
+            while queue and not self.closed:
+                await self.writer.drain()
+                while queue and self.transport.get_write_buffer_size() < TRANSPORT_HIGH_WATER:
+                    entry = queue.popleft()
+                    if self._latest.get(entry[0]) is entry:
+                        del self._latest[entry[0]]
+                    self.metrics.queued -= 1
+                    self.transport.write(entry[1])
+                self._stalled_since = time.monotonic() if queue else None
+                if len(queue) < self.max_depth:
+                    self._full_since = None
+        except (ConnectionError, RuntimeError):
+            self.abort()
+        finally:
+            self._flusher = None
+
+    def abort(self):
+        """送れないまま溜まった分を捨てて接続を切る"""
+        if self.closed:
+            return
+        self.closed = True
+        self.metrics.queued -= len(self._queue)
+        self._queue.clear()
+        self._latest.clear()
+        self.transport.abort()
@@ -0,0 +1,192 @@
+"""リアルタイム対戦用の WebSocket ゲートウェイ
+
+Flask とは別のポートで asyncio のイベントループを1本動かし、パスごとのハンドラーに接続を渡す。
+WebSocket のほか、チャットの SSE など通常の HTTP リクエストも同じポートで受ける（sse.HTTPRequest）。
+main.py から別スレッドで起動するほか、単体でも起動できる（python game_gateway.py）。
+"""
+import asyncio
+import itertools
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import ws
+from fanout import FanoutMetrics, SendQueue
+from sse import HTTPRequest
+
+logger = logging.getLogger(__name__)
+
+GUEST_PREFIX = 'guest_'
+SLOW_CONSUMER_LAG = 10.0   # 送信がこの秒数以上追いつかない接続は切断する
+_guest_numbers = itertools.count(1)
+
+
+def guest_identity(connection):
+    """ログイン情報がない接続にはゲスト名を付ける"""
+    return f"{GUEST_PREFIX}{next(_guest_numbers)}"
+
+
+def is_guest(player):
+    return player.startswith(GUEST_PREFIX)
+
+
+class Gateway:
+    """パスごとに WebSocket ハンドラーを登録するゲートウェイ"""
+
+    def __init__(self, identify=guest_identity):
+        self.identify = identify   # identify(WebSocket) -> プレイヤー名
+        self.routes = {}
+        self.http_routes = {}
+        self.connections = 0
+        self.total_connections = 0
+        self.loop = None
+        self._server = None
+        self.fanout = FanoutMetrics()
+        self.max_lag = SLOW_CONSUMER_LAG
+
+    def route(self, path):
+        def register(handler):
+            self.routes[path] = handler
+            return handler
+        return register
+
+    def http_route(self, path):
+        """WebSocket でない HTTP リクエストのハンドラーを登録する（handler(HTTPRequest, プレイヤー名)）"""
+        def register(handler):
+            self.http_routes[path] = handler
+            return handler
+        return register
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await ws.read_request(reader)
+            if not ws.is_upgrade(request[2]):
+                await self._handle_http(reader, writer, *request)
+                return
+            connection = await ws.accept(reader, writer, request)
+        except (ws.HandshakeError, ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        handler = self.routes.get(urlsplit(connection.path).path)
+        if handler is None:
+            await connection.close(1008)
+            return
+        # 遅いクライアントがブロードキャストを止めないよう、送信は接続ごとのキューを通す
+        connection.outbox = SendQueue(writer, self.fanout, max_lag=self.max_lag)
+
+        self.connections += 1
+        self.total_connections += 1
+        try:
+            await handler(connection, self.identify(connection))
+        except ws.ConnectionClosed:
+            pass
+        except Exception:
+            logger.exception("WebSocket ハンドラーでエラーが発生しました: %s", connection.path)
+        finally:
+            self.connections -= 1
+            await connection.close()
+
+    async def _handle_http(self, reader, writer, method, path, headers):
+        request = HTTPRequest(reader, writer, method, path, headers)
+        handler = self.http_routes.get(urlsplit(path).path)
+        if handler is None:
+            await request.respond(404)
+            writer.close()
+            return
+        request.outbox = SendQueue(writer, self.fanout, max_lag=self.max_lag)
+
+        self.connections += 1
+        self.total_connections += 1
+        try:
+            await handler(request, self.identify(request))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("HTTP ハンドラーでエラーが発生しました: %s %s", method, path)
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+        return self._server
+
+    async def serve_forever(self, host, port):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def run_in_thread(self, host, port):
+        """専用のイベントループを別スレッドで動かす（Flask と同じプロセスで使う場合）"""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, name='game-gateway', daemon=True)
+        thread.start()
+        started.wait()
+        return thread
+
+    def metrics(self):
+        return {
+            'connections': self.connections,
+            'total_connections': self.total_connections,
+            'send_queues': self.fanout.snapshot(),
+        }
+
+
+def create_gateway(identify=guest_identity, on_score=None, spectator_delay=None, replay_dir=None,
+                   on_match=None):
+    """ゲームのハンドラーを登録したゲートウェイを作る
+
+    on_score(ゲーム, プレイヤー名, 得点) はサーバーで判定したスコアを記録するために呼ばれる。
+    on_match(勝者名, 敗者名, 引き分けか) はオンライン対戦じゃんけんの試合が終わるたびに呼ばれる。
+    spectator_delay は観戦の遅延（秒、または秒を返す関数）。None なら color_race.SPECTATOR_DELAY。
+    replay_dir を渡すと、対戦をそのディレクトリにリプレイとして記録する（gateway.replays）。
+    トーナメント（gateway.tournaments）はじゃんけんのレーティングでシードを決め、じゃんけんの対戦で進める。
+    """
+    from rps import RPSLobby
+    from color_race import ColorRaceServer, SPECTATOR_DELAY
+    from chat import LobbyChat
+    from replay import ReplayWriter
+    from tournament import TournamentDirector
+
+    def race_result(player, score):
+        if on_score is not None:
+            on_score('color', player, score)
+
+    gateway = Gateway(identify)
+    gateway.replays = ReplayWriter(replay_dir) if replay_dir is not None else None
+    gateway.tournaments = TournamentDirector(lambda player: gateway.rps.ratings.get(player).rating)
+    gateway.rps = RPSLobby(on_result=on_match, recorder=gateway.replays, tournaments=gateway.tournaments)
+    gateway.color_race = ColorRaceServer(
+        on_result=race_result,
+        spectator_delay=SPECTATOR_DELAY if spectator_delay is None else spectator_delay,
+        recorder=gateway.replays)
+    gateway.route('/ws/rps')(gateway.rps.handle)
+    gateway.route('/ws/color-race')(gateway.color_race.handle)
+    gateway.route('/ws/color-race/spectate')(gateway.color_race.spectate)
+    gateway.chat = LobbyChat(can_post=lambda player: not is_guest(player))
+    gateway.http_route('/chat/events')(gateway.chat.events)
+    gateway.http_route('/chat/messages')(gateway.chat.post)
+    return gateway
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ゲーム用 WebSocket ゲートウェイ')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--spectator-delay', type=float, default=None, help='観戦の遅延（秒）')
+    parser.add_argument('--replay-dir', default=None, help='対戦のリプレイを記録するディレクトリ')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    gateway = create_gateway(spectator_delay=args.spectator_delay, replay_dir=args.replay_dir)
+    asyncio.run(gateway.serve_forever(args.host, args.port))
@@ -0,0 +1,203 @@
+"""サーバー側で保持するミニゲームのセッション
+
+答え（数字当ての正解やカードの配置、じゃんけんのコンピューターの手）はサーバーだけが持ち、クライアントには結果だけを返す。
+クイズは出題した問題・回答済みの問題・正解数をここに持ち、セッションIDはスコアの送信1回で使い切る。
+盤面は64ビットのシードから毎回同じものを再現できるので、シードだけ残せば検証できる。
+大量の同時セッションを持てるよう、各セッションは __slots__ で最小限の属性だけにする。
+"""
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+MEMORY_PAIRS = 8
+RPS_MOVES = ('rock', 'paper', 'scissors')   # 後ろの手が前の手に勝つ（scissors は rock に負ける）
+
+
+def number_target(seed):
+    """シードから数字当ての正解（1〜100）を決める"""
+    return random.Random(seed).randint(1, 100)
+
+
+def memory_layout(seed):
+    """シードから記憶ゲームのカード配置（各カードの絵柄番号）を決める"""
+    cards = list(range(MEMORY_PAIRS)) * 2
+    random.Random(seed).shuffle(cards)
+    return bytes(cards)
+
+
+def rps_move(seed, round_number):
+    """シードとラウンドからコンピューターの手を決める"""
+    return RPS_MOVES[random.Random(seed * 1_000_003 + round_number).randrange(3)]
+
+
+class NumberSession:
+    __slots__ = ('player', 'seed', 'target', 'attempts', 'finished', 'expires')
+
+    def __init__(self, player, seed, expires):
+        self.player = player
+        self.seed = seed
+        self.target = number_target(seed)
+        self.attempts = 0
+        self.finished = False
+        self.expires = expires
+
+    def guess(self, number):
+        """'correct' / 'higher'（もっと大きい）/ 'lower'（もっと小さい）を返す"""
+        self.attempts += 1
+        if number == self.target:
+            self.finished = True
+            return 'correct'
+        return 'higher' if number < self.target else 'lower'
+
+
+class MemorySession:
+    __slots__ = ('player', 'seed', 'layout', 'matched', 'open_card', 'attempts', 'finished', 'expires')
+
+    def __init__(self, player, seed, expires):
+        self.player = player
+        self.seed = seed
+        self.layout = memory_layout(seed)
+        self.matched = 0        # 揃ったカードのビットマスク
+        self.open_card = -1     # 1枚目にめくったカード（なければ -1）
+        self.attempts = 0
+        self.finished = False
+        self.expires = expires
+
+    def flip(self, index):
+        """カードをめくり (絵柄番号, 判定) を返す。判定は1枚目なら None、2枚目なら揃ったかどうか"""
+        if not 0 <= index < len(self.layout) or self.matched & (1 << index) or index == self.open_card:
+            raise ValueError(index)
+        symbol = self.layout[index]
+        if self.open_card < 0:
+            self.open_card = index
+            return symbol, None
+        first, self.open_card = self.open_card, -1
+        self.attempts += 1
+        if self.layout[first] != symbol:
+            return symbol, False
+        self.matched |= (1 << first) | (1 << index)
+        if self.matched == (1 << len(self.layout)) - 1:
+            self.finished = True
+        return symbol, True
+
+
+class RPSSession:
+    __slots__ = ('player', 'seed', 'rounds', 'wins', 'losses', 'draws', 'expires')
+
+    def __init__(self, player, seed, expires):
+        self.player = player
+        self.seed = seed
+        self.rounds = 0
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.expires = expires
+
+    def play(self, move):
+        """('win' / 'lose' / 'draw', コンピューターの手) を返す"""
+        player = RPS_MOVES.index(move)
+        computer = rps_move(self.seed, self.rounds)
+        self.rounds += 1
+        difference = (player - RPS_MOVES.index(computer)) % 3
+        if difference == 0:
+            self.draws += 1
+            return 'draw', computer
+        if difference == 1:
+            self.wins += 1
+            return 'win', computer
+        self.losses += 1
+        return 'lose', computer
+
+
+class QuizSession:
+    __slots__ = ('player', 'seed', 'served', 'unanswered', 'right', 'started', 'expires')
+
+    def __init__(self, player, seed, expires):
+        self.player = player
+        self.seed = seed
+        self.served = frozenset()
+        self.unanswered = set()
+        self.right = set()       # 正解した問題（数は len。同時に回答が来ても数え間違えないよう集合で持つ）
+        self.started = time.time()
+        self.expires = expires
+
+    def serve(self, questions):
+        self.served = frozenset(questions)
+        self.unanswered = set(questions)
+
+    def answer(self, qid, correct):
+        """出題した問題への最初の回答だけを数えて True を返す"""
+        try:
+            self.unanswered.remove(qid)
+        except KeyError:
+            return False
+        if correct:
+            self.right.add(qid)
+        return True
+
+    @property
+    def correct(self):
+        return len(self.right)
+
+
+class GameSessionStore:
+    """セッションIDで引くセッション置き場
+
+    最後に操作した順に並べておき、期限切れのものを先頭から捨てる。
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, session_class, player, seed=None):
+        if seed is None:
+            seed = secrets.randbits(64)
+        session_id = secrets.token_urlsafe(12)
+        game = session_class(player, seed, time.monotonic() + self.ttl)
+        with self._lock:
+            self._sessions[session_id] = game
+        return session_id, game
+
+    def get(self, session_id, session_class):
+        """有効なセッションを取り出して期限を延ばす。なければ None"""
+        now = time.monotonic()
+        with self._lock:
+            game = self._sessions.get(session_id)
+            if not isinstance(game, session_class) or game.expires < now:
+                return None
+            game.expires = now + self.ttl
+            self._sessions.move_to_end(session_id)
+            return game
+
+    def take(self, session_id, session_class, player):
+        """player の有効なセッションを取り除いて返す（使い切り）。なければ None"""
+        with self._lock:
+            game = self._sessions.get(session_id)
+            if not isinstance(game, session_class) or game.expires < time.monotonic() or game.player != player:
+                return None
+            del self._sessions[session_id]
+            return game
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict_expired(self):
+        """放置されたセッションを削除し、削除件数を返す"""
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                session_id, game = next(iter(self._sessions.items()))
+                if game.expires >= now:
+                    break
+                del self._sessions[session_id]
+                removed += 1
+        return removed
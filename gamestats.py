@@ -0,0 +1,405 @@
+"""ゲーム結果の列指向ストア
+
+結果1件を行（dict）として持たず、ゲームごとに列（時刻・プレイヤー・スコア）を別々のファイルに並べる。
+ファイルは mmap して memoryview.cast で型付きの列として読むので、集計は sum / min / max / Counter / bisect /
+itertools.compress などの組み込み関数が C のループで列を直接なめる（行ごとの Python オブジェクトを作らない）。
+
+行は追記のみで時刻順に並ぶ（時計が戻っても直前の行の時刻に揃える）。
+そのため「直近 N 時間」は bisect で開始位置を求めて、そこから後ろの列だけを集計すればよい。
+全期間の集計は、CHUNK 行ごとに区切った確定済みの部分の集計（値ごとの件数、15分ごとの件数と合計）を
+キャッシュしておき、最後の未確定の部分だけをその場で集計して足し合わせる。
+
+プレイヤーは辞書（players.json）で番号に置き換えて列に入れる。行数は flush() のときに meta ファイルへ保存し、
+それより後ろの行は再起動で捨てる。
+"""
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import compress
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 1 << 16                     # 集計をキャッシュする単位（行数）
+# 時間帯の集計の単位（秒）。UTC からのずれが30分・45分のタイムゾーンでも、区切りが現地の正時と揃う
+BUCKET = 15 * 60
+PERCENTILES = (50, 90, 99)
+
+SCORE_COLUMNS = (('time', 'I'), ('player', 'I'), ('score', 'i'))
+ANSWER_COLUMNS = (('time', 'I'), ('question', 'I'), ('correct', 'B'))
+
+
+class Column:
+    """1つの列（mmap したファイル）。容量を超えたらファイルを倍に伸ばして張り直す"""
+
+    def __init__(self, path, typecode, capacity=CHUNK):
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        existing = os.fstat(self._file.fileno()).st_size // self.itemsize
+        self._map(max(existing, capacity))
+
+    def _map(self, capacity):
+        self._file.truncate(capacity * self.itemsize)
+        # 集計中の memoryview が古い mmap を参照していることがあるので、resize ではなく新しく張る
+        self._mmap = mmap.mmap(self._file.fileno(), capacity * self.itemsize)
+        self.values = memoryview(self._mmap).cast(self.typecode)
+        self.capacity = capacity
+
+    def reserve(self, rows):
+        if rows > self.capacity:
+            capacity = self.capacity
+            while capacity < rows:
+                capacity *= 2
+            self._map(capacity)
+
+    def positions(self, value, rows):
+        """先頭 rows 行のうち value の行番号（mmap.find でバイト列として探し、列の境目に合うものだけ）"""
+        pattern = array(self.typecode, [value]).tobytes()
+        end = rows * self.itemsize
+        found = self._mmap.find(pattern, 0, end)
+        while found != -1:
+            if found % self.itemsize == 0:
+                yield found // self.itemsize
+            found = self._mmap.find(pattern, found + 1, end)
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.values.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class ColumnTable:
+    """同じ行数の列の組。最初の列は時刻で、昇順に並ぶ"""
+
+    def __init__(self, directory, name, schema):
+        self.name = name
+        self.names = [column for column, _ in schema]
+        self._meta_path = os.path.join(directory, f"{name}.json")
+        self.columns = [Column(os.path.join(directory, f"{name}.{column}"), typecode) for column, typecode in schema]
+        self.rows = min(self._load_rows(), min(column.capacity for column in self.columns))
+        self.saved_rows = self.rows
+        self.last_time = self.columns[0].values[self.rows - 1] if self.rows else 0
+        self._lock = threading.Lock()
+
+    def _load_rows(self):
+        try:
+            with open(self._meta_path, encoding='utf-8') as f:
+                return json.load(f)['rows']
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError):
+            logger.exception("列ストア %s の行数を読み込めません", self._meta_path)
+            return 0
+
+    def append(self, row):
+        """1行（列の順の値）を追加する"""
+        with self._lock:
+            rows = self.rows
+            for column in self.columns:
+                column.reserve(rows + 1)
+            self.last_time = max(int(row[0]), self.last_time)
+            self.columns[0].values[rows] = self.last_time
+            for column, value in zip(self.columns[1:], row[1:]):
+                column.values[rows] = value
+            # 値を書いてから行数を増やすので、読む側は rows までなら書きかけの行を見ない
+            self.rows = rows + 1
+
+    def extend(self, columns):
+        """時刻順に並んだ列の組（array）をまとめて追加する"""
+        count = len(columns[0])
+        with self._lock:
+            if count and columns[0][0] < self.last_time:
+                raise ValueError('時刻が直前の行より前です')
+            rows = self.rows
+            for column, values in zip(self.columns, columns):
+                column.reserve(rows + count)
+                column.values[rows:rows + count] = values
+            if count:
+                self.last_time = columns[0][-1]
+            self.rows = rows + count
+
+    def view(self, name, start=0, stop=None):
+        """列の start〜stop 行目（コピーしない memoryview）"""
+        stop = self.rows if stop is None else stop
+        return self.columns[self.names.index(name)].values[start:stop]
+
+    def start_of(self, since):
+        """時刻が since 以上の最初の行"""
+        return bisect_left(self.view('time'), since)
+
+    def flush(self, rows=None):
+        """先頭 rows 行（省略時は全行）を保存したことにする"""
+        rows = self.rows if rows is None else rows
+        if rows == self.saved_rows:
+            return 0
+        for column in self.columns:
+            column.flush()
+        tmp_path = self._meta_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'rows': rows}, f)
+            os.replace(tmp_path, self._meta_path)
+        except OSError:
+            logger.exception("列ストア %s に保存できません", self._meta_path)
+            return 0
+        written, self.saved_rows = rows - self.saved_rows, rows
+        return written
+
+    def close(self):
+        self.flush()
+        for column in self.columns:
+            column.close()
+
+
+def scan_scores(table, start, stop):
+    """スコアの列の start〜stop 行目を集計する: (値ごとの件数, {通算の区間番号: (件数, 合計)})"""
+    times = table.view('time', start, stop)
+    scores = table.view('score', start, stop)
+    buckets = {}
+    # 時刻順なので、BUCKET 秒ごとの境目を bisect で探して区間ごとに sum する
+    position, end = 0, len(times)
+    while position < end:
+        bucket = times[position] // BUCKET
+        boundary = bisect_left(times, (bucket + 1) * BUCKET, position, end)
+        buckets[bucket] = (boundary - position, sum(scores[position:boundary]))
+        position = boundary
+    return Counter(scores), buckets
+
+
+def scan_answers(table, start, stop):
+    """回答の列の start〜stop 行目を集計する: (問題ごとの回答数, 問題ごとの正解数)"""
+    questions = table.view('question', start, stop)
+    return Counter(questions), Counter(compress(questions, table.view('correct', start, stop)))
+
+
+def merge_buckets(total, buckets):
+    for bucket, (count, score_sum) in buckets.items():
+        seen = total.get(bucket)
+        total[bucket] = (count, score_sum) if seen is None else (seen[0] + count, seen[1] + score_sum)
+
+
+class _Aggregates:
+    """確定済みの CHUNK 単位の行をまとめた集計"""
+
+    def __init__(self):
+        self.sealed = 0
+        self.parts = None
+        self.lock = threading.Lock()
+
+
+class GameStats:
+    """ゲームごとのスコアの列と、クイズの回答の列"""
+
+    def __init__(self, directory, games):
+        os.makedirs(directory, exist_ok=True)
+        self.tables = {game: ColumnTable(directory, game, SCORE_COLUMNS) for game in games}
+        self.answers = ColumnTable(directory, 'quiz_answers', ANSWER_COLUMNS)
+        self._players_path = os.path.join(directory, 'players.json')
+        self._players = self._load_players()
+        self._player_index = {player: index for index, player in enumerate(self._players)}
+        self._saved_players = len(self._players)
+        self._players_lock = threading.Lock()
+        self._aggregates = {name: _Aggregates() for name in list(self.tables) + ['quiz_answers']}
+        self._local_hours = {}   # {区間番号: 現地時刻の時}（夏時間の切り替えも区間ごとに反映される）
+
+    def _load_players(self):
+        try:
+            with open(self._players_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError):
+            logger.exception("プレイヤーの辞書 %s を読み込めません", self._players_path)
+            return []
+
+    def player_id(self, player, create=True):
+        index = self._player_index.get(player)
+        if index is None and create:
+            with self._players_lock:
+                index = self._player_index.get(player)
+                if index is None:
+                    index = len(self._players)
+                    self._players.append(player)
+                    self._player_index[player] = index
+        return index
+
+    def record(self, game, player, score, now=None):
+        self.tables[game].append((time.time() if now is None else now, self.player_id(player), round(score)))
+
+    def record_answer(self, question, correct, now=None):
+        self.answers.append((time.time() if now is None else now, question, bool(correct)))
+
+    def import_answer_counts(self, counts, at):
+        """問題ごとの (回答数, 正解数) を、時刻 at の回答の行として追加して保存する（以前の集計からの移行用）"""
+        questions = array('I')
+        correct = array('B')
+        for question, (answered, right) in enumerate(counts):
+            answered = max(0, int(answered))
+            right = min(max(0, int(right)), answered)
+            questions.extend(array('I', [question]) * answered)
+            correct.extend(array('B', [1]) * right)
+            correct.extend(array('B', [0]) * (answered - right))
+        times = array('I', [max(int(at), self.answers.last_time)]) * len(questions)
+        self.answers.extend((times, questions, correct))
+        self.flush()
+        return len(questions)
+
+    def flush(self):
+        """列と行数をファイルに保存し、確定した CHUNK の集計を進めておく（バックグラウンドのジョブ）
+
+        保存する行が指すプレイヤーが必ず辞書に入っているように、先に行数を決めてから辞書を保存し、
+        最後に各列の行数を保存する。
+        """
+        rows = [(table, table.rows) for table in self._all_tables()]
+        if len(self._players) != self._saved_players:
+            with self._players_lock:
+                players = list(self._players)
+            tmp_path = self._players_path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(players, f)
+                os.replace(tmp_path, self._players_path)
+                self._saved_players = len(players)
+            except OSError:
+                logger.exception("プレイヤーの辞書 %s に保存できません", self._players_path)
+                return 0
+        written = sum(table.flush(count) for table, count in rows)
+        for table in self._all_tables():
+            self._sealed_parts(table)
+        return written
+
+    def close(self):
+        self.flush()
+        # 行数は flush() で保存済み（辞書より後の行を保存しないよう、表ごとの close() は使わない）
+        for table in self._all_tables():
+            for column in table.columns:
+                column.close()
+
+    def _all_tables(self):
+        return list(self.tables.values()) + [self.answers]
+
+    def _sealed_parts(self, table):
+        """確定済みの行の集計と、その行数（足りない CHUNK があればここで集計する）"""
+        aggregates = self._aggregates[table.name]
+        with aggregates.lock:
+            sealed = table.rows - table.rows % CHUNK
+            if aggregates.parts is None or sealed > aggregates.sealed:
+                scan = scan_scores if table is not self.answers else scan_answers
+                parts = scan(table, aggregates.sealed, sealed)
+                if aggregates.parts is not None:
+                    parts = self._merge(table, aggregates.parts, parts)
+                aggregates.parts, aggregates.sealed = parts, sealed
+            return aggregates.parts, aggregates.sealed
+
+    def _merge(self, table, first, second):
+        if table is self.answers:
+            return first[0] + second[0], first[1] + second[1]
+        buckets = dict(first[1])
+        merge_buckets(buckets, second[1])
+        return first[0] + second[0], buckets
+
+    def _collect(self, table, since):
+        """since 以降（None なら全期間）の集計"""
+        scan = scan_scores if table is not self.answers else scan_answers
+        if since is not None:
+            start = table.start_of(since)
+            if start > 0:
+                return scan(table, start, table.rows)
+        parts, sealed = self._sealed_parts(table)
+        return self._merge(table, parts, scan(table, sealed, table.rows))
+
+    def summary(self, game, since=None):
+        """件数・平均・最小・最大とパーセンタイル"""
+        values, _ = self._collect(self.tables[game], since)
+        return summarize(values)
+
+    def histogram(self, game, bins=20, since=None):
+        """最小〜最大を等幅の bins 個に分けた件数"""
+        values, _ = self._collect(self.tables[game], since)
+        return histogram(values, bins)
+
+    def by_hour(self, game, since=None):
+        """時刻（0〜23時、サーバーのタイムゾーンの現地時刻）ごとの件数と平均"""
+        _, buckets = self._collect(self.tables[game], since)
+        counts = [0] * 24
+        sums = [0] * 24
+        local_hours = self._local_hours
+        for bucket, (count, score_sum) in buckets.items():
+            hour_of_day = local_hours.get(bucket)
+            if hour_of_day is None:
+                hour_of_day = local_hours[bucket] = time.localtime(bucket * BUCKET).tm_hour
+            counts[hour_of_day] += count
+            sums[hour_of_day] += score_sum
+        return [{'hour': hour, 'count': counts[hour], 'mean': sums[hour] / counts[hour] if counts[hour] else None}
+                for hour in range(24)]
+
+    def quiz_accuracy(self, since=None):
+        """問題ごとの回答数・正解数・正解率（回答のあった問題だけ）"""
+        answered, correct = self._collect(self.answers, since)
+        return [{'question': question, 'answered': count, 'correct': correct[question],
+                 'accuracy': correct[question] / count}
+                for question, count in sorted(answered.items())]
+
+    def player_summary(self, game, player):
+        """1人のプレイヤーのスコアの集計（プレイヤーの列から番号をバイト列として探す）"""
+        index = self.player_id(player, create=False)
+        if index is None:
+            return summarize(Counter())
+        table = self.tables[game]
+        rows = table.rows
+        scores = table.view('score', 0, rows)
+        return summarize(Counter(scores[row] for row in table.columns[1].positions(index, rows)))
+
+    def metrics(self):
+        return {
+            'rows': {name: table.rows for name, table in self.tables.items()},
+            'quiz_answers': self.answers.rows,
+            'players': len(self._players),
+            'bytes': sum(column.capacity * column.itemsize for table in self._all_tables() for column in table.columns),
+        }
+
+
+def summarize(values):
+    """{値: 件数} から件数・平均・最小・最大とパーセンタイルを求める"""
+    count = sum(values.values())
+    if not count:
+        return {'count': 0, 'mean': None, 'min': None, 'max': None,
+                'percentiles': {str(p): None for p in PERCENTILES}}
+    ordered = sorted(values.items())
+    percentiles = {}
+    targets = [(p, max(1, -(-p * count // 100))) for p in PERCENTILES]
+    seen = 0
+    for value, n in ordered:
+        seen += n
+        while targets and seen >= targets[0][1]:
+            percentiles[str(targets.pop(0)[0])] = value
+        if not targets:
+            break
+    return {
+        'count': count,
+        'mean': sum(value * n for value, n in ordered) / count,
+        'min': ordered[0][0],
+        'max': ordered[-1][0],
+        'percentiles': percentiles,
+    }
+
+
+def histogram(values, bins):
+    """{値: 件数} を等幅の bins 個に分ける: {'low', 'width', 'counts'}"""
+    if not values:
+        return {'low': None, 'width': None, 'counts': []}
+    low, high = min(values), max(values)
+    width = max(1, -(-(high - low + 1) // bins))
+    counts = [0] * (-(-(high - low + 1) // width))
+    for value, n in values.items():
+        counts[(value - low) // width] += n
+    return {'low': low, 'width': width, 'counts': counts}
@@ -0,0 +1,369 @@
+"""ミニゲームのランキング
+
+各ゲームのスコアは順序統計付きスキップリスト（各リンクが飛び越す要素数を持つ）で管理し、
+挿入・削除・順位の取得を O(log n)、上位N件の取得を O(log n + N) で行う。
+上位 TOP_CACHE_SIZE 件はシリアライズ済みのJSONとして別に保持し、
+その範囲に入るスコアが記録されたときだけ差分で更新する。
+
+日間・週間ランキングは期間ごとに別のランキングを持ち、期間が変わったら
+新しいランキングに差し替えるだけで切り替える（全件の削除や再集計はしない）。
+締め切った期間は後からバックグラウンドで読み取り専用の配列に詰め直す。
+"""
+import bisect
+import itertools
+import json
+import random
+import threading
+from datetime import datetime
+
+MAX_LEVEL = 16   # p=1/4 なら 4^16 件まで十分な高さ
+BRANCHING = 4
+TOP_CACHE_SIZE = 100
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level   # このリンクがレベル0で何要素分進むか
+
+
+class OrderStatisticSkipList:
+    """キーを昇順に保持し、順位で参照できるスキップリスト"""
+
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _random_level():
+        level = 1
+        while level < MAX_LEVEL and random.randrange(BRANCHING) == 0:
+            level += 1
+        return level
+
+    def insert(self, key):
+        chain = [None] * MAX_LEVEL
+        steps_at_level = [0] * MAX_LEVEL
+        node = self._head
+        for level in range(MAX_LEVEL - 1, -1, -1):
+            following = node.next[level]
+            while following is not None and following.key < key:
+                steps_at_level[level] += node.width[level]
+                node = following
+                following = node.next[level]
+            chain[level] = node
+
+        new_level = self._random_level()
+        new_node = _Node(key, new_level)
+        steps = 0
+        for level in range(new_level):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(new_level, MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """key を削除する。存在しなければ KeyError"""
+        chain = [None] * MAX_LEVEL
+        node = self._head
+        for level in range(MAX_LEVEL - 1, -1, -1):
+            following = node.next[level]
+            while following is not None and following.key < key:
+                node = following
+                following = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        target_level = len(target.next)
+        for level in range(target_level):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(target_level, MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def count_less(self, key):
+        """key より小さいキーの数（= key の0始まりの順位）"""
+        position = 0
+        node = self._head
+        for level in range(MAX_LEVEL - 1, -1, -1):
+            following = node.next[level]
+            while following is not None and following.key < key:
+                position += node.width[level]
+                node = following
+                following = node.next[level]
+        return position
+
+    def iter_from(self, index):
+        """0始まりで index 番目以降のキーを順に返す"""
+        if index >= self._size:
+            return
+        position = 0
+        node = self._head
+        target = index + 1   # 先頭ノードの位置は1
+        for level in range(MAX_LEVEL - 1, -1, -1):
+            while node.next[level] is not None and position + node.width[level] <= target:
+                position += node.width[level]
+                node = node.next[level]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+
+class Leaderboard:
+    """1ゲーム分のランキング（プレイヤーごとに自己ベストだけを保持）"""
+
+    def __init__(self, higher_is_better=True):
+        self.higher_is_better = higher_is_better
+        self._scores = OrderStatisticSkipList()
+        self._entries = {}   # {player: (並び替えキー, スコア)}
+        self._sequence = itertools.count()   # 同点なら先に記録した方が上位
+        self._lock = threading.Lock()
+        # 上位 TOP_CACHE_SIZE 件のキャッシュ
+        self._top_keys = []   # 並び替えキー（昇順 = 上位から）
+        self._top_rows = []   # 各行をシリアライズしたJSON
+        self._top_json = {}   # {件数: 行を連結したJSON配列}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _is_better(self, score, best):
+        return score > best if self.higher_is_better else score < best
+
+    def submit(self, player, score):
+        """スコアを記録し (自己ベスト更新したか, 自己ベスト, 順位) を返す"""
+        with self._lock:
+            entry = self._entries.get(player)
+            if entry is not None and not self._is_better(score, entry[1]):
+                return False, entry[1], self._scores.count_less(entry[0]) + 1
+            if entry is not None:
+                self._scores.remove(entry[0])
+            sort_score = -score if self.higher_is_better else score
+            key = (sort_score, next(self._sequence), player)
+            self._scores.insert(key)
+            self._entries[player] = (key, score)
+            self._update_top_cache(entry[0] if entry else None, key)
+            return True, score, self._scores.count_less(key) + 1
+
+    def remove(self, player):
+        with self._lock:
+            entry = self._entries.pop(player, None)
+            if entry is not None:
+                self._scores.remove(entry[0])
+                self._update_top_cache(entry[0], None)
+            return entry is not None
+
+    def _update_top_cache(self, old_key, new_key):
+        """上位キャッシュに関係する変更だけを反映する"""
+        top = self._top_keys
+        changed_from = None
+        if old_key is not None and top and old_key <= top[-1]:
+            index = bisect.bisect_left(top, old_key)
+            del top[index]
+            changed_from = index
+        if new_key is not None and (len(top) < TOP_CACHE_SIZE or new_key < top[-1]):
+            index = bisect.bisect_left(top, new_key)
+            top.insert(index, new_key)
+            del top[TOP_CACHE_SIZE:]
+            changed_from = index if changed_from is None else min(changed_from, index)
+        if len(top) < TOP_CACHE_SIZE and len(self._scores) > len(top):
+            # 上位から抜けた分を次の順位のキーで埋める
+            start = len(top)
+            top.extend(itertools.islice(self._scores.iter_from(start), TOP_CACHE_SIZE - start))
+            changed_from = start if changed_from is None else min(changed_from, start)
+        if changed_from is None:
+            return
+
+        # 変更位置より下は順位がずれるので作り直す
+        del self._top_rows[changed_from:]
+        for rank, key in enumerate(top[changed_from:], start=changed_from + 1):
+            player = key[2]
+            self._top_rows.append(json.dumps(
+                {'rank': rank, 'player': player, 'score': self._entries[player][1]},
+                ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        self._top_json = {}
+
+    def top_json(self, count):
+        """上位 count 件（TOP_CACHE_SIZE まで）をJSON配列のバイト列で返す"""
+        count = min(count, TOP_CACHE_SIZE)
+        blob = self._top_json.get(count)
+        if blob is None:
+            with self._lock:
+                blob = b'[' + b','.join(self._top_rows[:count]) + b']'
+                self._top_json[count] = blob
+        return blob
+
+    def rank(self, player):
+        """1始まりの順位。記録がなければ None"""
+        with self._lock:
+            entry = self._entries.get(player)
+            if entry is None:
+                return None
+            return self._scores.count_less(entry[0]) + 1
+
+    def ranked(self):
+        """全件を [(プレイヤー, スコア)] で上位から返す"""
+        with self._lock:
+            return [(key[2], self._entries[key[2]][1]) for key in self._scores.iter_from(0)]
+
+    def best(self, player):
+        entry = self._entries.get(player)
+        return entry[1] if entry else None
+
+    def top(self, count, offset=0):
+        """[(順位, プレイヤー, スコア)] を上位から返す"""
+        with self._lock:
+            if offset + count <= TOP_CACHE_SIZE:
+                keys = self._top_keys[offset:offset + count]
+            else:
+                keys = itertools.islice(self._scores.iter_from(offset), count)
+            return [(rank, key[2], self._entries[key[2]][1])
+                    for rank, key in enumerate(keys, start=offset + 1)]
+
+
+def _serialize_rows(rows, start_rank=1):
+    return [json.dumps({'rank': rank, 'player': player, 'score': score},
+                       ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            for rank, (player, score) in enumerate(rows, start=start_rank)]
+
+
+class ArchivedLeaderboard:
+    """締め切った期間のランキング（読み取り専用の配列）"""
+
+    def __init__(self, board):
+        rows = board.ranked()
+        self.higher_is_better = board.higher_is_better
+        self._players = [player for player, _ in rows]
+        self._scores = [score for _, score in rows]
+        self._positions = {player: index for index, player in enumerate(self._players)}
+        self._top_rows = _serialize_rows(rows[:TOP_CACHE_SIZE])
+        self._top_json = {}
+
+    def __len__(self):
+        return len(self._players)
+
+    def rank(self, player):
+        index = self._positions.get(player)
+        return index + 1 if index is not None else None
+
+    def best(self, player):
+        index = self._positions.get(player)
+        return self._scores[index] if index is not None else None
+
+    def top(self, count, offset=0):
+        return [(rank, self._players[rank - 1], self._scores[rank - 1])
+                for rank in range(offset + 1, min(offset + count, len(self._players)) + 1)]
+
+    def top_json(self, count):
+        count = min(count, TOP_CACHE_SIZE)
+        blob = self._top_json.get(count)
+        if blob is None:
+            blob = b'[' + b','.join(self._top_rows[:count]) + b']'
+            self._top_json[count] = blob
+        return blob
+
+
+def day_period(now):
+    """日の通し番号"""
+    return now.date().toordinal()
+
+
+def week_period(now):
+    """月曜始まりの週の通し番号（0001-01-01 は月曜日）"""
+    return (now.date().toordinal() - 1) // 7
+
+
+class PeriodLeaderboard:
+    """期間ごとに区切ったランキング
+
+    期間が変わったときは現在のランキングを過去分に移して空のランキングを作るだけなので、
+    切り替えは件数によらず O(1) で済む。
+    """
+
+    def __init__(self, higher_is_better, period_of, keep):
+        self.higher_is_better = higher_is_better
+        self._period_of = period_of
+        self._keep = keep   # 保持する過去の期間の数
+        self._lock = threading.Lock()
+        self.current_period = period_of(datetime.now())
+        self.current = Leaderboard(higher_is_better)
+        self._archive = {}   # {期間: Leaderboard または ArchivedLeaderboard}
+
+    def roll(self, now=None):
+        """期間が変わっていれば新しいランキングに切り替える"""
+        period = self._period_of(now or datetime.now())
+        if period == self.current_period:
+            return
+        with self._lock:
+            if period <= self.current_period:
+                return
+            self._archive[self.current_period] = self.current
+            self.current = Leaderboard(self.higher_is_better)
+            self.current_period = period
+            for old in [p for p in self._archive if p <= period - self._keep - 1]:
+                del self._archive[old]
+
+    def submit(self, player, score, now=None):
+        self.roll(now)
+        return self.current.submit(player, score)
+
+    def board(self, ago=0, now=None):
+        """ago 期間前のランキング。保持していなければ None"""
+        self.roll(now)
+        if ago == 0:
+            return self.current
+        return self._archive.get(self.current_period - ago)
+
+    def compact(self):
+        """締め切った期間を読み取り専用の配列に詰め直す"""
+        for period, board in list(self._archive.items()):
+            if isinstance(board, Leaderboard):
+                archived = ArchivedLeaderboard(board)
+                with self._lock:
+                    if self._archive.get(period) is board:
+                        self._archive[period] = archived
+
+
+class GameLeaderboards:
+    """1ゲーム分の全期間・日間・週間ランキング"""
+
+    PERIODS = ('all', 'daily', 'weekly')
+
+    def __init__(self, higher_is_better=True):
+        self.all_time = Leaderboard(higher_is_better)
+        self.daily = PeriodLeaderboard(higher_is_better, day_period, keep=7)
+        self.weekly = PeriodLeaderboard(higher_is_better, week_period, keep=4)
+
+    def submit(self, player, score):
+        """全期間の (自己ベスト更新したか, 自己ベスト, 順位) と期間別の順位を返す"""
+        result = self.all_time.submit(player, score)
+        period_ranks = {
+            'daily': self.daily.submit(player, score)[2],
+            'weekly': self.weekly.submit(player, score)[2],
+        }
+        return result, period_ranks
+
+    def board(self, period='all', ago=0):
+        if period == 'all':
+            return self.all_time if ago == 0 else None
+        return getattr(self, period).board(ago)
+
+    def maintain(self):
+        """期間の切り替えと過去分の詰め直し（スケジューラーから呼ぶ）"""
+        for periodic in (self.daily, self.weekly):
+            periodic.roll()
+            periodic.compact()
@@ -1,48 +1,64 @@
 from flask import Flask, render_template_string, jsonify, request, session, redirect, url_for, flash, make_response
 import time
-import threading
-from collections import defaultdict
 import hashlib
+import json
+import random
 import secrets
 import os
+import re
 from datetime import datetime, timedelta
+from state import AtomicCounter, StripedDict, RateMeter, UserStore, SettingsStore
+from scheduler import Scheduler
+from leaderboard import GameLeaderboards
+from sketch import KLLSketch
+from quiz import QuestionBank, QuestionDealer
+from game_sessions import GameSessionStore, NumberSession, MemorySession, RPSSession, QuizSession, RPS_MOVES
+from anticheat import ResultValidator
+from game_gateway import create_gateway, guest_identity, is_guest
+from protocol import PROTOCOL_VERSION
+import replay
+from tournament import TournamentError
+from achievements import AchievementEngine
+from gamestats import GameStats
 
 app = Flask(__name__)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app.secret_key = secrets.token_hex(16)  # セッション用のシークレットキー
 
 # 永続的なログイントークンの保存
-persistent_tokens = {}  # {token: {'username': str, 'expires': datetime}}
+persistent_tokens = StripedDict()  # {token: {'username': str, 'expires': datetime}}
 
 def cleanup_expired_tokens():
     """期限切れトークンの定期削除"""
-    global persistent_tokens
-    while True:
-        current_time = datetime.now()
-        persistent_tokens = {token: data for token, data in persistent_tokens.items()
-                           if data['expires'] > current_time}
-        time.sleep(3600)  # 1時間ごとにクリーンアップ
-
-# バックグラウンドでトークンクリーンアップを実行
-token_cleanup_thread = threading.Thread(target=cleanup_expired_tokens, daemon=True)
-token_cleanup_thread.start()
+    current_time = datetime.now()
+    persistent_tokens.prune(lambda token, data: data['expires'] <= current_time)
 
 # アクティブユーザー追跡
-active_users = defaultdict(float)
-user_counter = 0
+active_users = StripedDict()  # {user_id: last_seen}
+user_counter = AtomicCounter()
+request_rate = RateMeter(window=10)  # 直近10秒間のリクエスト数/秒
 
-# サーバー設定
-server_settings = {
+# サーバー設定（server_settings.json に保存され、ファイルを書き換えると自動で再読み込みされる）
+SETTINGS_FILE = os.environ.get('SERVER_SETTINGS_FILE', os.path.join(BASE_DIR, 'server_settings.json'))
+server_settings = SettingsStore({
     "user_timeout": 30,  # アクティブユーザーのタイムアウト時間（秒）
     "debug_mode": True,  # デバッグモード
     "max_users": 100,    # 最大同時接続ユーザー数
     "heartbeat_interval": 15,  # ハートビート間隔（秒）
+    "heartbeat_min_interval": 5,  # 負荷が低いときの最短ハートビート間隔（秒）
+    "heartbeat_max_interval": 60,  # 高負荷時の最長ハートビート間隔（秒）
+    "heartbeat_target_rps": 50,  # この毎秒リクエスト数を「高負荷」とみなす
     "maintenance_mode": False,  # メンテナンスモード
     "server_name": "GAME SERVER",  # サーバー名
     "registration_enabled": True,  # 新規登録の有効/無効
-}
+    "token_cleanup_interval": 3600,  # 期限切れトークン削除の間隔（秒）
+    "user_cleanup_interval": 10,  # 非アクティブユーザー削除の間隔（秒）
+    "settings_reload_interval": 2,  # 設定ファイルの変更チェック間隔（秒）
+    "spectator_delay": 5,  # オンライン対戦の観戦の遅延（秒、新しい部屋から反映）
+}, path=SETTINGS_FILE)
 
 # 簡単なユーザーデータベース（実際のアプリケーションではデータベースを使用してください）
-users_db = {
+users_db = UserStore({
     "admin": {
         "password_hash": hashlib.sha256("admin123".encode()).hexdigest(),
         "role": "管理者",
@@ -63,56 +79,82 @@ users_db = {
         "role": "ゲーマー",
         "user_id": "gamer_001"
     }
-}
+})
 
 def cleanup_inactive_users():
-    """非アクティブなユーザーを定期的に削除"""
-    global active_users
-    while True:
-        current_time = time.time()
-        # 設定されたタイムアウト時間以上更新がないユーザーを削除
-        timeout = server_settings.get("user_timeout", 30)
-        active_users = {uid: last_seen for uid, last_seen in active_users.items()
-                       if current_time - last_seen < timeout}
-        time.sleep(10)
-
-# バックグラウンドでクリーンアップを実行
-cleanup_thread = threading.Thread(target=cleanup_inactive_users, daemon=True)
-cleanup_thread.start()
+    """非アクティブなユーザーを削除"""
+    current_time = time.time()
+    # 設定されたタイムアウト時間以上更新がないユーザーを削除
+    timeout = server_settings.get("user_timeout", 30)
+    active_users.prune(lambda uid, last_seen: current_time - last_seen >= timeout)
+
+# バックグラウンドジョブは1本のスケジューラースレッドでまとめて実行する
+# （間隔は毎回 server_settings から読み直す）
+scheduler = Scheduler()
+scheduler.register('cleanup_expired_tokens', cleanup_expired_tokens,
+                   lambda: server_settings.get("token_cleanup_interval", 3600), jitter=0.05)
+scheduler.register('cleanup_inactive_users', cleanup_inactive_users,
+                   lambda: server_settings.get("user_cleanup_interval", 10), jitter=0.1)
+scheduler.register('reload_settings', server_settings.reload_if_changed,
+                   lambda: server_settings.get("settings_reload_interval", 2))
+scheduler.start()
 
 def verify_password(username, password):
     """ユーザー名とパスワードを検証"""
-    if username in users_db:
+    user = users_db.get(username)
+    if user is not None:
         password_hash = hashlib.sha256(password.encode()).hexdigest()
-        return password_hash == users_db[username]["password_hash"]
+        return password_hash == user["password_hash"]
     return False
 
 def get_user_info(username):
     """ユーザー情報を取得"""
-    if username in users_db:
-        return users_db[username]
-    return None
+    return users_db.get(username)
 
 def check_persistent_login():
     """永続的なログインをチェック"""
     if 'username' not in session:
         remember_token = request.cookies.get('remember_token')
-        if remember_token and remember_token in persistent_tokens:
-            token_data = persistent_tokens[remember_token]
+        token_data = persistent_tokens.get(remember_token) if remember_token else None
+        if token_data:
             if token_data['expires'] > datetime.now():
                 # トークンが有効な場合、自動ログイン
                 session['username'] = token_data['username']
                 return True
             else:
                 # 期限切れトークンを削除
-                del persistent_tokens[remember_token]
+                persistent_tokens.pop(remember_token)
     return False
 
 @app.before_request
 def before_request():
     """各リクエスト前に永続的なログインをチェック"""
+    request_rate.mark()
     check_persistent_login()
 
+def current_load():
+    """サーバー負荷を 0〜 の値で返す（1.0 で目標上限に達している）"""
+    target_rps = max(server_settings.get("heartbeat_target_rps", 50), 1)
+    load = request_rate.rate() / target_rps
+    try:
+        # CPU負荷は1分間のロードアベレージをコア数で割った値を使う
+        load = max(load, os.getloadavg()[0] / (os.cpu_count() or 1))
+    except (AttributeError, OSError):
+        pass
+    return load
+
+def next_heartbeat_interval():
+    """クライアントが次にハートビートを送るまでの秒数
+
+    暇なときは設定値の半分まで短くし、負荷が高いほど長くする。
+    全クライアントが同じタイミングで送らないよう ±15% のゆらぎを加える。
+    """
+    settings = server_settings.snapshot()
+    interval = settings["heartbeat_interval"] * (0.5 + current_load())
+    interval *= random.uniform(0.85, 1.15)
+    return round(min(max(interval, settings["heartbeat_min_interval"]),
+                     settings["heartbeat_max_interval"]), 1)
+
 # HTMLテンプレート
 template = """
 <!DOCTYPE html>
@@ -479,16 +521,27 @@ template = """
             cursor: none; /* Hide default cursor */
         }
 
+        /* Cursor position (moved with transform only) */
+        .cursor-anchor {
+            position: fixed;
+            top: 0;
+            left: 0;
+            pointer-events: none;
+            z-index: 9999;
+            mix-blend-mode: difference;
+            will-change: transform;
+        }
+
         /* Custom cursor dot */
         .custom-cursor {
-            position: fixed;
+            position: absolute;
+            left: -10px;
+            top: -10px;
             width: 20px;
             height: 20px;
             background: #00d4ff;
             border-radius: 50%;
             pointer-events: none;
-            z-index: 9999;
-            mix-blend-mode: difference;
             transition: transform 0.1s ease;
             box-shadow: 0 0 20px #00d4ff;
         }
@@ -510,13 +563,16 @@ template = """
         /* Trail cursor */
         .cursor-trail {
             position: fixed;
+            top: 0;
+            left: 0;
             width: 6px;
             height: 6px;
             background: rgba(0, 212, 255, 0.5);
             border-radius: 50%;
             pointer-events: none;
             z-index: 9998;
-            transition: all 0.3s ease;
+            transition: opacity 0.3s ease;
+            will-change: transform;
         }
 
         /* Pulsing cursor */
@@ -619,6 +675,22 @@ template = """
             box-shadow: 0 0 3px #ffffff;
         }
 
+        /* Particle avoiding the cursor */
+        .particle.evading {
+            background: #66ffcc;
+            box-shadow: 0 0 25px #66ffcc;
+        }
+
+        .particle.large.evading {
+            background: #33aaff;
+            box-shadow: 0 0 25px #33aaff;
+        }
+
+        .particle.small.evading {
+            background: #ffee88;
+            box-shadow: 0 0 25px #ffee88;
+        }
+
         @keyframes float {
             0% {
                 opacity: 0;
@@ -677,7 +749,9 @@ template = """
     <div class="bg-animation"></div>
 
     <!-- Custom Cursor -->
-    <div class="custom-cursor" id="customCursor"></div>
+    <div class="cursor-anchor" id="cursorAnchor">
+        <div class="custom-cursor" id="customCursor"></div>
+    </div>
 
     <!-- Cursor Trail -->
     <div class="cursor-trail" id="cursorTrail1"></div>
@@ -696,7 +770,7 @@ template = """
                 {% if session.username %}
                 <li><a href="/profile">プロフィール</a></li>
                 <li><a href="/minigame">😀 ミニゲーム</a></li>
-                <li><a href="/discord">Discord</a></li>
+                <li><a href="/discord">💬 チャット</a></li>
                 {% if user_data and user_data.role == '管理者' %}
                 <li><a href="/admin">管理</a></li>
                 {% endif %}
@@ -704,7 +778,7 @@ template = """
                 {% else %}
                 <li><a href="/login">ログイン</a></li>
                 <li><a href="/register">新規登録</a></li>
-                <li><a href="/discord">Discord</a></li>
+                <li><a href="/discord">💬 チャット</a></li>
                 {% endif %}
             </ul>
         </div>
@@ -767,73 +841,34 @@ template = """
     </footer>
 
     <script>
-        // マウス位置の追跡
+        // マウス位置の追跡（イベントでは記録だけして、描画はフレームループで行う）
         let mouseX = 0;
         let mouseY = 0;
-        let particles = [];
-        let particleCreationInterval = null;
-        let largeParticleCreationInterval = null;
+        let scrollY = window.pageYOffset;
 
         // カスタムカーソル要素
+        const cursorAnchor = document.getElementById('cursorAnchor');
         const customCursor = document.getElementById('customCursor');
         const cursorTrails = [
             document.getElementById('cursorTrail1'),
             document.getElementById('cursorTrail2'),
             document.getElementById('cursorTrail3')
         ];
+        const parallax = document.querySelector('.bg-animation');
 
-        let trailPositions = [
-            { x: 0, y: 0 },
-            { x: 0, y: 0 },
-            { x: 0, y: 0 }
-        ];
+        // トレイルは 50ms, 100ms, 150ms 前のマウス位置を表示する
+        const TRAIL_DELAYS = [50, 100, 150];
+        const mouseHistory = [];
 
         // カーソル効果の設定
         let currentCursorMode = 'normal'; // normal, glitch, rainbow, pulsing, rotating
-        let cursorModeInterval = null;
+        let cursorModeElapsed = 0;
 
         document.addEventListener('mousemove', (e) => {
             mouseX = e.clientX;
             mouseY = e.clientY;
-
-            // カスタムカーソルの位置更新
-            if (customCursor) {
-                customCursor.style.left = mouseX - 10 + 'px';
-                customCursor.style.top = mouseY - 10 + 'px';
-            }
-
-            // トレイル効果の更新
-            updateCursorTrail();
         });
 
-        // カーソルトレイルの更新
-        function updateCursorTrail() {
-            // 位置を遅延させてトレイル効果を作成
-            setTimeout(() => {
-                trailPositions[0] = { x: mouseX, y: mouseY };
-                if (cursorTrails[0]) {
-                    cursorTrails[0].style.left = trailPositions[0].x - 3 + 'px';
-                    cursorTrails[0].style.top = trailPositions[0].y - 3 + 'px';
-                }
-            }, 50);
-
-            setTimeout(() => {
-                trailPositions[1] = { x: mouseX, y: mouseY };
-                if (cursorTrails[1]) {
-                    cursorTrails[1].style.left = trailPositions[1].x - 3 + 'px';
-                    cursorTrails[1].style.top = trailPositions[1].y - 3 + 'px';
-                }
-            }, 100);
-
-            setTimeout(() => {
-                trailPositions[2] = { x: mouseX, y: mouseY };
-                if (cursorTrails[2]) {
-                    cursorTrails[2].style.left = trailPositions[2].x - 3 + 'px';
-                    cursorTrails[2].style.top = trailPositions[2].y - 3 + 'px';
-                }
-            }, 150);
-        }
-
         // マウスクリック時の効果
         document.addEventListener('mousedown', () => {
             if (customCursor) {
@@ -882,50 +917,85 @@ template = """
             currentCursorMode = randomMode;
         }
 
-        // 10秒ごとにカーソルモードを変更
-        cursorModeInterval = setInterval(changeCursorMode, 10000);
+        // トレイル用にマウス位置の履歴を残す（150ms より古いものは捨てる）
+        function recordMouseHistory(now) {
+            mouseHistory.push({ x: mouseX, y: mouseY, t: now });
+            while (mouseHistory.length > 2 && now - mouseHistory[1].t > TRAIL_DELAYS[TRAIL_DELAYS.length - 1]) {
+                mouseHistory.shift();
+            }
+        }
+
+        function mousePositionAt(time) {
+            for (let i = mouseHistory.length - 1; i >= 0; i--) {
+                if (mouseHistory[i].t <= time) {
+                    return mouseHistory[i];
+                }
+            }
+            return mouseHistory[0];
+        }
+
+        // マグネット効果用のボタン位置はスクロール・リサイズ時だけ測り直す
+        let buttonCenters = null;
+
+        function measureButtons() {
+            buttonCenters = [];
+            document.querySelectorAll('button, .play-button, .cta-button').forEach(button => {
+                const rect = button.getBoundingClientRect();
+                buttonCenters.push({ x: rect.left + rect.width / 2, y: rect.top + rect.height / 2 });
+            });
+        }
+
+        window.addEventListener('resize', () => { buttonCenters = null; });
 
         // マグネット効果（ボタンに近づくとカーソルが引き寄せられる）
-        function updateMagneticCursor() {
-            const buttons = document.querySelectorAll('button, .play-button, .cta-button');
+        function magneticPull() {
+            if (!buttonCenters) {
+                measureButtons();
+            }
+
             let closestButton = null;
             let minDistance = Infinity;
 
-            buttons.forEach(button => {
-                const rect = button.getBoundingClientRect();
-                const buttonCenterX = rect.left + rect.width / 2;
-                const buttonCenterY = rect.top + rect.height / 2;
-                const distance = Math.sqrt(
-                    Math.pow(mouseX - buttonCenterX, 2) +
-                    Math.pow(mouseY - buttonCenterY, 2)
-                );
-
+            buttonCenters.forEach(center => {
+                const distance = Math.hypot(mouseX - center.x, mouseY - center.y);
                 if (distance < 100 && distance < minDistance) {
                     minDistance = distance;
-                    closestButton = { x: buttonCenterX, y: buttonCenterY, distance };
+                    closestButton = { x: center.x, y: center.y, distance };
                 }
             });
 
-            if (closestButton && customCursor) {
-                const pullStrength = Math.max(0, (100 - closestButton.distance) / 100);
-                const pullX = (closestButton.x - mouseX) * pullStrength * 0.3;
-                const pullY = (closestButton.y - mouseY) * pullStrength * 0.3;
-
-                customCursor.style.transform = `translate(${pullX}px, ${pullY}px)`;
-                customCursor.classList.add('magnetic');
-            } else if (customCursor) {
-                customCursor.style.transform = 'translate(0, 0)';
-                customCursor.classList.remove('magnetic');
+            if (!closestButton) {
+                return null;
             }
+            const pullStrength = Math.max(0, (100 - closestButton.distance) / 100);
+            return {
+                x: (closestButton.x - mouseX) * pullStrength * 0.3,
+                y: (closestButton.y - mouseY) * pullStrength * 0.3
+            };
         }
 
-        // マグネット効果を定期的に更新
-        setInterval(updateMagneticCursor, 16); // 60fps
+        // パーティクル（DOM要素はプールして使い回し、transform と opacity だけを書き換える）
+        const PARTICLE_POOL_SIZE = 60;
+        const particleContainer = document.getElementById('particles');
+        const particlePool = [];
+        let particles = [];
 
-        // パーティクルクラス
         class InteractiveParticle {
-            constructor(type) {
+            constructor() {
                 this.element = document.createElement('div');
+                this.element.style.position = 'absolute';
+                this.element.style.left = '0';
+                this.element.style.top = '0';
+                this.element.style.pointerEvents = 'none';
+                this.element.style.zIndex = '1';
+                this.element.style.opacity = '0';
+                this.element.style.willChange = 'transform, opacity';
+                // アニメーションを無効化してJS制御に切り替え
+                this.element.style.animation = 'none';
+                particleContainer.appendChild(this.element);
+            }
+
+            reset(type) {
                 this.type = type;
                 this.x = Math.random() * window.innerWidth;
                 this.y = window.innerHeight + 50;
@@ -936,10 +1006,8 @@ template = """
                 this.life = 0;
                 this.maxLife = this.getMaxLife();
                 this.avoidDistance = this.getAvoidDistance();
-
+                this.evading = false;
                 this.element.className = type;
-                this.setupElement();
-                document.getElementById('particles').appendChild(this.element);
             }
 
             getMaxLife() {
@@ -954,22 +1022,12 @@ template = """
                 return 100;
             }
 
-            setupElement() {
-                this.element.style.position = 'absolute';
-                this.element.style.left = this.x + 'px';
-                this.element.style.top = this.y + 'px';
-                this.element.style.pointerEvents = 'none';
-                this.element.style.zIndex = '1';
-
-                // アニメーションを無効化してJS制御に切り替え
-                this.element.style.animation = 'none';
-            }
-
-            update() {
+            update(effectLevel) {
                 // マウスとの距離を計算
                 const dx = mouseX - this.x;
                 const dy = mouseY - this.y;
                 const distance = Math.sqrt(dx * dx + dy * dy);
+                let transform = '';
 
                 // マウスが近い場合の回避処理
                 if (distance < this.avoidDistance && distance > 0) {
@@ -984,37 +1042,22 @@ template = """
                     this.vx = this.originalVx + avoidX;
                     this.vy = this.originalVy + avoidY;
 
-                    // より派手なビジュアル効果
-                    const scaleEffect = 1 + avoidForce * 0.8;
-                    const rotationEffect = avoidForce * 180;
-                    const glowEffect = 15 + avoidForce * 25;
-
-                    this.element.style.transform = `scale(${scaleEffect}) rotate(${rotationEffect}deg)`;
-                    this.element.style.boxShadow = `0 0 ${glowEffect}px currentColor`;
-
-                    // 色の変化も追加
-                    if (this.type.includes('large')) {
-                        this.element.style.background = `hsl(${200 + avoidForce * 60}, 100%, 60%)`;
-                    } else if (this.type.includes('small')) {
-                        this.element.style.background = `hsl(${0 + avoidForce * 60}, 100%, 80%)`;
-                    } else {
-                        this.element.style.background = `hsl(${180 + avoidForce * 80}, 100%, 70%)`;
+                    // 拡大・回転は負荷が高いときは省略する
+                    if (effectLevel > 1) {
+                        transform = ` scale(${1 + avoidForce * 0.8}) rotate(${avoidForce * 180}deg)`;
+                    }
+                    if (!this.evading) {
+                        this.evading = true;
+                        this.element.classList.add('evading');
                     }
                 } else {
                     // 元の動きに戻る（スムーズに減速）
                     this.vx = this.vx * 0.95 + this.originalVx * 0.05;
                     this.vy = this.vy * 0.95 + this.originalVy * 0.05;
 
-                    this.element.style.transform = 'scale(1) rotate(0deg)';
-                    this.element.style.boxShadow = '0 0 6px currentColor';
-
-                    // 元の色に戻す
-                    if (this.type.includes('large')) {
-                        this.element.style.background = '#0099ff';
-                    } else if (this.type.includes('small')) {
-                        this.element.style.background = '#ffffff';
-                    } else {
-                        this.element.style.background = '#00d4ff';
+                    if (this.evading) {
+                        this.evading = false;
+                        this.element.classList.remove('evading');
                     }
                 }
 
@@ -1028,37 +1071,45 @@ template = """
                                this.life > this.maxLife - 20 ? (this.maxLife - this.life) / 20 : 1;
 
                 this.element.style.opacity = Math.max(0, Math.min(1, opacity));
-                this.element.style.left = this.x + 'px';
-                this.element.style.top = this.y + 'px';
+                this.element.style.transform = `translate3d(${this.x}px, ${this.y}px, 0)` + transform;
 
-                // 画面外または寿命が尽きた場合は削除
+                // 画面外または寿命が尽きた場合は終了
                 return this.life < this.maxLife && this.y > -50 && this.x > -50 && this.x < window.innerWidth + 50;
             }
 
-            destroy() {
-                if (this.element && this.element.parentNode) {
-                    this.element.parentNode.removeChild(this.element);
-                }
+            release() {
+                this.element.style.opacity = '0';
+                particlePool.push(this);
             }
         }
 
-        // パーティクル生成と更新
-        function createParticle() {
-            const types = ['particle', 'particle large', 'particle small'];
-            const type = types[Math.floor(Math.random() * types.length)];
-            const particle = new InteractiveParticle(type);
+        for (let i = 0; i < PARTICLE_POOL_SIZE; i++) {
+            particlePool.push(new InteractiveParticle());
+        }
+
+        // パーティクル生成（プールが空なら生成しない）
+        function createParticle(type) {
+            const particle = particlePool.pop();
+            if (!particle) {
+                return;
+            }
+            particle.reset(type);
             particles.push(particle);
         }
 
-        function updateParticles() {
+        function createRandomParticle() {
+            const types = ['particle', 'particle large', 'particle small'];
+            createParticle(types[Math.floor(Math.random() * types.length)]);
+        }
+
+        function updateParticles(effectLevel) {
             particles = particles.filter(particle => {
-                if (!particle.update()) {
-                    particle.destroy();
+                if (!particle.update(effectLevel)) {
+                    particle.release();
                     return false;
                 }
                 return true;
             });
-            requestAnimationFrame(updateParticles);
         }
 
         // Smooth scrolling
@@ -1074,42 +1125,145 @@ template = """
             });
         });
 
-        // Parallax effect
+        // Parallax effect（位置はフレームループでまとめて反映）
         window.addEventListener('scroll', () => {
-            const scrolled = window.pageYOffset;
-            const parallax = document.querySelector('.bg-animation');
-            const speed = scrolled * 0.5;
-            parallax.style.transform = `translateY(${speed}px)`;
+            scrollY = window.pageYOffset;
+            buttonCenters = null;
         });
 
         // スリープ状態の管理
         let isAsleep = false;
 
-        // パーティクルシステムの開始
-        function startParticleSystem() {
-            if (particleCreationInterval) clearInterval(particleCreationInterval);
-            if (largeParticleCreationInterval) clearInterval(largeParticleCreationInterval);
+        // 描画はすべてこの requestAnimationFrame ループ1本で行う。
+        // フレーム時間が長い状態が続くと effectLevel を下げて演出を減らす。
+        //   2: すべての演出 / 1: パーティクル数を半分にして拡大・回転を省略 / 0: トレイルとパーティクルを停止
+        const FRAME_BUDGET = 20; // ms（これを超えるフレームが続いたら演出を減らす）
+        let effectLevel = 2;
+        let averageFrameTime = 16;
+        let lastFrameTime = null;
+        let levelChangedAt = 0;
+        let particleSpawnElapsed = 0;
+        let largeParticleSpawnElapsed = 0;
+        let renderFrame = null;
+
+        function adjustEffectLevel(now, frameTime) {
+            averageFrameTime = averageFrameTime * 0.9 + frameTime * 0.1;
+            if (now - levelChangedAt < 1000) {
+                return;
+            }
+            let level = effectLevel;
+            if (averageFrameTime > FRAME_BUDGET && effectLevel > 0) {
+                level--;
+            } else if (averageFrameTime < 14 && effectLevel < 2) {
+                level++;
+            }
+            if (level === effectLevel) {
+                return;
+            }
+            effectLevel = level;
+            levelChangedAt = now;
+            cursorTrails.forEach(trail => {
+                if (trail) trail.style.opacity = effectLevel > 0 ? '' : '0';
+            });
+        }
+
+        function renderLoop(now) {
+            // タブ復帰直後などの長い間隔は 100ms に切り詰める
+            const frameTime = lastFrameTime === null ? 16 : Math.min(now - lastFrameTime, 100);
+            lastFrameTime = now;
+            adjustEffectLevel(now, frameTime);
+
+            // 読み取り（レイアウトを参照する処理は書き込みより前にまとめる）
+            recordMouseHistory(now);
+            const pull = magneticPull();
+
+            // 10秒ごとにカーソルモードを変更
+            cursorModeElapsed += frameTime;
+            if (cursorModeElapsed >= 10000) {
+                cursorModeElapsed = 0;
+                changeCursorMode();
+            }
+
+            // パーティクル生成（通常 800ms ごと、大きなものは 3000ms ごと）
+            if (!isAsleep && effectLevel > 0) {
+                const maxParticles = effectLevel > 1 ? PARTICLE_POOL_SIZE : PARTICLE_POOL_SIZE / 2;
+                particleSpawnElapsed += frameTime;
+                largeParticleSpawnElapsed += frameTime;
+                if (particleSpawnElapsed >= 800) {
+                    particleSpawnElapsed = 0;
+                    if (particles.length < maxParticles) createRandomParticle();
+                }
+                if (largeParticleSpawnElapsed >= 3000) {
+                    largeParticleSpawnElapsed = 0;
+                    if (particles.length < maxParticles) createParticle('particle large');
+                }
+            }
 
-            particleCreationInterval = setInterval(createParticle, 800);
+            // 書き込み（transform と opacity のみ）
+            if (cursorAnchor) {
+                const offsetX = pull ? pull.x : 0;
+                const offsetY = pull ? pull.y : 0;
+                cursorAnchor.style.transform = `translate3d(${mouseX + offsetX}px, ${mouseY + offsetY}px, 0)`;
+                if (customCursor) {
+                    customCursor.classList.toggle('magnetic', pull !== null);
+                }
+            }
 
-            // 大きなパーティクルを時々生成
-            largeParticleCreationInterval = setInterval(() => {
-                const particle = new InteractiveParticle('particle large');
-                particles.push(particle);
-            }, 3000);
+            if (effectLevel > 0) {
+                cursorTrails.forEach((trail, index) => {
+                    const position = mousePositionAt(now - TRAIL_DELAYS[index]);
+                    if (trail && position) {
+                        trail.style.transform = `translate3d(${position.x - 3}px, ${position.y - 3}px, 0)`;
+                    }
+                });
+            }
+
+            updateParticles(effectLevel);
+
+            if (parallax) {
+                parallax.style.transform = `translate3d(0, ${scrollY * 0.5}px, 0)`;
+            }
+
+            renderFrame = requestAnimationFrame(renderLoop);
         }
 
-        // パーティクルシステムを開始
-        startParticleSystem();
+        function startRenderLoop() {
+            if (renderFrame === null) {
+                lastFrameTime = null;
+                renderFrame = requestAnimationFrame(renderLoop);
+            }
+        }
+
+        function stopRenderLoop() {
+            cancelAnimationFrame(renderFrame);
+            renderFrame = null;
+        }
 
         // アニメーションループの開始
-        updateParticles();
+        startRenderLoop();
 
         // Real-time active users tracking
+        // 次のハートビートまでの間隔はサーバーが負荷に応じて指定する
+        let heartbeatInterval = {{ heartbeat_interval }};
+        let heartbeatTimer = null;
+
+        function scheduleHeartbeat() {
+            clearTimeout(heartbeatTimer);
+            heartbeatTimer = null;
+            // 非表示になる前に送ったリクエストの完了で、止めたポーリングを再開しない
+            if (document.hidden) {
+                return;
+            }
+            heartbeatTimer = setTimeout(updateActiveUsers, heartbeatInterval * 1000);
+        }
+
         function updateActiveUsers() {
             fetch('/heartbeat')
                 .then(response => response.json())
                 .then(data => {
+                    if (data.next_interval) {
+                        heartbeatInterval = data.next_interval;
+                    }
                     const activeCount = data.active_users;
                     document.getElementById('active-users').textContent = activeCount;
 
@@ -1120,21 +1274,15 @@ template = """
                         exitSleepMode();
                     }
                 })
-                .catch(error => console.log('Error updating active users:', error));
+                .catch(error => console.log('Error updating active users:', error))
+                .finally(scheduleHeartbeat);
         }
 
         // スリープモードに入る
         function enterSleepMode() {
+            // パーティクル生成を停止（renderLoop が isAsleep を見て生成しなくなる）
             isAsleep = true;
 
-            // パーティクル生成を停止
-            if (particleCreationInterval) {
-                clearInterval(particleCreationInterval);
-            }
-            if (largeParticleCreationInterval) {
-                clearInterval(largeParticleCreationInterval);
-            }
-
             // 既存のパーティクルを徐々に削除
             particles.forEach(particle => {
                 particle.maxLife = Math.min(particle.maxLife, particle.life + 100);
@@ -1144,16 +1292,31 @@ template = """
         // スリープモードから復帰
         function exitSleepMode() {
             isAsleep = false;
-
-            // パーティクル生成を再開
-            startParticleSystem();
         }
 
-        // 初回実行
+        // 初回実行（以降は scheduleHeartbeat で次回を予約）
         updateActiveUsers();
 
-        // 15秒ごとに更新
-        setInterval(updateActiveUsers, 15000);
+        // タブが非表示の間はハートビートと描画ループを止める
+        function suspendPage() {
+            clearTimeout(heartbeatTimer);
+            heartbeatTimer = null;
+            navigator.sendBeacon('/heartbeat?state=away');
+            stopRenderLoop();
+        }
+
+        function resumePage() {
+            startRenderLoop();
+            updateActiveUsers();
+        }
+
+        document.addEventListener('visibilitychange', () => {
+            if (document.hidden) {
+                suspendPage();
+            } else {
+                resumePage();
+            }
+        });
 
         // Scroll animations
         function animateOnScroll() {
@@ -1593,7 +1756,7 @@ discord_template = """
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Discord - GAME SERVER</title>
+    <title>チャット - GAME SERVER</title>
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Orbitron:wght@400;700;900&display=swap');
 
@@ -1638,10 +1801,81 @@ discord_template = """
             border: 1px solid rgba(0, 212, 255, 0.3);
             backdrop-filter: blur(10px);
             text-align: center;
-            max-width: 500px;
+            max-width: 700px;
             width: 90%;
         }
 
+        .chat-rooms {
+            display: flex;
+            gap: 0.5rem;
+            justify-content: center;
+            margin-bottom: 1rem;
+        }
+
+        .chat-room-button {
+            padding: 0.5rem 1rem;
+            background: transparent;
+            color: #00d4ff;
+            border: 1px solid #00d4ff;
+            border-radius: 20px;
+            cursor: pointer;
+            font-family: inherit;
+        }
+
+        .chat-room-button.active {
+            background: #00d4ff;
+            color: #000;
+        }
+
+        #chat-messages {
+            list-style: none;
+            height: 320px;
+            overflow-y: auto;
+            text-align: left;
+            background: rgba(0, 0, 0, 0.3);
+            border-radius: 10px;
+            padding: 1rem;
+            margin-bottom: 1rem;
+            font-family: sans-serif;
+            font-size: 0.95rem;
+        }
+
+        #chat-messages li {
+            margin-bottom: 0.4rem;
+            word-break: break-word;
+        }
+
+        #chat-messages .chat-player {
+            color: #00d4ff;
+            margin-right: 0.5rem;
+        }
+
+        #chat-messages .chat-notice {
+            color: #888;
+            font-style: italic;
+        }
+
+        .chat-form {
+            display: flex;
+            gap: 0.5rem;
+        }
+
+        .chat-form input {
+            flex: 1;
+            padding: 0.7rem;
+            border-radius: 10px;
+            border: 1px solid rgba(0, 212, 255, 0.3);
+            background: rgba(255, 255, 255, 0.1);
+            color: #fff;
+        }
+
+        #chat-status {
+            min-height: 1.5rem;
+            margin: 0.5rem 0 1rem;
+            font-size: 0.85rem;
+            color: #ff6b6b;
+        }
+
         .discord-icon {
             font-size: 4rem;
             color: #5865F2;
@@ -1702,14 +1936,105 @@ discord_template = """
 
     <div class="container">
         <div class="discord-icon">💬</div>
-        <h1>Discord コミュニティ</h1>
-        <p>GAME SERVERの公式Discordサーバーに参加して、他のプレイヤーと交流しましょう！</p>
-        <p>最新のゲームを楽しみましょう!</p>
+        <h1>ロビーチャット</h1>
+        <div class="chat-rooms">
+            <button class="chat-room-button" data-room="lobby" onclick="openChatRoom('lobby')">ロビー</button>
+            <button class="chat-room-button" data-room="rps" onclick="openChatRoom('rps')">じゃんけん</button>
+            <button class="chat-room-button" data-room="color" onclick="openChatRoom('color')">カラーレース</button>
+        </div>
+        <ul id="chat-messages"></ul>
+        <form class="chat-form" onsubmit="sendChatMessage(event)">
+            <input id="chat-input" maxlength="200" placeholder="ログインすると発言できます" disabled>
+            <button class="chat-room-button" id="chat-send" type="submit" disabled>送信</button>
+        </form>
+        <div id="chat-status"></div>
 
+        <p>GAME SERVERの公式Discordサーバーでも、他のプレイヤーと交流できます！</p>
         <a href="https://discord.gg/2CWewd3WAd" class="discord-button" target="_blank">Discordに参加</a>
         <br>
         <a href="/" class="back-button">ホームに戻る</a>
     </div>
+
+    <script>
+        // チャットはゲーム用ゲートウェイ（別ポート）の SSE で受け取る。
+        // 再接続は EventSource が自動で行い、最後に受け取った id（Last-Event-ID）の続きから届く
+        const chatServer = `${location.protocol}//${location.hostname}:{{ gateway_port }}`;
+        let chatSource = null;
+        let chatRoom = null;
+
+        function setChatStatus(text) {
+            document.getElementById('chat-status').textContent = text;
+        }
+
+        function appendChatLine(player, text, notice) {
+            const list = document.getElementById('chat-messages');
+            const stick = list.scrollTop + list.clientHeight >= list.scrollHeight - 10;
+            const item = document.createElement('li');
+            if (notice) {
+                item.className = 'chat-notice';
+                item.textContent = text;
+            } else {
+                const name = document.createElement('span');
+                name.className = 'chat-player';
+                name.textContent = player;
+                item.appendChild(name);
+                item.appendChild(document.createTextNode(text));
+            }
+            list.appendChild(item);
+            if (stick) list.scrollTop = list.scrollHeight;
+        }
+
+        function openChatRoom(room) {
+            if (chatSource) chatSource.close();
+            chatRoom = room;
+            document.querySelectorAll('.chat-room-button[data-room]').forEach(button => {
+                button.classList.toggle('active', button.dataset.room === room);
+            });
+            document.getElementById('chat-messages').innerHTML = '';
+            chatSource = new EventSource(`${chatServer}/chat/events?room=${room}`, { withCredentials: true });
+            chatSource.addEventListener('hello', event => {
+                const hello = JSON.parse(event.data);
+                document.getElementById('chat-input').disabled = !hello.can_post;
+                document.getElementById('chat-send').disabled = !hello.can_post;
+                document.getElementById('chat-input').placeholder = hello.can_post
+                    ? 'メッセージを入力' : 'ログインすると発言できます';
+                setChatStatus('');
+            });
+            chatSource.addEventListener('message', event => {
+                const message = JSON.parse(event.data);
+                appendChatLine(message.player, message.text, false);
+            });
+            chatSource.addEventListener('gap', () => {
+                appendChatLine(null, '（接続が切れている間のメッセージの一部は表示できません）', true);
+            });
+            chatSource.addEventListener('reset', () => {
+                document.getElementById('chat-messages').innerHTML = '';
+            });
+            chatSource.onerror = () => setChatStatus('チャットサーバーに再接続しています...');
+        }
+
+        async function sendChatMessage(event) {
+            event.preventDefault();
+            const input = document.getElementById('chat-input');
+            const text = input.value.trim();
+            if (!text) return;
+            try {
+                const response = await fetch(`${chatServer}/chat/messages?room=${chatRoom}`, {
+                    method: 'POST', credentials: 'include', body: text
+                });
+                if (response.ok) {
+                    input.value = '';
+                    setChatStatus('');
+                } else {
+                    setChatStatus((await response.json()).error);
+                }
+            } catch (e) {
+                setChatStatus('送信できませんでした');
+            }
+        }
+
+        openChatRoom('lobby');
+    </script>
 </body>
 </html>
 """
@@ -1904,6 +2229,22 @@ minigame_template = """
             display: block;
         }
 
+        /* ランキング */
+        .leaderboard-panel ol {
+            max-width: 400px;
+            margin: 1rem auto 0;
+            text-align: left;
+        }
+
+        .leaderboard-panel li {
+            padding: 0.3rem 0;
+            border-bottom: 1px solid rgba(0, 212, 255, 0.2);
+        }
+
+        .leaderboard-panel li.me {
+            color: #00ff88;
+        }
+
         .memory-game {
             display: grid;
             grid-template-columns: repeat(4, 1fr);
@@ -1961,7 +2302,7 @@ minigame_template = """
                 <li><a href="/">ホーム</a></li>
                 <li><a href="/profile">プロフィール</a></li>
                 <li><a href="/minigame" style="color: #00d4ff;">😀 ミニゲーム</a></li>
-                <li><a href="/discord">Discord</a></li>
+                <li><a href="/discord">💬 チャット</a></li>
             </ul>
         </div>
     </nav>
@@ -2057,7 +2398,11 @@ minigame_template = """
                 <button class="play-button" onclick="playRPS('scissors')" style="margin: 0.5rem;">✌️ チョキ</button>
             </div>
             <div id="rps-result" style="margin: 1rem 0; font-size: 1.5rem;"></div>
+            <div id="rps-online-status" style="margin: 1rem 0; color: #00d4ff;"></div>
+            <button class="play-button" id="rps-online-button" onclick="playOnlineRPS()" style="margin-top: 1rem;">🌐 オンライン対戦</button>
+            <button class="play-button" onclick="loadRPSTournaments()" style="margin-top: 1rem;">🏆 トーナメント</button>
             <button class="play-button" onclick="resetRPSGame()" style="margin-top: 1rem;">リセット</button>
+            <ul id="rps-tournaments" style="list-style: none; margin: 1rem 0;"></ul>
             <button class="play-button" onclick="hideGame()" style="margin-top: 1rem; background: #ff6b6b;">戻る</button>
         </div>
 
@@ -2086,7 +2431,12 @@ minigame_template = """
             <div id="color-display" style="font-size: 3rem; margin: 2rem 0; min-height: 120px; display: flex; align-items: center; justify-content: center; background: rgba(255,255,255,0.05); border-radius: 15px; padding: 2rem;"></div>
             <div id="color-options" style="margin: 2rem 0;"></div>
             <div id="color-result" style="margin: 1rem 0; font-size: 1.2rem; min-height: 30px;"></div>
+            <div id="color-race-status" style="margin: 1rem 0; color: #00d4ff;"></div>
+            <ol id="color-race-standings" style="text-align: left; display: inline-block;"></ol>
+            <div></div>
             <button class="play-button" onclick="startColorGameRound()" style="margin-top: 1rem;">スタート</button>
+            <button class="play-button" id="color-race-button" onclick="playColorRace()" style="margin-top: 1rem;">🌐 オンライン対戦</button>
+            <button class="play-button" id="color-spectate-button" onclick="spectateColorRace()" style="margin-top: 1rem;">👀 観戦</button>
             <button class="play-button" onclick="hideGame()" style="margin-top: 1rem; background: #ff6b6b;">戻る</button>
         </div>
 
@@ -2104,13 +2454,107 @@ minigame_template = """
             <button class="play-button" onclick="hideGame()" style="margin-top: 1rem; background: #ff6b6b;">戻る</button>
         </div>
 
+        <!-- ランキング -->
+        <div id="leaderboard-panel" class="game-area leaderboard-panel">
+            <h2>🏆 ランキング</h2>
+            <div style="margin-top: 1rem;">
+                <button class="play-button" onclick="showLeaderboardPeriod('daily')">今日</button>
+                <button class="play-button" onclick="showLeaderboardPeriod('weekly')">今週</button>
+                <button class="play-button" onclick="showLeaderboardPeriod('all')">全期間</button>
+            </div>
+            <div id="score-status" style="margin: 1rem 0; min-height: 24px;"></div>
+            <ol id="leaderboard-list"></ol>
+        </div>
+
         <a href="/" class="back-button">ホームに戻る</a>
     </div>
 
     <script>
-        // 記憶ゲーム
-        let memoryCards = [];
+        // スコア送信とランキング表示
+        let leaderboardGame = null;
+        let leaderboardPeriod = 'all';
+
+        function showLeaderboardPeriod(period) {
+            leaderboardPeriod = period;
+            if (leaderboardGame) {
+                loadLeaderboard(leaderboardGame);
+            }
+        }
+
+        function loadLeaderboard(game) {
+            leaderboardGame = game;
+            document.getElementById('leaderboard-panel').classList.add('active');
+            fetch(`/api/games/${game}/leaderboard?limit=10&period=${leaderboardPeriod}`)
+                .then(response => response.json())
+                .then(data => {
+                    const list = document.getElementById('leaderboard-list');
+                    list.innerHTML = '';
+                    data.entries.forEach(entry => {
+                        const item = document.createElement('li');
+                        item.textContent = `${entry.rank}. ${entry.player} - ${entry.score}`;
+                        if (data.me && data.me.rank === entry.rank) {
+                            item.classList.add('me');
+                        }
+                        list.appendChild(item);
+                    });
+                    if (data.entries.length === 0) {
+                        list.innerHTML = '<li>まだ記録がありません</li>';
+                    }
+                })
+                .catch(error => console.log('Error loading leaderboard:', error));
+        }
+
+        // extra はスコアと一緒に送る項目（クイズのセッションIDなど）
+        function submitScore(game, score, extra) {
+            const status = document.getElementById('score-status');
+            return fetch(`/api/games/${game}/score`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(Object.assign({ score: score }, extra))
+            })
+                .then(response => {
+                    if (response.status === 401) {
+                        status.textContent = 'ログインするとスコアがランキングに記録されます';
+                        return null;
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    if (!data || data.error) {
+                        return;
+                    }
+                    showScoreResult(data);
+                    return data;
+                })
+                .catch(error => console.log('Error submitting score:', error));
+        }
+
+        // サーバーが記録したスコアの結果を表示
+        function showScoreResult(data) {
+            const status = document.getElementById('score-status');
+            if (data.pending) {
+                // 不正チェックを通るとランキングに載る（チェックは数秒ごと）
+                status.textContent = 'スコアを確認中です。確認が済むとランキングに載ります';
+                setTimeout(() => loadLeaderboard(data.game), 3000);
+                return;
+            }
+            status.textContent = `${data.improved ? '🎉 自己ベスト更新！ ' : ''}自己ベスト: ${data.best}（${data.rank}位 / ${data.total}人）` +
+                ` 今日: ${data.period_ranks.daily}位 / 今週: ${data.period_ranks.weekly}位`;
+            loadLeaderboard(data.game);
+        }
+
+        function postJSON(url, body) {
+            return fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body)
+            }).then(response => response.json());
+        }
+
+        // 記憶ゲーム（カードの配置はサーバーのセッションだけが知っている）
+        let memorySession = null;
         let flippedCards = [];
+        let memoryBusy = false;
         let matchedPairs = 0;
         let memoryScore = 0;
         let memoryAttempts = 0;
@@ -2118,55 +2562,74 @@ minigame_template = """
 
         function startMemoryGame() {
             document.getElementById('memory-game-area').classList.add('active');
+            loadLeaderboard('memory');
             initMemoryGame();
         }
 
         function initMemoryGame() {
             const gameBoard = document.getElementById('memory-game');
             gameBoard.innerHTML = '';
-            memoryCards = [...memorySymbols, ...memorySymbols];
-            memoryCards.sort(() => Math.random() - 0.5);
             flippedCards = [];
+            memoryBusy = false;
             matchedPairs = 0;
             memoryScore = 0;
             memoryAttempts = 0;
             updateMemoryStats();
 
-            memoryCards.forEach((symbol, index) => {
-                const card = document.createElement('div');
-                card.className = 'memory-card';
-                card.dataset.symbol = symbol;
-                card.dataset.index = index;
-                card.addEventListener('click', flipCard);
-                gameBoard.appendChild(card);
-            });
+            postJSON('/api/games/memory/session', {})
+                .then(data => {
+                    memorySession = data.session;
+                    for (let index = 0; index < data.cards; index++) {
+                        const card = document.createElement('div');
+                        card.className = 'memory-card';
+                        card.dataset.index = index;
+                        card.addEventListener('click', flipCard);
+                        gameBoard.appendChild(card);
+                    }
+                })
+                .catch(error => console.log('Error starting memory game:', error));
         }
 
         function flipCard(e) {
             const card = e.target;
-            if (card.classList.contains('flipped') || card.classList.contains('matched') || flippedCards.length >= 2) {
+            if (memoryBusy || card.classList.contains('flipped') || card.classList.contains('matched') || flippedCards.length >= 2) {
                 return;
             }
 
-            card.classList.add('flipped');
-            card.textContent = card.dataset.symbol;
-            flippedCards.push(card);
-
-            if (flippedCards.length === 2) {
-                memoryAttempts++;
-                updateMemoryStats();
-                setTimeout(checkMatch, 1000);
-            }
+            memoryBusy = true;
+            postJSON('/api/games/memory/flip', { session: memorySession, index: Number(card.dataset.index) })
+                .then(data => {
+                    memoryBusy = false;
+                    if (data.error) {
+                        return;
+                    }
+                    card.classList.add('flipped');
+                    card.textContent = memorySymbols[data.symbol];
+                    flippedCards.push(card);
+
+                    if (data.matched !== null) {
+                        memoryAttempts = data.attempts;
+                        updateMemoryStats();
+                        setTimeout(() => checkMatch(data), 1000);
+                    }
+                })
+                .catch(error => {
+                    memoryBusy = false;
+                    console.log('Error flipping card:', error);
+                });
         }
 
-        function checkMatch() {
+        function checkMatch(data) {
             const [card1, card2] = flippedCards;
-            if (card1.dataset.symbol === card2.dataset.symbol) {
+            if (data.matched) {
                 card1.classList.add('matched');
                 card2.classList.add('matched');
                 matchedPairs++;
                 memoryScore += 10;
-                if (matchedPairs === memorySymbols.length) {
+                if (data.finished) {
+                    if (data.score) {
+                        showScoreResult(data.score);
+                    }
                     setTimeout(() => alert('おめでとう！ゲームクリア！'), 500);
                 }
             } else {
@@ -2188,21 +2651,24 @@ minigame_template = """
             initMemoryGame();
         }
 
-        // 数字当てゲーム
-        let targetNumber = 0;
+        // 数字当てゲーム（正解はサーバーのセッションだけが知っている）
+        let numberSession = null;
         let numberAttempts = 0;
 
         function startNumberGame() {
             document.getElementById('number-game-area').classList.add('active');
+            loadLeaderboard('number');
             resetNumberGame();
         }
 
         function resetNumberGame() {
-            targetNumber = Math.floor(Math.random() * 100) + 1;
             numberAttempts = 0;
             document.getElementById('number-input').value = '';
             document.getElementById('number-result').textContent = '';
             document.getElementById('number-attempts').textContent = '0';
+            postJSON('/api/games/number/session', {})
+                .then(data => { numberSession = data.session; })
+                .catch(error => console.log('Error starting number game:', error));
         }
 
         function guessNumber() {
@@ -2216,58 +2682,87 @@ minigame_template = """
                 return;
             }
 
-            numberAttempts++;
-            document.getElementById('number-attempts').textContent = numberAttempts;
-
-            if (guess === targetNumber) {
-                result.textContent = `🎉 正解！${numberAttempts}回で当てました！`;
-                result.style.color = '#00ff88';
-            } else if (guess < targetNumber) {
-                result.textContent = '📈 もっと大きい数字です';
-                result.style.color = '#00d4ff';
-            } else {
-                result.textContent = '📉 もっと小さい数字です';
-                result.style.color = '#00d4ff';
-            }
+            postJSON('/api/games/number/guess', { session: numberSession, guess: guess })
+                .then(data => {
+                    if (data.error) {
+                        result.textContent = data.error;
+                        result.style.color = '#ff6b6b';
+                        return;
+                    }
+                    numberAttempts = data.attempts;
+                    document.getElementById('number-attempts').textContent = numberAttempts;
+
+                    if (data.result === 'correct') {
+                        result.textContent = `🎉 正解！${numberAttempts}回で当てました！`;
+                        result.style.color = '#00ff88';
+                        if (data.score) {
+                            showScoreResult(data.score);
+                        }
+                    } else if (data.result === 'higher') {
+                        result.textContent = '📈 もっと大きい数字です';
+                        result.style.color = '#00d4ff';
+                    } else {
+                        result.textContent = '📉 もっと小さい数字です';
+                        result.style.color = '#00d4ff';
+                    }
+                })
+                .catch(error => console.log('Error guessing number:', error));
         }
 
-        // じゃんけんゲーム
+        // じゃんけんゲーム（コンピューターの手と勝敗はサーバーのセッションが決める）
+        let rpsSession = null;
         let rpsWins = 0;
         let rpsLosses = 0;
         let rpsDraws = 0;
 
         function startRockPaperScissors() {
             document.getElementById('rps-game-area').classList.add('active');
+            loadLeaderboard('rps');
+            if (!rpsSession) {
+                startRPSSession();
+            }
+        }
+
+        function startRPSSession() {
+            return postJSON('/api/games/rps/session', {})
+                .then(data => { rpsSession = data.session; })
+                .catch(error => console.log('Error starting rock-paper-scissors:', error));
         }
 
         function playRPS(playerChoice) {
-            const choices = ['rock', 'paper', 'scissors'];
+            if (rpsMatchActive) {
+                // 対戦中はオフラインのじゃんけんをしない（相手の手やラウンドを待っている間のクリックは無視する）
+                if (rpsOnlineRound) {
+                    sendOnlineMove(playerChoice);
+                }
+                return;
+            }
             const emojis = { rock: '✊', paper: '✋', scissors: '✌️' };
-            const computerChoice = choices[Math.floor(Math.random() * 3)];
+            const labels = { win: 'あなたの勝ち！', lose: 'あなたの負け...', draw: '引き分け' };
+            const colors = { win: '#00ff88', lose: '#ff6b6b', draw: '#00d4ff' };
             const result = document.getElementById('rps-result');
 
-            let outcome = '';
-            if (playerChoice === computerChoice) {
-                outcome = '引き分け';
-                rpsDraws++;
-            } else if (
-                (playerChoice === 'rock' && computerChoice === 'scissors') ||
-                (playerChoice === 'paper' && computerChoice === 'rock') ||
-                (playerChoice === 'scissors' && computerChoice === 'paper')
-            ) {
-                outcome = 'あなたの勝ち！';
-                rpsWins++;
-            } else {
-                outcome = 'あなたの負け...';
-                rpsLosses++;
-            }
-
-            result.innerHTML = `
-                あなた: ${emojis[playerChoice]} vs コンピューター: ${emojis[computerChoice]}<br>
-                <span style="color: ${outcome.includes('勝ち') ? '#00ff88' : outcome.includes('負け') ? '#ff6b6b' : '#00d4ff'}">${outcome}</span>
-            `;
-
-            updateRPSStats();
+            postJSON('/api/games/rps/play', { session: rpsSession, move: playerChoice })
+                .then(data => {
+                    if (data.error) {
+                        result.textContent = data.error;
+                        // セッションが切れていたら新しく始める（勝ち数は0から）
+                        startRPSSession();
+                        return;
+                    }
+                    rpsWins = data.wins;
+                    rpsLosses = data.losses;
+                    rpsDraws = data.draws;
+                    result.innerHTML = `
+                        あなた: ${emojis[playerChoice]} vs コンピューター: ${emojis[data.computer]}<br>
+                        <span style="color: ${colors[data.outcome]}">${labels[data.outcome]}</span>
+                    `;
+                    updateRPSStats();
+                    if (data.score) {
+                        showScoreResult(data.score);
+                    }
+                })
+                .catch(error => console.log('Error playing rock-paper-scissors:', error));
         }
 
         function updateRPSStats() {
@@ -2282,42 +2777,231 @@ minigame_template = """
             rpsDraws = 0;
             updateRPSStats();
             document.getElementById('rps-result').textContent = '';
+            leaveOnlineRPS();
+            startRPSSession();
+        }
+
+        // オンライン対戦（手の判定はサーバー側で行う）
+        const rpsEmojis = { rock: '✊', paper: '✋', scissors: '✌️' };
+        let rpsSocket = null;
+        let rpsOnlineState = 'offline';  // offline / connecting / waiting / playing / idle
+        let rpsOnlineRound = 0;
+        let rpsMatchActive = false;     // 対戦の開始から終了（または切断）まで true
+        let rpsRoundTimer = null;
+        let rpsRating = null;
+
+        function setOnlineStatus(text) {
+            document.getElementById('rps-online-status').textContent = text;
+        }
+
+        function setOnlineState(state) {
+            rpsOnlineState = state;
+            const labels = {
+                offline: '🌐 オンライン対戦',
+                connecting: '🔌 接続をやめる',
+                waiting: '🔌 待機をやめる',
+                playing: '🔌 対戦をやめる',
+                idle: '🌐 次の対戦相手を探す'
+            };
+            document.getElementById('rps-online-button').textContent = labels[state];
+        }
+
+        function playOnlineRPS() {
+            if (rpsOnlineState === 'idle') {
+                rpsSocket.send(JSON.stringify({ type: 'queue' }));
+                return;
+            }
+            if (rpsSocket) {
+                leaveOnlineRPS();
+                return;
+            }
+            connectOnlineRPS('queue');
+        }
+
+        // 接続したら最初に送るメッセージ（queue: 普通の対戦、tournament: トーナメントにチェックイン）
+        function connectOnlineRPS(firstMessage) {
+            const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+            rpsSocket = new WebSocket(`${scheme}://${location.hostname}:{{ gateway_port }}/ws/rps`);
+            setOnlineState('connecting');
+            setOnlineStatus('サーバーに接続しています...');
+            rpsSocket.onopen = () => rpsSocket.send(JSON.stringify({ type: firstMessage }));
+            rpsSocket.onmessage = event => handleOnlineMessage(JSON.parse(event.data));
+            rpsSocket.onclose = () => {
+                rpsSocket = null;
+                rpsOnlineRound = 0;
+                rpsMatchActive = false;
+                clearInterval(rpsRoundTimer);
+                setOnlineState('offline');
+                setOnlineStatus('オンライン対戦から切断しました');
+            };
+        }
+
+        function checkInTournament() {
+            if (!rpsSocket) {
+                connectOnlineRPS('tournament');
+            } else if (rpsSocket.readyState === WebSocket.OPEN && rpsOnlineState !== 'playing') {
+                rpsSocket.send(JSON.stringify({ type: 'tournament' }));
+            }
+        }
+
+        function loadRPSTournaments() {
+            const statusLabels = { registration: '参加受付中', running: '開催中', finished: '終了' };
+            fetch('/api/tournaments')
+                .then(response => response.json())
+                .then(data => {
+                    const list = document.getElementById('rps-tournaments');
+                    list.innerHTML = '';
+                    if (data.tournaments.length === 0) {
+                        list.textContent = '開催予定のトーナメントはありません';
+                    }
+                    data.tournaments.forEach(t => {
+                        const item = document.createElement('li');
+                        item.textContent = `🏆 ${t.name}（${statusLabels[t.status]}・${t.players}人）`;
+                        if (t.champion) {
+                            item.textContent += ` 優勝: ${t.champion}`;
+                        }
+                        const button = document.createElement('button');
+                        button.className = 'play-button';
+                        button.style.margin = '0.5rem';
+                        if (t.status === 'registration') {
+                            button.textContent = t.joined ? '登録を取り消す' : '参加登録';
+                            button.onclick = () => fetch(`/api/tournaments/${t.id}/${t.joined ? 'leave' : 'join'}`, { method: 'POST' })
+                                .then(response => response.json())
+                                .then(result => { if (result.error) alert(result.error); loadRPSTournaments(); });
+                            item.appendChild(button);
+                        } else if (t.status === 'running' && t.joined) {
+                            button.textContent = 'チェックイン';
+                            button.onclick = checkInTournament;
+                            item.appendChild(button);
+                        }
+                        list.appendChild(item);
+                    });
+                });
+        }
+
+        function leaveOnlineRPS() {
+            if (rpsSocket) {
+                rpsSocket.close();
+            }
+        }
+
+        function sendOnlineMove(move) {
+            rpsSocket.send(JSON.stringify({ type: 'move', move: move }));
+            document.getElementById('rps-result').textContent = `${rpsEmojis[move]} を出しました。相手を待っています...`;
+            rpsOnlineRound = 0;
+        }
+
+        function handleOnlineMessage(message) {
+            const result = document.getElementById('rps-result');
+            switch (message.type) {
+                case 'hello':
+                    rpsRating = message.rating.rating;
+                    break;
+                case 'waiting':
+                    setOnlineState('waiting');
+                    setOnlineStatus(`レートの近い対戦相手を探しています...（あなたのレート ${rpsRating}）`);
+                    break;
+                case 'match': {
+                    rpsMatchActive = true;
+                    setOnlineState('playing');
+                    const event = message.tournament ? `🏆 ${message.tournament.name} ${message.tournament.round}/${message.tournament.rounds}回戦: ` : '';
+                    setOnlineStatus(`${event}${message.opponent} さん（レート ${message.opponent_rating}）と対戦中（${message.wins_needed}勝先取）`);
+                    break;
+                }
+                case 'tournament_wait':
+                    setOnlineState('waiting');
+                    setOnlineStatus(`🏆 ${message.name} ${message.round}回戦: ${message.opponent} さんを待っています（${message.no_show_timeout}秒来なければ不戦勝）`);
+                    break;
+                case 'tournament_idle':
+                    setOnlineState('idle');
+                    setOnlineStatus(message.champion ? `🏆 トーナメント終了！ 優勝: ${message.champion}` : '🏆 トーナメントの次の試合はまだありません');
+                    break;
+                case 'round': {
+                    rpsOnlineRound = message.round;
+                    let remaining = message.time_limit;
+                    result.textContent = `第${message.round}ラウンド: 手を選んでください（残り${remaining}秒）`;
+                    clearInterval(rpsRoundTimer);
+                    rpsRoundTimer = setInterval(() => {
+                        remaining--;
+                        if (remaining <= 0 || rpsOnlineRound !== message.round) {
+                            clearInterval(rpsRoundTimer);
+                        } else {
+                            result.textContent = `第${message.round}ラウンド: 手を選んでください（残り${remaining}秒）`;
+                        }
+                    }, 1000);
+                    break;
+                }
+                case 'result': {
+                    rpsOnlineRound = 0;
+                    clearInterval(rpsRoundTimer);
+                    const labels = { win: 'あなたの勝ち！', lose: 'あなたの負け...', draw: '引き分け' };
+                    const colors = { win: '#00ff88', lose: '#ff6b6b', draw: '#00d4ff' };
+                    result.innerHTML = `
+                        あなた: ${rpsEmojis[message.you] || '⌛'} vs 相手: ${rpsEmojis[message.opponent] || '⌛'}<br>
+                        <span style="color: ${colors[message.outcome]}">${labels[message.outcome]}</span>
+                        （${message.score[0]} - ${message.score[1]}）
+                    `;
+                    break;
+                }
+                case 'match_end': {
+                    rpsOnlineRound = 0;
+                    rpsMatchActive = false;
+                    clearInterval(rpsRoundTimer);
+                    const labels = { win: '🏆 対戦に勝ちました！', lose: '対戦に負けました...', draw: '対戦は引き分けでした' };
+                    const note = message.forfeit ? '（相手が切断しました）' : '';
+                    let ratingNote = '';
+                    if (message.rating) {
+                        const change = message.rating.rating - rpsRating;
+                        ratingNote = ` レート: ${message.rating.rating}（${change >= 0 ? '+' : ''}${change}）`;
+                        rpsRating = message.rating.rating;
+                    }
+                    const replayNote = message.replay ? `（リプレイ ID: ${message.replay}）` : '';
+                    setOnlineState('idle');
+                    setOnlineStatus(`${labels[message.outcome]} ${message.score[0]} - ${message.score[1]}${note}${ratingNote}${replayNote}`);
+                    break;
+                }
+            }
         }
 
         function hideGame() {
             document.querySelectorAll('.game-area').forEach(area => {
                 area.classList.remove('active');
             });
+            leaveOnlineRPS();
+            if (colorRaceSocket) {
+                colorRaceSocket.close();
+            }
+            if (colorSpectateSocket) {
+                colorSpectateSocket.close();
+            }
         }
 
-        // クイズゲーム
-        let quizQuestions = [
-            { question: "日本の首都は？", options: ["東京", "大阪", "京都", "名古屋"], correct: 0 },
-            { question: "1 + 1 = ?", options: ["1", "2", "3", "4"], correct: 1 },
-            { question: "地球で一番大きい海は？", options: ["大西洋", "太平洋", "インド洋", "北極海"], correct: 1 },
-            { question: "人間の骨の数は約何本？", options: ["150本", "200本", "250本", "300本"], correct: 1 },
-            { question: "富士山の高さは？", options: ["3776m", "3500m", "4000m", "3200m"], correct: 0 },
-            { question: "日本で一番長い川は？", options: ["利根川", "信濃川", "石狩川", "北上川"], correct: 1 },
-            { question: "光の速度は？", options: ["約30万km/s", "約20万km/s", "約40万km/s", "約10万km/s"], correct: 0 },
-            { question: "虹は何色？", options: ["5色", "6色", "7色", "8色"], correct: 2 },
-            { question: "一年は何日？", options: ["364日", "365日", "366日", "367日"], correct: 1 },
-            { question: "日本の県の数は？", options: ["45", "46", "47", "48"], correct: 2 }
-        ];
+        // クイズゲーム（問題はサーバーの問題バンクから取得）
         let currentQuiz = 0;
         let quizScore = 0;
         let shuffledQuiz = [];
+        let quizSession = null;
 
         function startQuizGame() {
             document.getElementById('quiz-game-area').classList.add('active');
+            loadLeaderboard('quiz');
             resetQuizGame();
         }
 
         function resetQuizGame() {
-            shuffledQuiz = [...quizQuestions].sort(() => Math.random() - 0.5);
             currentQuiz = 0;
             quizScore = 0;
-            updateQuizStats();
-            showQuizQuestion();
+            document.getElementById('quiz-question').textContent = '問題を読み込み中...';
+            document.getElementById('quiz-options').innerHTML = '';
+            fetch('/api/quiz/questions?count=10')
+                .then(response => response.json())
+                .then(data => {
+                    shuffledQuiz = data.questions;
+                    quizSession = data.session;
+                    updateQuizStats();
+                    showQuizQuestion();
+                })
+                .catch(error => console.log('Error loading quiz questions:', error));
         }
 
         function updateQuizStats() {
@@ -2331,6 +3015,7 @@ minigame_template = """
                 document.getElementById('quiz-question').innerHTML = `ゲーム終了！<br>最終スコア: ${quizScore}/${shuffledQuiz.length}`;
                 document.getElementById('quiz-options').innerHTML = '';
                 document.getElementById('quiz-result').textContent = '';
+                submitScore('quiz', quizScore, { session: quizSession });
                 return;
             }
 
@@ -2344,25 +3029,43 @@ minigame_template = """
             document.getElementById('quiz-options').innerHTML = optionsHtml;
         }
 
+        let quizAnswering = false;
+
         function answerQuiz(selectedIndex) {
+            if (quizAnswering) return;
+            quizAnswering = true;
             const question = shuffledQuiz[currentQuiz];
             const result = document.getElementById('quiz-result');
 
-            if (selectedIndex === question.correct) {
-                result.innerHTML = '🎉 正解！';
-                result.style.color = '#00ff88';
-                quizScore++;
-            } else {
-                result.innerHTML = `❌ 不正解。正解は「${question.options[question.correct]}」です。`;
-                result.style.color = '#ff6b6b';
-            }
+            // 正誤判定はサーバーで行う
+            fetch('/api/quiz/answer', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ session: quizSession, id: question.id, choice: selectedIndex })
+            })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.correct) {
+                        result.innerHTML = '🎉 正解！';
+                        result.style.color = '#00ff88';
+                        quizScore++;
+                    } else {
+                        result.textContent = `❌ 不正解。正解は「${question.options[data.answer]}」です。`;
+                        result.style.color = '#ff6b6b';
+                    }
 
-            currentQuiz++;
-            updateQuizStats();
+                    currentQuiz++;
+                    updateQuizStats();
 
-            setTimeout(() => {
-                showQuizQuestion();
-            }, 2000);
+                    setTimeout(() => {
+                        quizAnswering = false;
+                        showQuizQuestion();
+                    }, 2000);
+                })
+                .catch(error => {
+                    quizAnswering = false;
+                    console.log('Error answering quiz:', error);
+                });
         }
 
         // カラーマッチングゲーム
@@ -2386,6 +3089,7 @@ minigame_template = """
 
         function startColorGame() {
             document.getElementById('color-game-area').classList.add('active');
+            loadLeaderboard('color');
         }
 
         function startColorGameRound() {
@@ -2430,6 +3134,10 @@ minigame_template = """
         }
 
         function answerColor(userAnswer) {
+            if (colorRace) {
+                answerColorRace(userAnswer);
+                return;
+            }
             if (!colorGameActive) return;
 
             const result = document.getElementById('color-result');
@@ -2460,6 +3168,350 @@ minigame_template = """
             document.getElementById('color-display').innerHTML = `ゲーム終了！<br>スコア: ${colorScore}点`;
             document.getElementById('color-options').innerHTML = '';
             document.getElementById('color-result').innerHTML = '';
+            submitScore('color', colorScore);
+        }
+
+        // 対戦用のバイナリメッセージ（形式は protocol.py を参照）
+        const PROTOCOL_VERSION = {{ protocol_version }};
+        const MSG_STATE = 1;
+        const MSG_ANSWER = 2;
+        const MSG_DELTA = 3;
+        const MSG_ACK = 4;
+        const FIELD_REMOVED = 8;
+        const RACE_STATES = ['countdown', 'racing'];
+
+        function decodeGameMessage(buffer) {
+            const bytes = new Uint8Array(buffer);
+            if (bytes.length < 2 || bytes[0] !== PROTOCOL_VERSION) {
+                throw new Error(`unsupported game message (version ${bytes[0]})`);
+            }
+            let offset = 2;
+            function readVarint() {
+                let result = 0;
+                let scale = 1;
+                while (offset < bytes.length) {
+                    const byte = bytes[offset++];
+                    result += (byte & 0x7f) * scale;
+                    if (byte < 0x80) return result;
+                    scale *= 128;
+                }
+                throw new Error('truncated varint');
+            }
+            if (bytes[1] === MSG_STATE) {
+                const tick = readVarint();
+                const state = RACE_STATES[bytes[offset++]];
+                const remaining = readVarint() / 10;
+                const count = readVarint();
+                const players = [];
+                for (let i = 0; i < count; i++) {
+                    players.push([readVarint(), readVarint(), readVarint(), readVarint()]);
+                }
+                return { type: 'state', tick: tick, state: state, remaining: remaining, players: players };
+            }
+            if (bytes[1] === MSG_DELTA) {
+                const tick = readVarint();
+                const base = readVarint();
+                const state = RACE_STATES[bytes[offset++]];
+                const remaining = readVarint() / 10;
+                const count = readVarint();
+                const changes = [];
+                for (let i = 0; i < count; i++) {
+                    const slot = readVarint();
+                    const mask = bytes[offset++];
+                    const values = [];
+                    for (let field = 0; field < 3; field++) {
+                        values.push(mask & (1 << field) ? readVarint() : null);
+                    }
+                    changes.push([slot, mask, values]);
+                }
+                return { type: 'delta', tick: tick, base: base, state: state, remaining: remaining, changes: changes };
+            }
+            throw new Error(`unknown game message type ${bytes[1]}`);
+        }
+
+        function pushVarint(bytes, value) {
+            while (value >= 0x80) {
+                bytes.push((value & 0x7f) | 0x80);
+                value = Math.floor(value / 128);
+            }
+            bytes.push(value);
+        }
+
+        function encodeAnswer(item, match) {
+            const bytes = [PROTOCOL_VERSION, MSG_ANSWER];
+            pushVarint(bytes, item);
+            bytes.push(match ? 1 : 0);
+            return new Uint8Array(bytes);
+        }
+
+        function encodeAck(tick) {
+            const bytes = [PROTOCOL_VERSION, MSG_ACK];
+            pushVarint(bytes, tick);
+            return new Uint8Array(bytes);
+        }
+
+        // オンライン対戦（全員に同じ色の並びが配られ、得点はサーバーが判定する）
+        let colorRaceSocket = null;
+        let colorRaceName = null;
+        let colorRace = null;   // { sequence, names, mySlot, index, racing, waitingNext, snapshots, ... }
+
+        function setColorRaceStatus(text) {
+            document.getElementById('color-race-status').textContent = text;
+        }
+
+        function playColorRace() {
+            if (colorRaceSocket && !colorRace) {
+                colorRaceSocket.send(JSON.stringify({ type: 'join' }));
+                return;
+            }
+            if (colorRaceSocket) {
+                colorRaceSocket.close();
+                return;
+            }
+            colorGameActive = false;
+            clearInterval(colorGameInterval);
+            const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+            colorRaceSocket = new WebSocket(`${scheme}://${location.hostname}:{{ gateway_port }}/ws/color-race`);
+            colorRaceSocket.binaryType = 'arraybuffer';
+            document.getElementById('color-race-button').textContent = '🔌 オンライン対戦をやめる';
+            setColorRaceStatus('サーバーに接続しています...');
+            colorRaceSocket.onopen = () => colorRaceSocket.send(JSON.stringify({ type: 'join' }));
+            colorRaceSocket.onmessage = event => handleColorRaceMessage(
+                typeof event.data === 'string' ? JSON.parse(event.data) : decodeGameMessage(event.data));
+            colorRaceSocket.onclose = () => {
+                colorRaceSocket = null;
+                colorRace = null;
+                document.getElementById('color-race-button').textContent = '🌐 オンライン対戦';
+                document.getElementById('color-options').innerHTML = '';
+                setColorRaceStatus('オンライン対戦から切断しました');
+            };
+        }
+
+        // サーバーが別のバージョンの形式を使っている（ページが古い）ときは、つないでいても通じないので切る
+        function closeIfProtocolMismatch(message, socket) {
+            if (message.protocol === PROTOCOL_VERSION) return false;
+            const onclose = socket.onclose;
+            socket.onmessage = null;
+            socket.onclose = event => {
+                onclose(event);
+                setColorRaceStatus('サーバーが更新されました。ページを再読み込みしてください');
+            };
+            socket.close();
+            return true;
+        }
+
+        function handleColorRaceMessage(message) {
+            switch (message.type) {
+                case 'hello':
+                    if (closeIfProtocolMismatch(message, colorRaceSocket)) break;
+                    colorRaceName = message.player;
+                    break;
+                case 'waiting':
+                    setColorRaceStatus(`対戦相手を待っています（${message.players.length}/${message.max_players}人）`);
+                    break;
+                case 'start':
+                    colorRace = {
+                        sequence: message.sequence,
+                        names: message.players,
+                        mySlot: message.players.indexOf(colorRaceName),
+                        index: 0,
+                        racing: false,
+                        waitingNext: false,
+                        snapshots: new Map(),   // tick -> Map(スロット番号 -> [得点, コンボ, 問題数])
+                        ackEvery: message.ack_every,
+                        historyTicks: message.history_ticks,
+                        lastAck: -1
+                    };
+                    document.getElementById('color-race-button').textContent = '🔌 オンライン対戦をやめる';
+                    document.getElementById('color-display').textContent = `${message.countdown}秒後にスタート！`;
+                    document.getElementById('color-options').innerHTML = '';
+                    document.getElementById('color-result').innerHTML = '';
+                    setColorRaceStatus(`${message.players.length}人で対戦します`);
+                    break;
+                case 'state':
+                    if (colorRace) {
+                        storeColorRaceSnapshot(message, new Map(message.players.map(entry => [entry[0], entry.slice(1)])));
+                    }
+                    break;
+                case 'delta':
+                    applyColorRaceDelta(message);
+                    break;
+                case 'finish': {
+                    colorRace = null;
+                    const rank = message.standings.findIndex(entry => entry[0] === colorRaceName) + 1;
+                    renderColorRaceStandings(message.standings);
+                    document.getElementById('color-display').innerHTML = `レース終了！<br>${rank}位`;
+                    document.getElementById('color-options').innerHTML = '';
+                    document.getElementById('color-race-button').textContent = '🌐 もう一度対戦する';
+                    setColorRaceStatus(message.replay ? `リプレイ ID: ${message.replay}` : '');
+                    loadLeaderboard('color');
+                    break;
+                }
+            }
+        }
+
+        function applyColorRaceDelta(message) {
+            if (!colorRace) return;
+            const base = colorRace.snapshots.get(message.base);
+            if (!base) return;  // 基準が手元にない場合は次のキーフレームを待つ
+            const players = new Map();
+            base.forEach((fields, slot) => players.set(slot, fields.slice()));
+            message.changes.forEach(([slot, mask, values]) => {
+                if (mask & FIELD_REMOVED) {
+                    players.delete(slot);
+                    return;
+                }
+                const fields = players.get(slot) || [0, 0, 0];
+                values.forEach((value, field) => {
+                    if (value !== null) fields[field] = value;
+                });
+                players.set(slot, fields);
+            });
+            storeColorRaceSnapshot(message, players);
+        }
+
+        function storeColorRaceSnapshot(message, players) {
+            colorRace.snapshots.set(message.tick, players);
+            if (message.tick - colorRace.lastAck >= colorRace.ackEvery) {
+                colorRaceSocket.send(encodeAck(message.tick));
+                colorRace.lastAck = message.tick;
+                // 受信確認がいつサーバーに届くかは分からないので、サーバーが基準に使いうる
+                // 直近 history_ticks 分の状態は残しておく
+                colorRace.snapshots.forEach((_, tick) => {
+                    if (tick < message.tick - colorRace.historyTicks) colorRace.snapshots.delete(tick);
+                });
+            }
+            updateColorRaceState({
+                state: message.state,
+                remaining: message.remaining,
+                players: Array.from(players, ([slot, fields]) => [slot, ...fields])
+            });
+        }
+
+        function updateColorRaceState(message) {
+            if (!colorRace) return;
+            // 状態メッセージのプレイヤーはスロット番号で届く
+            const me = message.players.find(entry => entry[0] === colorRace.mySlot);
+            document.getElementById('color-time').textContent = Math.ceil(message.remaining);
+            if (me) {
+                document.getElementById('color-score').textContent = me[1];
+                document.getElementById('color-combo').textContent = me[2];
+            }
+            renderColorRaceStandings(message.players.map(entry => [colorRace.names[entry[0]], entry[1]])
+                .sort((a, b) => b[1] - a[1]));
+            if (message.state === 'racing' && !colorRace.racing) {
+                colorRace.racing = true;
+                showColorRaceItem();
+            }
+        }
+
+        function renderColorRaceStandings(standings) {
+            const list = document.getElementById('color-race-standings');
+            list.innerHTML = '';
+            standings.forEach(entry => {
+                const item = document.createElement('li');
+                item.textContent = `${entry[0]}: ${entry[1]}点`;
+                if (entry[0] === colorRaceName) {
+                    item.style.color = '#00ff88';
+                }
+                list.appendChild(item);
+            });
+        }
+
+        function showColorRaceItem() {
+            if (!colorRace) return;
+            colorRace.waitingNext = false;
+            const item = colorRace.sequence[colorRace.index];
+            if (!item) {
+                document.getElementById('color-display').textContent = '全問回答しました！';
+                document.getElementById('color-options').innerHTML = '';
+                return;
+            }
+            const ink = colors[item[0]];
+            const word = colors[item[1]];
+            document.getElementById('color-display').innerHTML = `<span style="color: ${ink.bg}">${word.name}</span>`;
+            document.getElementById('color-options').innerHTML = `
+                <button class="play-button" onclick="answerColor(true)" style="margin: 0.5rem; background: #00ff88;">一致</button>
+                <button class="play-button" onclick="answerColor(false)" style="margin: 0.5rem; background: #ff6b6b;">不一致</button>
+            `;
+        }
+
+        function answerColorRace(userAnswer) {
+            if (!colorRace.racing || colorRace.waitingNext) return;
+            const item = colorRace.sequence[colorRace.index];
+            if (!item) return;
+            colorRaceSocket.send(encodeAnswer(colorRace.index, userAnswer));
+            const result = document.getElementById('color-result');
+            if (userAnswer === (item[0] === item[1])) {
+                result.innerHTML = '✅ 正解！';
+                result.style.color = '#00ff88';
+            } else {
+                result.innerHTML = '❌ 不正解！';
+                result.style.color = '#ff6b6b';
+            }
+            colorRace.index++;
+            colorRace.waitingNext = true;
+            setTimeout(showColorRaceItem, 800);
+        }
+
+        // 観戦（サーバーが決めた秒数だけ遅れて、部屋全体の状態が届く）
+        let colorSpectateSocket = null;
+        let colorSpectateNames = [];
+
+        function spectateColorRace() {
+            if (colorSpectateSocket) {
+                colorSpectateSocket.close();
+                return;
+            }
+            const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+            colorSpectateSocket = new WebSocket(`${scheme}://${location.hostname}:{{ gateway_port }}/ws/color-race/spectate`);
+            colorSpectateSocket.binaryType = 'arraybuffer';
+            document.getElementById('color-spectate-button').textContent = '👀 観戦をやめる';
+            colorSpectateSocket.onmessage = event => handleSpectateMessage(
+                typeof event.data === 'string' ? JSON.parse(event.data) : decodeGameMessage(event.data));
+            colorSpectateSocket.onclose = () => {
+                colorSpectateSocket = null;
+                document.getElementById('color-spectate-button').textContent = '👀 観戦';
+                setColorRaceStatus('');
+            };
+        }
+
+        function handleSpectateMessage(message) {
+            switch (message.type) {
+                case 'spectate':
+                    if (closeIfProtocolMismatch(message, colorSpectateSocket)) break;
+                    if (message.room === null) {
+                        setColorRaceStatus('観戦できる対戦がありません。しばらくしてからもう一度お試しください');
+                        colorSpectateSocket.close();
+                    } else {
+                        setColorRaceStatus(`部屋${message.room}を観戦中（${message.delay}秒遅れ）`);
+                    }
+                    break;
+                case 'waiting':
+                    colorSpectateNames = message.players;
+                    renderColorRaceStandings(message.players.map(name => [name, 0]));
+                    break;
+                case 'start':
+                    colorSpectateNames = message.players;
+                    document.getElementById('color-display').textContent = `${message.countdown}秒後にスタート！`;
+                    break;
+                case 'state':
+                    document.getElementById('color-time').textContent = Math.ceil(message.remaining);
+                    if (message.state === 'racing') {
+                        document.getElementById('color-display').textContent = '対戦中';
+                    }
+                    renderColorRaceStandings(message.players.map(entry => [colorSpectateNames[entry[0]], entry[1]])
+                        .sort((a, b) => b[1] - a[1]));
+                    break;
+                case 'finish':
+                    renderColorRaceStandings(message.standings);
+                    document.getElementById('color-display').textContent = 'レース終了！';
+                    // 続けて別の対戦を観戦する
+                    setTimeout(() => {
+                        if (colorSpectateSocket) colorSpectateSocket.send(JSON.stringify({ type: 'watch' }));
+                    }, 3000);
+                    break;
+            }
         }
 
         // リアクションゲーム
@@ -2471,6 +3523,7 @@ minigame_template = """
 
         function startReactionGame() {
             document.getElementById('reaction-game-area').classList.add('active');
+            loadLeaderboard('reaction');
         }
 
         function startReactionRound() {
@@ -2510,6 +3563,12 @@ minigame_template = """
                         updateReactionStats();
 
                         const result = document.getElementById('reaction-result');
+                        // サーバーに記録された全プレイヤーの分布と比べた結果を表示
+                        submitScore('reaction', reactionTime).then(data => {
+                            if (data && data.better_than !== undefined) {
+                                result.innerHTML += `<br>プレイヤーの${data.better_than}%より速い！`;
+                            }
+                        });
                         if (reactionTime < 200) {
                             result.innerHTML = '🚀 超高速！';
                             result.style.color = '#00ff88';
@@ -2747,10 +3806,36 @@ profile_template = """
             </div>
         </div>
 
+        <div class="profile-info">
+            <div class="info-item">
+                <span class="info-label">🏅 実績:</span>
+                <span class="info-value" id="achievement-count">-</span>
+            </div>
+            <ul id="achievement-list" style="list-style: none; text-align: left;"></ul>
+        </div>
+
         <a href="/edit_profile" class="back-button">プロフィール編集</a>
         <a href="/" class="back-button">ホームに戻る</a>
         <a href="/logout" class="logout-button">ログアウト</a>
 
+        <script>
+            fetch('/api/achievements')
+                .then(response => response.json())
+                .then(data => {
+                    if (data.error) return;
+                    document.getElementById('achievement-count').textContent = `${data.unlocked} / ${data.total}`;
+                    const list = document.getElementById('achievement-list');
+                    data.achievements.forEach(a => {
+                        const item = document.createElement('li');
+                        item.style.margin = '0.5rem 0';
+                        item.style.opacity = a.unlocked_at ? 1 : 0.4;
+                        const unlocked = a.unlocked_at ? `（${new Date(a.unlocked_at * 1000).toLocaleDateString()}）` : '';
+                        item.textContent = `${a.unlocked_at ? '🏅' : '🔒'} ${a.name}: ${a.description}${unlocked}`;
+                        list.appendChild(item);
+                    });
+                });
+        </script>
+
         {% else %}
         <div class="profile-icon">🔐</div>
         <h1>ログインが必要です</h1>
@@ -3088,6 +4173,7 @@ def login():
 
         if verify_password(username, password):
             session['username'] = username
+            achievements.submit('login', get_user_info(username)['user_id'])
             
             # Remember me機能の処理
             if remember_me:
@@ -3128,18 +4214,23 @@ def register():
         email = request.form['email']
         password = request.form['password']
 
-        # ユーザー名、ユーザーID、メールアドレスが既に存在しないかチェック
-        if username in users_db or user_id in [u['user_id'] for u in users_db.values()] or email in [u['email'] for u in users_db.values() if 'email' in u]:
-            flash('ユーザー名、ユーザーID、またはメールアドレスが既に存在します。', 'error')
+        # ゲストの名前（guest_1 など）と同じ形のIDはゲスト扱いになってしまうので使えない
+        if is_guest(user_id):
+            flash('そのユーザーIDは使用できません。', 'error')
             return render_template_string(register_template, form_data=request.form)
 
-        # 新しいユーザーをデータベースに追加
-        users_db[username] = {
+        # ユーザー名、ユーザーID、メールアドレスの重複チェックと追加をアトミックに行う
+        registered = users_db.register(username, {
             "password_hash": hashlib.sha256(password.encode()).hexdigest(),
             "role": "一般ユーザー", # デフォルトロール
             "user_id": user_id,
             "email": email
-        }
+        })
+        if not registered:
+            flash('ユーザー名、ユーザーID、またはメールアドレスが既に存在します。', 'error')
+            return render_template_string(register_template, form_data=request.form)
+
+        achievements.submit('register', user_id)
         flash('新規登録が完了しました！ログインしてください。', 'success')
         return redirect(url_for('login'))
 
@@ -3147,11 +4238,12 @@ def register():
 
 @app.route('/discord')
 def discord():
-    return render_template_string(discord_template)
+    return render_template_string(discord_template, gateway_port=GATEWAY_PORT)
 
 @app.route('/minigame')
 def minigame():
-    return render_template_string(minigame_template)
+    return render_template_string(minigame_template, gateway_port=GATEWAY_PORT,
+                                  protocol_version=PROTOCOL_VERSION)
 
 @app.route('/profile')
 def profile():
@@ -3178,9 +4270,9 @@ def edit_profile():
 
         # ユーザー名を更新
         if new_username != current_username:
-            user_data = users_db[current_username]
-            users_db[new_username] = user_data
-            del users_db[current_username]
+            if not users_db.rename(current_username, new_username):
+                flash('そのユーザー名は既に使用されています。', 'error')
+                return render_template_string(edit_profile_template, user_data=get_user_info(current_username))
             session['username'] = new_username
             flash('ユーザー名を更新しました！', 'success')
         else:
@@ -3202,7 +4294,7 @@ def users():
         flash('管理者権限が必要です。', 'error')
         return redirect(url_for('home'))
 
-    return render_template_string(users_template, users_db=users_db)
+    return render_template_string(users_template, users_db=dict(users_db.items()))
 
 @app.route('/logout')
 def logout():
@@ -3211,8 +4303,8 @@ def logout():
     
     # 永続的なログイントークンがある場合は削除
     remember_token = request.cookies.get('remember_token')
-    if remember_token and remember_token in persistent_tokens:
-        del persistent_tokens[remember_token]
+    if remember_token:
+        persistent_tokens.pop(remember_token)
     
     # Cookieからトークンを削除
     response = make_response(render_template_string("""
@@ -3311,20 +4403,22 @@ def server_settings_page():
 
     if request.method == 'POST':
         try:
-            # 設定を更新
-            server_settings['user_timeout'] = int(request.form.get('user_timeout', 30))
-            server_settings['debug_mode'] = request.form.get('debug_mode') == 'on'
-            server_settings['max_users'] = int(request.form.get('max_users', 100))
-            server_settings['heartbeat_interval'] = int(request.form.get('heartbeat_interval', 15))
-            server_settings['maintenance_mode'] = request.form.get('maintenance_mode') == 'on'
-            server_settings['server_name'] = request.form.get('server_name', 'GAME SERVER')
-            server_settings['registration_enabled'] = request.form.get('registration_enabled') == 'on'
+            # 設定をまとめて更新
+            server_settings.update({
+                'user_timeout': int(request.form.get('user_timeout', 30)),
+                'debug_mode': request.form.get('debug_mode') == 'on',
+                'max_users': int(request.form.get('max_users', 100)),
+                'heartbeat_interval': int(request.form.get('heartbeat_interval', 15)),
+                'maintenance_mode': request.form.get('maintenance_mode') == 'on',
+                'server_name': request.form.get('server_name', 'GAME SERVER'),
+                'registration_enabled': request.form.get('registration_enabled') == 'on',
+            })
 
             flash('サーバー設定を更新しました！', 'success')
         except ValueError:
             flash('無効な値が入力されました。', 'error')
 
-    return render_template_string(server_settings_template, settings=server_settings)
+    return render_template_string(server_settings_template, settings=server_settings.snapshot())
 
 # Admin dashboard route
 @app.route('/admin')
@@ -3507,9 +4601,76 @@ def admin_dashboard():
                     <div class="card-title">統計情報</div>
                     <div class="card-description">サーバーの統計情報</div>
                 </a>
+                <div class="card">
+                    <div class="card-icon">🏆</div>
+                    <div class="card-title">トーナメント</div>
+                    <div class="card-description">じゃんけんのトーナメントを作成・開始</div>
+                    <div style="margin-top: 1rem;">
+                        <input id="tournament-name" placeholder="大会名" maxlength="50" style="width: 100%; margin-bottom: 0.5rem;">
+                        <select id="tournament-format" style="margin-bottom: 0.5rem;">
+                            <option value="single_elimination">シングルエリミネーション</option>
+                            <option value="swiss">スイス式</option>
+                        </select>
+                        <input id="tournament-rounds" type="number" min="1" max="20" placeholder="ラウンド数（スイス式）" style="width: 100%; margin-bottom: 0.5rem;">
+                        <button onclick="createTournament()">作成</button>
+                    </div>
+                    <ul id="tournament-list" style="list-style: none; margin-top: 1rem; text-align: left;"></ul>
+                </div>
             </div>
             <a href="/" class="back-button">ホームに戻る</a>
         </div>
+        <script>
+            const tournamentStatus = { registration: '参加受付中', running: '開催中', finished: '終了' };
+
+            function loadTournaments() {
+                fetch('/api/tournaments')
+                    .then(response => response.json())
+                    .then(data => {
+                        const list = document.getElementById('tournament-list');
+                        list.innerHTML = '';
+                        data.tournaments.forEach(t => {
+                            const item = document.createElement('li');
+                            item.textContent = `#${t.id} ${t.name}（${tournamentStatus[t.status]}・${t.players}人）`;
+                            if (t.status === 'registration') {
+                                const button = document.createElement('button');
+                                button.textContent = '開始';
+                                button.onclick = () => startTournament(t.id);
+                                item.appendChild(button);
+                            } else if (t.champion) {
+                                item.textContent += ` 優勝: ${t.champion}`;
+                            }
+                            list.appendChild(item);
+                        });
+                    });
+            }
+
+            function createTournament() {
+                const rounds = parseInt(document.getElementById('tournament-rounds').value, 10);
+                fetch('/api/tournaments', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        name: document.getElementById('tournament-name').value,
+                        format: document.getElementById('tournament-format').value,
+                        rounds: rounds || null
+                    })
+                }).then(response => response.json()).then(data => {
+                    if (data.error) alert(data.error);
+                    loadTournaments();
+                });
+            }
+
+            function startTournament(id) {
+                fetch(`/api/tournaments/${id}/start`, { method: 'POST' })
+                    .then(response => response.json())
+                    .then(data => {
+                        if (data.error) alert(data.error);
+                        loadTournaments();
+                    });
+            }
+
+            loadTournaments();
+        </script>
     </body>
     </html>
     """)
@@ -3517,21 +4678,26 @@ def admin_dashboard():
 
 @app.route('/')
 def home():
-    global user_counter
     user_data = None
 
     if 'username' in session:
         # ユーザーがログインしている場合、アクティブユーザーに追加
-        user_id = f"{session['username']}_{user_counter}"
-        user_counter += 1
+        user_id = f"{session['username']}_{user_counter.increment()}"
         active_users[user_id] = time.time()
         user_data = get_user_info(session['username'])
 
-    return render_template_string(template, user_data=user_data)
+    return render_template_string(template, user_data=user_data,
+                                  heartbeat_interval=server_settings.get("heartbeat_interval", 15))
 
-@app.route('/heartbeat')
+@app.route('/heartbeat', methods=['GET', 'POST'])
 def heartbeat():
     """アクティブユーザー数を返すエンドポイント"""
+    # タブが非表示になったときのビーコン（sendBeacon は POST で送られる）
+    if request.args.get('state') == 'away':
+        if 'username' in session:
+            active_users.pop(session['username'])
+        return '', 204
+
     # セッションにユーザーがいる場合、現在時刻で更新
     if 'username' in session:
         # より簡単なユーザーIDを使用
@@ -3540,7 +4706,8 @@ def heartbeat():
 
     return jsonify({
         'active_users': len(active_users),
-        'timestamp': time.time()
+        'timestamp': time.time(),
+        'next_interval': next_heartbeat_interval()
     })
 
 # Statistics route
@@ -3640,6 +4807,17 @@ statistics_template = """
             border-radius: 5px; overflow: hidden;
         }
         .rate-fill { height: 100%; background: linear-gradient(90deg, #ff6b6b, #ffff00, #00ff88); border-radius: 5px; }
+        .dist-controls { display: flex; gap: 1rem; justify-content: center; margin-bottom: 1rem; }
+        .dist-controls select {
+            padding: 0.5rem; background: rgba(0, 0, 0, 0.5); color: #fff;
+            border: 1px solid #00d4ff; border-radius: 5px; font-family: 'Orbitron', monospace;
+        }
+        .dist-table { width: 100%; border-collapse: collapse; margin: 1rem 0; font-size: 0.85rem; }
+        .dist-table th, .dist-table td { padding: 0.5rem; border-bottom: 1px solid rgba(0, 212, 255, 0.2); }
+        .dist-table th { color: #00d4ff; }
+        .bar-chart { display: flex; align-items: flex-end; gap: 2px; height: 160px; margin: 1rem 0 0.3rem; }
+        .bar-chart .bar { flex: 1; background: linear-gradient(0deg, #0099ff, #00d4ff); min-height: 1px; border-radius: 2px 2px 0 0; }
+        .bar-labels { display: flex; justify-content: space-between; font-size: 0.7rem; opacity: 0.7; }
         @media (max-width: 768px) {
             .stats-grid { grid-template-columns: 1fr; }
             h1 { font-size: 2rem; }
@@ -3674,6 +4852,33 @@ statistics_template = """
             </div>
         </div>
 
+        <div class="chart-container">
+            <h2 style="color: #00d4ff; margin-bottom: 1rem;">🎮 ゲーム結果の分布</h2>
+            <div class="dist-controls">
+                <select id="dist-period" onchange="loadDistributions()">
+                    <option value="">全期間</option>
+                    <option value="24">直近24時間</option>
+                    <option value="168">直近7日</option>
+                </select>
+                <select id="dist-game" onchange="loadGameDetail()"></select>
+            </div>
+            <table class="dist-table">
+                <thead><tr><th>ゲーム</th><th>件数</th><th>平均</th><th>最小</th><th>中央値</th><th>90%</th><th>99%</th><th>最大</th></tr></thead>
+                <tbody id="dist-summary"></tbody>
+            </table>
+            <h3 style="margin-top: 1.5rem;">スコアの分布</h3>
+            <div class="bar-chart" id="dist-histogram"></div>
+            <div class="bar-labels" id="dist-histogram-labels"></div>
+            <h3 style="margin-top: 1.5rem;">時間帯ごとの平均スコア</h3>
+            <div class="bar-chart" id="dist-hours"></div>
+            <div class="bar-labels"><span>0時</span><span>6時</span><span>12時</span><span>18時</span><span>23時</span></div>
+            <h3 style="margin-top: 1.5rem;">クイズの正解率（低い順）</h3>
+            <table class="dist-table">
+                <thead><tr><th>問題</th><th>カテゴリ</th><th>回答数</th><th>正解率</th></tr></thead>
+                <tbody id="dist-quiz"></tbody>
+            </table>
+        </div>
+
         <div style="text-align: center; margin: 2rem 0;">
             <button class="refresh-button" onclick="loadStats()">🔄 更新</button>
             <form method="POST" action="/reset_stats" style="display: inline;"
@@ -3775,8 +4980,104 @@ statistics_template = """
             pageViewsContainer.innerHTML = pageViewsHtml || '<div class="page-view-item">データなし</div>';
         }
 
+        function formatNumber(value) {
+            return value === null || value === undefined ? '-' : Number(value).toLocaleString(undefined, {maximumFractionDigits: 1});
+        }
+
+        function escapeHtml(text) {
+            const div = document.createElement('div');
+            div.textContent = text;
+            return div.innerHTML;
+        }
+
+        function distQuery() {
+            const hours = document.getElementById('dist-period').value;
+            return hours ? `?hours=${hours}` : '';
+        }
+
+        function renderBars(containerId, values, titles) {
+            const max = Math.max(...values, 0);
+            document.getElementById(containerId).innerHTML = values.map((value, i) => `
+                <div class="bar" style="height: ${max ? value / max * 100 : 0}%" title="${titles[i]}"></div>
+            `).join('');
+        }
+
+        function loadDistributions() {
+            fetch('/api/stats/games' + distQuery())
+                .then(response => response.json())
+                .then(data => {
+                    const select = document.getElementById('dist-game');
+                    if (!select.options.length) {
+                        select.innerHTML = Object.entries(data.games)
+                            .map(([game, stats]) => `<option value="${game}">${stats.name}</option>`).join('');
+                    }
+                    document.getElementById('dist-summary').innerHTML = Object.values(data.games).map(stats => `
+                        <tr>
+                            <td>${stats.name}</td>
+                            <td>${stats.count.toLocaleString()}</td>
+                            <td>${formatNumber(stats.mean)}</td>
+                            <td>${formatNumber(stats.min)}</td>
+                            <td>${formatNumber(stats.percentiles['50'])}</td>
+                            <td>${formatNumber(stats.percentiles['90'])}</td>
+                            <td>${formatNumber(stats.percentiles['99'])}</td>
+                            <td>${formatNumber(stats.max)}</td>
+                        </tr>
+                    `).join('');
+                    loadGameDetail();
+                    loadQuizAccuracy();
+                })
+                .catch(error => {
+                    console.error('ゲーム結果の分布の読み込みに失敗しました:', error);
+                });
+        }
+
+        function loadGameDetail() {
+            const game = document.getElementById('dist-game').value;
+            if (!game) return;
+            fetch(`/api/stats/games/${game}` + distQuery())
+                .then(response => response.json())
+                .then(data => {
+                    const histogram = data.histogram;
+                    const labels = document.getElementById('dist-histogram-labels');
+                    if (!histogram.counts.length) {
+                        document.getElementById('dist-histogram').innerHTML = '';
+                        labels.innerHTML = '<span>データなし</span>';
+                    } else {
+                        renderBars('dist-histogram', histogram.counts, histogram.counts.map((count, i) =>
+                            `${histogram.low + i * histogram.width}〜${histogram.low + (i + 1) * histogram.width - 1}: ${count}件`));
+                        labels.innerHTML = `<span>${histogram.low}</span>` +
+                            `<span>${histogram.low + histogram.counts.length * histogram.width - 1}</span>`;
+                    }
+                    renderBars('dist-hours', data.by_hour.map(hour => hour.mean || 0), data.by_hour.map(hour =>
+                        `${hour.hour}時: 平均 ${formatNumber(hour.mean)} (${hour.count}件)`));
+                })
+                .catch(error => {
+                    console.error('ゲーム結果の分布の読み込みに失敗しました:', error);
+                });
+        }
+
+        function loadQuizAccuracy() {
+            fetch('/api/stats/quiz' + distQuery())
+                .then(response => response.json())
+                .then(data => {
+                    const rows = data.questions.slice(0, 20).map(entry => `
+                        <tr>
+                            <td style="text-align: left;">${escapeHtml(entry.text)}</td>
+                            <td>${escapeHtml(entry.category)}</td>
+                            <td>${entry.answered.toLocaleString()}</td>
+                            <td>${(entry.accuracy * 100).toFixed(1)}%</td>
+                        </tr>
+                    `).join('');
+                    document.getElementById('dist-quiz').innerHTML = rows || '<tr><td colspan="4">データなし</td></tr>';
+                })
+                .catch(error => {
+                    console.error('クイズの正解率の読み込みに失敗しました:', error);
+                });
+        }
+
         // 初回読み込み
         loadStats();
+        loadDistributions();
 
         // 30秒ごとに自動更新
         setInterval(loadStats, 30000);
@@ -3798,9 +5099,8 @@ def reset_stats():
 
     # 統計情報をリセット（ここではダミーデータを使用）
     # 実際には、ログファイルやデータベースから集計したデータをクリアする必要があります。
-    global active_users, user_counter
     active_users.clear()
-    user_counter = 0
+    user_counter.reset()
 
     # ページビューなどの統計情報もリセットするロジックを追加
 
@@ -3859,9 +5159,510 @@ def api_stats():
         'registrations': registrations,
         'total_users': total_users,
         'success_rate': success_rate,
-        'page_views': page_views
+        'page_views': page_views,
+        'settings_version': server_settings.version,
+        'background_jobs': scheduler.metrics(),
+        'anticheat': result_validator.metrics(),
+        'achievements': achievements.metrics(),
+        'game_stats': game_stats.metrics(),
+        'realtime': dict(gateway.metrics(), rps=gateway.rps.metrics(),
+                         color_race=gateway.color_race.metrics(), chat=gateway.chat.metrics(),
+                         replays=gateway.replays.metrics(), tournaments=gateway.tournaments.metrics())
+    })
+
+# ミニゲームのスコアとランキング
+# score_range はサーバー側で受け付けるスコアの範囲、higher_is_better が False なら小さいほど上位
+# server_scored のゲームはサーバー側のセッションで判定し、クライアントからのスコア送信は受け付けない
+GAMES = {
+    'memory': {'name': '記憶ゲーム', 'higher_is_better': False, 'score_range': (8, 1000), 'server_scored': True},     # 試行回数
+    'number': {'name': '数字当てゲーム', 'higher_is_better': False, 'score_range': (1, 100), 'server_scored': True},  # 試行回数
+    'rps': {'name': 'じゃんけん', 'higher_is_better': True, 'score_range': (0, 100000), 'server_scored': True},  # 勝ち数
+    'quiz': {'name': 'クイズ', 'higher_is_better': True, 'score_range': (0, 20)},              # 正解数
+    'color': {'name': 'カラーマッチング', 'higher_is_better': True, 'score_range': (0, 10000)}, # 得点
+    'reaction': {'name': 'リアクション', 'higher_is_better': False, 'score_range': (1, 10000)}, # ミリ秒
+}
+
+leaderboards = {game: GameLeaderboards(higher_is_better=rules['higher_is_better'])
+                for game, rules in GAMES.items()}
+
+# 自己ベストに限らず送信された全スコアの分布（「上位何%か」の表示用）
+score_sketches = {game: KLLSketch() for game in GAMES}
+
+# 管理者の統計ページ用に、全スコアとクイズの回答を列ごとのファイル（mmap）に追記する
+GAME_STATS_DIR = os.environ.get('GAME_STATS_DIR', os.path.join(BASE_DIR, 'game_stats'))
+game_stats = GameStats(GAME_STATS_DIR, GAMES)
+scheduler.register('flush_game_stats', game_stats.flush, 10)
+
+def reject_score(submission, reason):
+    """不正と判定されたスコアはランキングにも分布にも載せずに捨てる"""
+    app.logger.warning("スコアを却下しました: %s %s %s (%s)",
+                       submission.game, submission.player, submission.score, reason)
+
+def publish_checked_score(submission):
+    """不正チェックを通ったクライアント判定のスコアを、ここで初めてランキングに載せる"""
+    publish_score(submission.game, submission.player, submission.score)
+    accept_score(submission.game, submission.player, submission.score)
+
+def accept_score(game, player, score):
+    """不正チェックを通った（またはサーバーが判定した）スコアを分布に記録し、実績を判定する"""
+    game_stats.record(game, player, score)
+    achievements.submit('game_result', player, game=game, score=score)
+
+# クライアントが判定するゲームの結果はバックグラウンドでまとめて検証する
+result_validator = ResultValidator(
+    on_reject=reject_score,
+    on_accept=publish_checked_score)
+scheduler.register('validate_results', result_validator.process_batch, 2)
+
+# 実績もイベントをキューに積むだけにして、判定はバックグラウンドでまとめて行う
+achievements = AchievementEngine()
+scheduler.register('evaluate_achievements', achievements.process_batch, 1)
+
+@app.route('/api/achievements')
+def achievement_list():
+    player = current_player()
+    if player is None:
+        return jsonify({'error': 'ログインが必要です。'}), 401
+    entries = achievements.summary(player)
+    return jsonify({
+        'player': player,
+        'unlocked': sum(1 for entry in entries if entry['unlocked_at'] is not None),
+        'total': len(entries),
+        'achievements': entries,
+    })
+
+def better_than_fraction(game, score):
+    """score より悪いスコアの割合（0.0〜1.0）"""
+    sketch = score_sketches[game]
+    if GAMES[game]['higher_is_better']:
+        return sketch.fraction_below(score)
+    return sketch.fraction_above(score)
+
+def maintain_leaderboards():
+    """日間・週間ランキングの切り替えと、締め切った期間の詰め直し"""
+    for boards in leaderboards.values():
+        boards.maintain()
+
+scheduler.register('maintain_leaderboards', maintain_leaderboards, 60, jitter=0.1)
+
+def current_player():
+    """ランキング上のプレイヤーID（ユーザー名を変更しても変わらない user_id）"""
+    if 'username' not in session:
+        return None
+    user_data = get_user_info(session['username'])
+    return user_data['user_id'] if user_data else None
+
+@app.route('/api/games/<game>/score', methods=['POST'])
+def submit_game_score(game):
+    if game not in GAMES:
+        return jsonify({'error': '不明なゲームです。'}), 404
+    player = current_player()
+    if player is None:
+        return jsonify({'error': 'ログインが必要です。'}), 401
+
+    if GAMES[game].get('server_scored'):
+        return jsonify({'error': 'このゲームのスコアはサーバーで記録されます。'}), 403
+
+    data = request.get_json(silent=True) or {}
+    score = data.get('score')
+    low, high = GAMES[game]['score_range']
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not low <= score <= high:
+        return jsonify({'error': '無効なスコアです。'}), 400
+
+    context = {}
+    if game == 'quiz':
+        # クイズのセッションはスコアの送信1回で使い切る（同じIDで2回目は送れない）
+        quiz = game_sessions.take(data.get('session'), QuizSession, player)
+        if quiz is None:
+            return jsonify({'error': 'クイズが開始されていません。'}), 400
+        # 不正チェック用に、サーバー側で数えた経過時間と正解数を渡す
+        context = {'elapsed': time.time() - quiz.started, 'correct': quiz.correct}
+
+    # 検証はキューに積むだけにして、応答を待たせない。ランキングには検証を通ってから載る
+    result_validator.submit(game, player, score, GAMES[game]['higher_is_better'], context)
+    return jsonify({
+        'game': game,
+        'pending': True,
+        'better_than': round(better_than_fraction(game, score) * 100, 1)
     })
 
+def record_score(game, player, score):
+    """サーバーが判定したスコアを記録し、APIで返す結果を作る"""
+    result = publish_score(game, player, score)
+    accept_score(game, player, score)
+    return result
+
+def publish_score(game, player, score):
+    """スコアをランキングと分布に載せ、APIで返す結果を作る"""
+    boards = leaderboards[game]
+    (improved, best, rank), period_ranks = boards.submit(player, score)
+    score_sketches[game].update(score)
+    return {
+        'game': game,
+        'improved': improved,
+        'best': best,
+        'rank': rank,
+        'total': len(boards.all_time),
+        'period_ranks': period_ranks,
+        'better_than': round(better_than_fraction(game, score) * 100, 1)
+    }
+
+@app.route('/api/games/<game>/leaderboard')
+def game_leaderboard(game):
+    if game not in GAMES:
+        return jsonify({'error': '不明なゲームです。'}), 404
+    period = request.args.get('period', 'all')
+    if period not in GameLeaderboards.PERIODS:
+        return jsonify({'error': '不明な期間です。'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    ago = max(request.args.get('ago', 0, type=int), 0)  # 1 なら前日（前週）
+
+    board = leaderboards[game].board(period, ago)
+    if board is None:
+        return jsonify({'game': game, 'period': period, 'total': 0, 'entries': [], 'me': None})
+    player = current_player()
+    me = None
+    if player is not None and board.best(player) is not None:
+        me = {'player': player, 'score': board.best(player), 'rank': board.rank(player)}
+
+    if offset == 0:
+        # 上位の一覧はシリアライズ済みのJSONをそのまま返す
+        body = b''.join([
+            b'{"game":', json.dumps(game).encode(),
+            b',"period":', json.dumps(period).encode(),
+            b',"total":', str(len(board)).encode(),
+            b',"entries":', board.top_json(limit),
+            b',"me":', json.dumps(me, ensure_ascii=False).encode('utf-8'),
+            b'}'])
+        return app.response_class(body, mimetype='application/json')
+
+    return jsonify({
+        'game': game,
+        'period': period,
+        'total': len(board),
+        'entries': [{'rank': rank, 'player': name, 'score': score}
+                    for rank, name, score in board.top(limit, offset)],
+        'me': me
+    })
+
+# 数字当て・記憶ゲーム・じゃんけん・クイズのサーバー側セッション（10分間操作がなければ破棄）
+game_sessions = GameSessionStore(ttl=600)
+scheduler.register('evict_game_sessions', game_sessions.evict_expired, 60, jitter=0.1)
+
+@app.route('/api/games/number/session', methods=['POST'])
+def start_number_game():
+    session_id, _ = game_sessions.create(NumberSession, current_player())
+    return jsonify({'session': session_id})
+
+@app.route('/api/games/number/guess', methods=['POST'])
+def number_guess():
+    data = request.get_json(silent=True) or {}
+    game = game_sessions.get(data.get('session'), NumberSession)
+    if game is None or game.finished:
+        return jsonify({'error': 'ゲームが見つかりません。もう一度始めてください。'}), 404
+    guess = data.get('guess')
+    if isinstance(guess, bool) or not isinstance(guess, int) or not 1 <= guess <= 100:
+        return jsonify({'error': '1〜100の数字を入力してください'}), 400
+
+    response = {'result': game.guess(guess), 'attempts': game.attempts}
+    if game.finished:
+        game_sessions.discard(data.get('session'))
+        if game.player is not None:
+            response['score'] = record_score('number', game.player, game.attempts)
+    return jsonify(response)
+
+@app.route('/api/games/rps/session', methods=['POST'])
+def start_rps_game():
+    session_id, _ = game_sessions.create(RPSSession, current_player())
+    return jsonify({'session': session_id})
+
+@app.route('/api/games/rps/play', methods=['POST'])
+def rps_play():
+    data = request.get_json(silent=True) or {}
+    game = game_sessions.get(data.get('session'), RPSSession)
+    if game is None:
+        return jsonify({'error': 'ゲームが見つかりません。もう一度始めてください。'}), 404
+    move = data.get('move')
+    if move not in RPS_MOVES:
+        return jsonify({'error': 'グー・チョキ・パーのどれかを選んでください。'}), 400
+
+    outcome, computer = game.play(move)
+    response = {'outcome': outcome, 'computer': computer,
+                'wins': game.wins, 'losses': game.losses, 'draws': game.draws}
+    # スコアはこのセッションでの勝ち数（勝つたびに記録する）
+    if outcome == 'win' and game.player is not None:
+        response['score'] = record_score('rps', game.player, game.wins)
+    return jsonify(response)
+
+@app.route('/api/games/memory/session', methods=['POST'])
+def start_memory_game():
+    session_id, game = game_sessions.create(MemorySession, current_player())
+    return jsonify({'session': session_id, 'cards': len(game.layout)})
+
+@app.route('/api/games/memory/flip', methods=['POST'])
+def memory_flip():
+    data = request.get_json(silent=True) or {}
+    game = game_sessions.get(data.get('session'), MemorySession)
+    if game is None or game.finished:
+        return jsonify({'error': 'ゲームが見つかりません。もう一度始めてください。'}), 404
+    index = data.get('index')
+    try:
+        symbol, matched = game.flip(index if isinstance(index, int) else -1)
+    except ValueError:
+        return jsonify({'error': 'そのカードはめくれません。'}), 400
+
+    response = {'symbol': symbol, 'matched': matched, 'attempts': game.attempts, 'finished': game.finished}
+    if game.finished:
+        game_sessions.discard(data.get('session'))
+        if game.player is not None:
+            response['score'] = record_score('memory', game.player, game.attempts)
+    return jsonify(response)
+
+# クイズの問題バンク（問題は data/quiz_questions.json、問題ごとの回答は game_stats の quiz_answers に記録）
+question_bank = QuestionBank.load(os.path.join(BASE_DIR, 'data', 'quiz_questions.json'))
+question_dealer = QuestionDealer(question_bank)
+
+# 以前の回答統計（quiz_stats.json）は起動時に quiz_answers の行へ移し、二重に取り込まないよう名前を変える
+LEGACY_QUIZ_STATS_FILE = os.environ.get('QUIZ_STATS_FILE', os.path.join(BASE_DIR, 'quiz_stats.json'))
+
+def migrate_legacy_quiz_stats(path):
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        counts = list(zip(data['attempts'], data['corrects']))
+        migrated = game_stats.import_answer_counts(counts, os.path.getmtime(path))
+        os.replace(path, path + '.migrated')
+    except (OSError, ValueError, KeyError, TypeError):
+        app.logger.exception("以前の回答統計 %s を移行できません", path)
+        return 0
+    app.logger.warning("以前の回答統計 %s から %d 件の回答を移行しました", path, migrated)
+    return migrated
+
+migrate_legacy_quiz_stats(LEGACY_QUIZ_STATS_FILE)
+
+def quiz_client_id():
+    """出題済み問題を覚えておくためのID（未ログインならセッションごと）"""
+    player = current_player()
+    if player is not None:
+        return player
+    if 'quiz_client' not in session:
+        session['quiz_client'] = secrets.token_hex(8)
+    return 'guest_' + session['quiz_client']
+
+@app.route('/api/quiz/questions')
+def quiz_questions():
+    count = min(max(request.args.get('count', 10, type=int), 1), 20)
+    difficulty = request.args.get('difficulty', type=int)
+    category = request.args.get('category') or None
+    # seed を指定すると同じ出題順を再現できる
+    seed = request.args.get('seed', type=int)
+    if seed is None:
+        seed = secrets.randbits(63)
+
+    chosen = question_dealer.draw(quiz_client_id(), count, seed, category, difficulty)
+    # 不正チェック用に、この回の開始時刻・出題した問題・回答済みの問題・正解数をサーバー側のセッションで数える
+    session_id, quiz = game_sessions.create(QuizSession, current_player(), seed)
+    quiz.serve(chosen)
+    return jsonify({
+        'session': session_id,
+        'seed': seed,
+        'categories': question_bank.categories,
+        'questions': [question_bank.question(qid) for qid in chosen]
+    })
+
+@app.route('/api/quiz/answer', methods=['POST'])
+def quiz_answer():
+    data = request.get_json(silent=True) or {}
+    quiz = game_sessions.get(data.get('session'), QuizSession)
+    if quiz is None:
+        return jsonify({'error': 'クイズが見つかりません。もう一度始めてください。'}), 404
+    qid = data.get('id')
+    choice = data.get('choice')
+    if not isinstance(qid, int) or not 0 <= qid < len(question_bank) or not isinstance(choice, int):
+        return jsonify({'error': '無効な回答です。'}), 400
+
+    if qid not in quiz.served:
+        return jsonify({'error': 'この回に出題された問題ではありません。'}), 400
+
+    answer = question_bank.correct_answer(qid)
+    # 同じ問題への2回目以降の回答は、正解数にも回答統計にも数えない
+    if quiz.answer(qid, choice == answer):
+        game_stats.record_answer(qid, choice == answer)
+    return jsonify({'correct': choice == answer, 'answer': answer})
+
+def stats_since():
+    """?hours=N なら直近 N 時間の開始時刻、指定がなければ None（全期間）"""
+    hours = request.args.get('hours', type=int)
+    return time.time() - hours * 3600 if hours and hours > 0 else None
+
+@app.route('/api/stats/games')
+def game_stats_summary():
+    error = admin_api_error()
+    if error:
+        return error
+    since = stats_since()
+    return jsonify({'since': since,
+                    'games': {game: dict(game_stats.summary(game, since), name=rules['name'],
+                                         higher_is_better=rules['higher_is_better'])
+                              for game, rules in GAMES.items()}})
+
+@app.route('/api/stats/games/<game>')
+def game_stats_detail(game):
+    error = admin_api_error()
+    if error:
+        return error
+    if game not in GAMES:
+        return jsonify({'error': '不明なゲームです。'}), 404
+    since = stats_since()
+    bins = min(max(request.args.get('bins', 20, type=int), 1), 100)
+    result = {
+        'game': game,
+        'since': since,
+        'summary': game_stats.summary(game, since),
+        'histogram': game_stats.histogram(game, bins, since),
+        'by_hour': game_stats.by_hour(game, since),
+    }
+    username = request.args.get('player')
+    if username:
+        user_data = get_user_info(username)
+        if not user_data:
+            return jsonify({'error': 'ユーザーが見つかりません。'}), 404
+        result['player'] = dict(game_stats.player_summary(game, user_data['user_id']), username=username)
+    return jsonify(result)
+
+@app.route('/api/stats/quiz')
+def quiz_accuracy_stats():
+    error = admin_api_error()
+    if error:
+        return error
+    entries = []
+    for entry in game_stats.quiz_accuracy(stats_since()):
+        # 問題バンクを差し替えて無くなった問題は出さない
+        if entry['question'] >= len(question_bank):
+            continue
+        question = question_bank.question(entry['question'])
+        entries.append(dict(entry, text=question['question'], category=question['category']))
+    # 正解率の低い（難しい）問題から
+    entries.sort(key=lambda entry: entry['accuracy'])
+    return jsonify({'questions': entries})
+
+# リアルタイム対戦（WebSocket）は Flask とは別ポートの asyncio ゲートウェイで受ける
+GATEWAY_PORT = int(os.environ.get('GAME_GATEWAY_PORT', 5001))
+
+def websocket_player(connection):
+    """ゲートウェイへの接続（WebSocket・チャットの HTTP）の Flask セッションクッキーからプレイヤーを特定する（未ログインならゲスト）"""
+    cookie = connection.cookie(app.config['SESSION_COOKIE_NAME'])
+    if cookie:
+        try:
+            data = app.session_interface.get_signing_serializer(app).loads(cookie)
+        except Exception:
+            data = {}
+        user_data = get_user_info(data.get('username', ''))
+        if user_data:
+            return user_data['user_id']
+    return guest_identity(connection)
+
+def record_realtime_score(game, player, score):
+    """対戦でサーバーが判定したスコアをランキングに記録する（ゲストは記録しない）"""
+    if not is_guest(player):
+        record_score(game, player, score)
+
+# 対戦のリプレイ（replay.py の形式、サイズでファイルを切り替える）
+REPLAY_DIR = os.environ.get('REPLAY_DIR', os.path.join(BASE_DIR, 'replays'))
+
+def record_rps_match(winner, loser, draw):
+    """オンライン対戦じゃんけんの結果を実績のイベントにする（ゲストは記録しない）"""
+    for player, outcome in ((winner, 'draw' if draw else 'win'), (loser, 'draw' if draw else 'lose')):
+        if not is_guest(player):
+            achievements.submit('rps_match', player, outcome=outcome)
+
+gateway = create_gateway(websocket_player, on_score=record_realtime_score,
+                         spectator_delay=lambda: server_settings.get("spectator_delay", 5),
+                         replay_dir=REPLAY_DIR, on_match=record_rps_match)
+
+@app.route('/api/replays/<replay_id>')
+def replay_detail(replay_id):
+    """リプレイをゲームのロジックで再生し直し、記録した結果と一致するかを返す"""
+    # 再生はファイルの読み込みとゲームのロジックを回すので、ログインしたユーザーだけにする
+    if current_player() is None:
+        return jsonify({'error': 'ログインが必要です。'}), 401
+    if not re.fullmatch(r'[0-9a-f]{16}', replay_id):
+        return jsonify({'error': '不明なリプレイです。'}), 404
+    gateway.replays.flush()
+    found = replay.find(REPLAY_DIR, replay_id)
+    if found is None:
+        return jsonify({'error': '不明なリプレイです。'}), 404
+    try:
+        outcome = replay.run(found)
+    except replay.ReplayError as e:
+        return jsonify(dict(found.summary(), error=str(e))), 409
+    return jsonify(dict(found.summary(), recorded=found.results, **outcome))
+
+# トーナメント（じゃんけん）。試合はゲートウェイで、チェックインした参加者どうしが対戦する
+tournaments = gateway.tournaments
+
+def admin_api_error():
+    """管理者でなければエラーレスポンスを返す"""
+    if 'username' not in session:
+        return jsonify({'error': 'ログインが必要です。'}), 401
+    if get_user_info(session['username'])['role'] != '管理者':
+        return jsonify({'error': '管理者権限が必要です。'}), 403
+    return None
+
+@app.route('/api/tournaments', methods=['GET', 'POST'])
+def tournament_list():
+    if request.method == 'GET':
+        return jsonify({'tournaments': tournaments.list(current_player())})
+    error = admin_api_error()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    name = str(data.get('name') or '').strip()[:50] or 'トーナメント'
+    rounds = data.get('rounds')
+    if rounds is not None and (not isinstance(rounds, int) or not 1 <= rounds <= 20):
+        return jsonify({'error': 'ラウンド数は1〜20で指定してください。'}), 400
+    try:
+        tournament = tournaments.create(name, data.get('format', 'single_elimination'), rounds)
+    except TournamentError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(tournament.summary()), 201
+
+@app.route('/api/tournaments/<int:tournament_id>')
+def tournament_detail(tournament_id):
+    # 組み合わせ表はトーナメント側でシリアライズ済みのものを返す（変わったラウンドだけ作り直される）
+    view = tournaments.view(tournament_id)
+    if view is None:
+        return jsonify({'error': '不明なトーナメントです。'}), 404
+    return app.response_class(view, mimetype='application/json')
+
+@app.route('/api/tournaments/<int:tournament_id>/<action>', methods=['POST'])
+def tournament_action(tournament_id, action):
+    if action not in ('join', 'leave', 'start'):
+        return jsonify({'error': '不明な操作です。'}), 404
+    if action == 'start':
+        error = admin_api_error()
+        if error:
+            return error
+    else:
+        player = current_player()
+        if player is None:
+            return jsonify({'error': 'トーナメントに参加するにはログインしてください。'}), 401
+    try:
+        if action == 'start':
+            tournament = tournaments.start(tournament_id)
+        else:
+            getattr(tournaments, action)(tournament_id, player)
+            tournament = tournaments.get(tournament_id)
+    except TournamentError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(tournament.summary())
+
 
 if __name__ == '__main__':
+    # debug=True ではリローダーの子プロセスだけがゲートウェイを起動する
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        gateway.run_in_thread('0.0.0.0', GATEWAY_PORT)
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""レーティングの近いプレイヤー同士を組み合わせる対戦待ちキュー
+
+待機中のプレイヤーはレーティング BUCKET_WIDTH ごとのバケツに入れ、
+空でないバケツの番号だけをソート済みで持つ。参加時は自分の許容範囲にかかるバケツだけを
+二分探索で探すので、待機人数 n に対して O(log n)（＋範囲内のバケツ数）で相手が見つかる。
+待ち時間が延びると許容範囲を広げ、定期的な sweep() で広がった範囲の相手を探し直す。
+"""
+import bisect
+import statistics
+import time
+from collections import OrderedDict, deque
+
+BUCKET_WIDTH = 50
+# 許容範囲がこれだけ広がったら探し直す
+RESEARCH_STEP = BUCKET_WIDTH // 2
+
+
+class Ticket:
+    __slots__ = ('player', 'rating', 'enqueued', 'bucket', 'searched')
+
+    def __init__(self, player, rating, enqueued):
+        self.player = player
+        self.rating = rating
+        self.enqueued = enqueued
+        self.bucket = int(rating // BUCKET_WIDTH)
+        self.searched = 0    # 最後に相手を探したときの許容範囲
+
+
+class Matchmaker:
+    """window は最初の許容レーティング差、widen_per_second 秒ごとに広げる量、max_window が上限"""
+
+    def __init__(self, window=100, widen_per_second=25, max_window=600, samples=1000):
+        self.window = window
+        self.widen_per_second = widen_per_second
+        self.max_window = max_window
+        self._buckets = {}               # {バケツ番号: OrderedDict(player -> Ticket)}（古い順）
+        # player はハッシュ可能なら何でもよい（同じユーザーの別接続を区別するため接続ごとのオブジェクトを使う）
+        self._occupied = []              # 空でないバケツ番号（昇順）
+        self._tickets = OrderedDict()    # {player: Ticket}（参加順）
+        self._wait_times = deque(maxlen=samples)
+        self.matched = 0
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, player):
+        return player in self._tickets
+
+    def window_for(self, ticket, now):
+        waited = now - ticket.enqueued
+        return min(self.window + waited * self.widen_per_second, self.max_window)
+
+    def enqueue(self, player, rating, now=None):
+        """待機に加える。すぐに相手が見つかれば (相手の Ticket, 自分の Ticket) を返す"""
+        now = time.monotonic() if now is None else now
+        if player in self._tickets:
+            return None
+        ticket = Ticket(player, rating, now)
+        ticket.searched = self.window
+        opponent = self._find(ticket, self.window, now)
+        if opponent is not None:
+            self._remove(opponent)
+            self._record_match(now, opponent, ticket)
+            return opponent, ticket
+        self._add(ticket)
+        return None
+
+    def cancel(self, player):
+        ticket = self._tickets.get(player)
+        if ticket is not None:
+            self._remove(ticket)
+        return ticket
+
+    def sweep(self, now=None):
+        """待ち時間で許容範囲が広がったプレイヤーの相手を探し直し、成立した組のリストを返す"""
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for ticket in list(self._tickets.values()):
+            if ticket.player not in self._tickets:
+                continue
+            window = self.window_for(ticket, now)
+            if window - self.window < RESEARCH_STEP:
+                # これ以降はもっと新しいので範囲はまだ広がっていない
+                break
+            if window - ticket.searched < RESEARCH_STEP:
+                continue
+            ticket.searched = window
+            opponent = self._find(ticket, window, now)
+            if opponent is None:
+                continue
+            self._remove(ticket)
+            self._remove(opponent)
+            self._record_match(now, ticket, opponent)
+            pairs.append((ticket, opponent))
+        return pairs
+
+    def _find(self, ticket, window, now):
+        """最もレーティングの近いバケツの、最も長く待っている相手
+
+        どちらかの許容範囲に入っていれば組み合わせる（長く待っている相手の範囲は広い）。
+        """
+        low = bisect.bisect_left(self._occupied, int((ticket.rating - self.max_window) // BUCKET_WIDTH))
+        high = bisect.bisect_right(self._occupied, int((ticket.rating + self.max_window) // BUCKET_WIDTH))
+        best = None
+        best_diff = None
+        for key in self._occupied[low:high]:
+            candidate = None
+            for candidate in self._buckets[key].values():
+                if candidate is not ticket:
+                    break
+            if candidate is None or candidate is ticket:
+                continue
+            diff = abs(candidate.rating - ticket.rating)
+            if diff > window and diff > self.window_for(candidate, now):
+                continue
+            if best is None or diff < best_diff:
+                best, best_diff = candidate, diff
+        return best
+
+    def _add(self, ticket):
+        bucket = self._buckets.get(ticket.bucket)
+        if bucket is None:
+            bucket = self._buckets[ticket.bucket] = OrderedDict()
+            bisect.insort(self._occupied, ticket.bucket)
+        bucket[ticket.player] = ticket
+        self._tickets[ticket.player] = ticket
+
+    def _remove(self, ticket):
+        bucket = self._buckets[ticket.bucket]
+        del bucket[ticket.player]
+        del self._tickets[ticket.player]
+        if not bucket:
+            del self._buckets[ticket.bucket]
+            del self._occupied[bisect.bisect_left(self._occupied, ticket.bucket)]
+
+    def _record_match(self, now, *tickets):
+        self.matched += 1
+        for ticket in tickets:
+            self._wait_times.append(now - ticket.enqueued)
+
+    def metrics(self):
+        wait_times = list(self._wait_times)
+        return {
+            'queue_length': len(self._tickets),
+            'matched': self.matched,
+            'median_time_to_match': round(statistics.median(wait_times), 2) if wait_times else None,
+        }
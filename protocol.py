@@ -0,0 +1,216 @@
+"""リアルタイム対戦のバイナリメッセージ形式
+
+毎ティック送るメッセージ（部屋の状態）と、プレイヤーの入力だけをバイナリにする。
+開始・終了などたまにしか送らないメッセージは JSON のまま。
+
+先頭2バイトはヘッダー（バージョン, 種類）、以降の整数は可変長（LEB128 の符号なし varint）。
+小さい値が多いので、ほとんどのフィールドは1バイトで済む。
+形式を変えるときは PROTOCOL_VERSION を上げ、minigame_template の decodeGameMessage も合わせる。
+バージョンは hello（観戦は spectate）の JSON でも知らせ、古いページのクライアントは自分から切る。
+
+    状態（サーバー → クライアント、キーフレーム）
+        ヘッダー, tick, 状態（0: カウントダウン / 1: レース中）, 残り時間（0.1秒単位）, 人数,
+        人数分の [スロット番号, 得点, コンボ, 回答済みの問題数]
+    差分（サーバー → クライアント）
+        ヘッダー, tick, 基準の tick, 状態, 残り時間, 変わったプレイヤー数,
+        その人数分の [スロット番号, 変更ビット, 変わったフィールドの値...]
+        変更ビットは 1: 得点, 2: コンボ, 4: 問題数, 8: 退出
+    回答（クライアント → サーバー）
+        ヘッダー, 問題番号, 一致と答えたか（0 / 1）
+    受信確認（クライアント → サーバー）
+        ヘッダー, 受け取った状態の tick
+"""
+import struct
+
+PROTOCOL_VERSION = 2       # 1: 状態と回答、2: 差分と受信確認を追加
+
+MSG_STATE = 1
+MSG_ANSWER = 2
+MSG_DELTA = 3
+MSG_ACK = 4
+
+PLAYER_FIELDS = 3          # 得点, コンボ, 問題数
+FIELD_REMOVED = 8
+
+RACE_STATES = ('countdown', 'racing')
+
+HEADER = struct.Struct('!BB')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class ProtocolVersionError(ProtocolError):
+    """相手が別のバージョンの形式で送ってきた（古いページのままなど）"""
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, offset):
+    """(値, 次の位置) を返す"""
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[offset]
+        except IndexError:
+            raise ProtocolError('truncated varint') from None
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+        if shift > 63:
+            raise ProtocolError('varint too long')
+
+
+def encode_state(tick, state, remaining, players):
+    """players は [(スロット番号, 得点, コンボ, 問題数), ...]"""
+    buffer = bytearray(HEADER.pack(PROTOCOL_VERSION, MSG_STATE))
+    write_varint(buffer, tick)
+    buffer.append(RACE_STATES.index(state))
+    write_varint(buffer, round(remaining * 10))
+    write_varint(buffer, len(players))
+    for fields in players:
+        for value in fields:
+            if value < 0x80:
+                buffer.append(value)
+            else:
+                write_varint(buffer, value)
+    return bytes(buffer)
+
+
+def encode_delta(tick, base_tick, state, remaining, base, current):
+    """base / current はスロット番号ごとの (得点, コンボ, 問題数)（いなければ None）のタプル"""
+    buffer = bytearray(HEADER.pack(PROTOCOL_VERSION, MSG_DELTA))
+    write_varint(buffer, tick)
+    write_varint(buffer, base_tick)
+    buffer.append(RACE_STATES.index(state))
+    write_varint(buffer, round(remaining * 10))
+    changes = bytearray()
+    count = 0
+    for slot in range(max(len(base), len(current))):
+        old = base[slot] if slot < len(base) else None
+        new = current[slot] if slot < len(current) else None
+        if old == new:
+            continue
+        count += 1
+        write_varint(changes, slot)
+        if new is None:
+            changes.append(FIELD_REMOVED)
+            continue
+        if old is None:
+            old = (None,) * PLAYER_FIELDS
+        mask = 0
+        values = []
+        for field in range(PLAYER_FIELDS):
+            if old[field] != new[field]:
+                mask |= 1 << field
+                values.append(new[field])
+        changes.append(mask)
+        for value in values:
+            if value < 0x80:
+                changes.append(value)
+            else:
+                write_varint(changes, value)
+    write_varint(buffer, count)
+    buffer += changes
+    return bytes(buffer)
+
+
+def apply_delta(base, changes):
+    """{スロット番号: [得点, コンボ, 問題数]} に差分を当てた新しい辞書を返す"""
+    players = {slot: list(fields) for slot, fields in base.items()}
+    for slot, mask, values in changes:
+        if mask & FIELD_REMOVED:
+            players.pop(slot, None)
+            continue
+        fields = players.setdefault(slot, [0] * PLAYER_FIELDS)
+        for field, value in values.items():
+            fields[field] = value
+    return players
+
+
+def encode_ack(tick):
+    buffer = bytearray(HEADER.pack(PROTOCOL_VERSION, MSG_ACK))
+    write_varint(buffer, tick)
+    return bytes(buffer)
+
+
+def encode_answer(item, match):
+    buffer = bytearray(HEADER.pack(PROTOCOL_VERSION, MSG_ANSWER))
+    write_varint(buffer, item)
+    buffer.append(1 if match else 0)
+    return bytes(buffer)
+
+
+def decode(data):
+    """バイナリメッセージを辞書にする。形式が違えば ProtocolError"""
+    if len(data) < HEADER.size:
+        raise ProtocolError('message too short')
+    version, kind = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolVersionError(f'unsupported protocol version {version}')
+    offset = HEADER.size
+
+    if kind == MSG_ANSWER:
+        item, offset = read_varint(data, offset)
+        if offset >= len(data):
+            raise ProtocolError('truncated answer')
+        return {'type': 'answer', 'item': item, 'match': data[offset] == 1}
+
+    if kind == MSG_ACK:
+        tick, offset = read_varint(data, offset)
+        return {'type': 'ack', 'tick': tick}
+
+    if kind == MSG_DELTA:
+        tick, offset = read_varint(data, offset)
+        base_tick, offset = read_varint(data, offset)
+        if offset >= len(data) or data[offset] >= len(RACE_STATES):
+            raise ProtocolError('bad race state')
+        state = RACE_STATES[data[offset]]
+        remaining, offset = read_varint(data, offset + 1)
+        count, offset = read_varint(data, offset)
+        changes = []
+        for _ in range(count):
+            slot, offset = read_varint(data, offset)
+            if offset >= len(data):
+                raise ProtocolError('truncated delta')
+            mask = data[offset]
+            offset += 1
+            values = {}
+            for field in range(PLAYER_FIELDS):
+                if mask & (1 << field):
+                    values[field], offset = read_varint(data, offset)
+            changes.append((slot, mask, values))
+        return {'type': 'delta', 'tick': tick, 'base': base_tick, 'state': state,
+                'remaining': remaining / 10, 'changes': changes}
+
+    if kind == MSG_STATE:
+        tick, offset = read_varint(data, offset)
+        if offset >= len(data) or data[offset] >= len(RACE_STATES):
+            raise ProtocolError('bad race state')
+        state = RACE_STATES[data[offset]]
+        remaining, offset = read_varint(data, offset + 1)
+        count, offset = read_varint(data, offset)
+        players = []
+        for _ in range(count):
+            fields = []
+            for _ in range(4):
+                if offset < len(data) and data[offset] < 0x80:
+                    fields.append(data[offset])
+                    offset += 1
+                else:
+                    value, offset = read_varint(data, offset)
+                    fields.append(value)
+            players.append(fields)
+        return {'type': 'state', 'tick': tick, 'state': state, 'remaining': remaining / 10,
+                'players': players}
+
+    raise ProtocolError(f'unknown message type {kind}')
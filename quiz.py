@@ -0,0 +1,128 @@
+"""クイズの問題バンク
+
+問題はファイルから読み込み、カテゴリ・難易度ごとの問題番号の配列で引けるようにする。
+ユーザーごとに出題済みの問題をビットマップで覚えておき、全問出し終わるまで同じ問題は出さない。
+未出題の問題が多いうちは候補から乱数で引いて出題済みなら引き直すので、1回の出題は問題数によらない。
+覚えておくのは最近出題した max_users 人分まで（ゲストはセッションごとに別人になるため）。
+"""
+import json
+import random
+import threading
+from array import array
+from collections import OrderedDict
+
+
+class QuestionBank:
+    """問題番号で引く読み取り専用の問題集"""
+
+    def __init__(self, questions):
+        self.categories = sorted({q['category'] for q in questions})
+        category_ids = {name: i for i, name in enumerate(self.categories)}
+        self._texts = [q['question'] for q in questions]
+        self._options = [tuple(q['options']) for q in questions]
+        self._correct = bytes(q['correct'] for q in questions)
+        self._category = bytes(category_ids[q['category']] for q in questions)
+        self._difficulty = bytes(q.get('difficulty', 1) for q in questions)
+        self._index = {}   # {(カテゴリ番号, 難易度): array('I', 問題番号)}
+        for qid in range(len(questions)):
+            key = (self._category[qid], self._difficulty[qid])
+            self._index.setdefault(key, array('I')).append(qid)
+        self._candidates = {}   # {(カテゴリ, 難易度): 問題番号のタプル}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def __len__(self):
+        return len(self._texts)
+
+    def candidates(self, category=None, difficulty=None):
+        """条件に合う問題番号のタプル（問題集は変わらないので条件ごとに覚えておく）"""
+        key = (category, difficulty)
+        result = self._candidates.get(key)
+        if result is None:
+            result = self._candidates[key] = tuple(self._find(category, difficulty))
+        return result
+
+    def _find(self, category, difficulty):
+        category_id = self.categories.index(category) if category in self.categories else None
+        if category is not None and category_id is None:
+            return []
+        result = []
+        for (cat, diff), ids in self._index.items():
+            if (category_id is None or cat == category_id) and (difficulty is None or diff == difficulty):
+                result.extend(ids)
+        result.sort()
+        return result
+
+    def question(self, qid):
+        """クライアントに渡す問題（正解は含めない）"""
+        return {
+            'id': qid,
+            'question': self._texts[qid],
+            'options': list(self._options[qid]),
+            'category': self.categories[self._category[qid]],
+            'difficulty': self._difficulty[qid],
+        }
+
+    def correct_answer(self, qid):
+        return self._correct[qid]
+
+
+class QuestionDealer:
+    """ユーザーごとに出題済みの問題を覚えて、重複なしで問題を配る"""
+
+    def __init__(self, bank, max_users=10000):
+        self.bank = bank
+        self.max_users = max_users
+        self._seen = OrderedDict()   # {ユーザー: 出題済みビットマップ}（最後に出題した順）
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def draw(self, user, count, seed, category=None, difficulty=None):
+        """seed で決まる順番で、まだ出していない問題を count 問選ぶ"""
+        candidates = self.bank.candidates(category, difficulty)
+        rng = random.Random(seed)
+        with self._lock:
+            seen = self._seen.get(user)
+            if seen is None:
+                seen = self._seen[user] = bytearray((len(self.bank) + 7) // 8)
+                if len(self._seen) > self.max_users:
+                    self._seen.popitem(last=False)
+            else:
+                self._seen.move_to_end(user)
+            chosen = self._sample(seen, candidates, count, rng)
+            if chosen is None:
+                unseen = [qid for qid in candidates if not seen[qid >> 3] & (1 << (qid & 7))]
+                if len(unseen) < count:
+                    # 出し尽くしたら、この条件の問題を未出題に戻す
+                    for qid in candidates:
+                        seen[qid >> 3] &= ~(1 << (qid & 7)) & 0xFF
+                    unseen = candidates
+                chosen = rng.sample(unseen, min(count, len(unseen)))
+            for qid in chosen:
+                seen[qid >> 3] |= 1 << (qid & 7)
+        return chosen
+
+    @staticmethod
+    def _sample(seen, candidates, count, rng, tries=8):
+        """候補から引いて出題済みなら引き直す。count * tries 回で足りなければ None（全体をなめる方に任せる）"""
+        size = len(candidates)
+        if count > size:
+            return None
+        chosen = []
+        for _ in range(count * tries):
+            qid = candidates[rng.randrange(size)]
+            if not seen[qid >> 3] & (1 << (qid & 7)) and qid not in chosen:
+                chosen.append(qid)
+                if len(chosen) == count:
+                    return chosen
+        return None
+
+    def forget(self, user):
+        with self._lock:
+            self._seen.pop(user, None)
+
@@ -0,0 +1,86 @@
+"""対戦ゲームのレーティング（Glicko）
+
+各プレイヤーはレーティングとその不確かさ（RD）を持つ。
+試合が少ない・しばらく遊んでいないプレイヤーほど RD が大きく、1試合での変動も大きい。
+"""
+import math
+import threading
+import time
+
+DEFAULT_RATING = 1500.0
+DEFAULT_RD = 350.0
+MIN_RD = 30.0
+# 遊ばない期間が1日あたり RD をどれだけ戻すか（約100日で最大値に戻る）
+RD_DECAY = 34.6
+RATING_PERIOD = 24 * 3600
+
+_Q = math.log(10) / 400
+
+
+def _g(rd):
+    return 1 / math.sqrt(1 + 3 * _Q * _Q * rd * rd / (math.pi * math.pi))
+
+
+def expected_score(rating, opponent_rating, opponent_rd):
+    """rating のプレイヤーが勝つ見込み（0.0〜1.0）"""
+    return 1 / (1 + 10 ** (-_g(opponent_rd) * (rating - opponent_rating) / 400))
+
+
+class Rating:
+    __slots__ = ('rating', 'rd', 'games', 'last_played')
+
+    def __init__(self, rating=DEFAULT_RATING, rd=DEFAULT_RD, games=0, last_played=None):
+        self.rating = rating
+        self.rd = rd
+        self.games = games
+        self.last_played = last_played
+
+    def current_rd(self, now):
+        """最後に遊んでからの期間に応じて広がった RD"""
+        if self.last_played is None:
+            return self.rd
+        periods = max(now - self.last_played, 0) / RATING_PERIOD
+        return min(math.sqrt(self.rd * self.rd + RD_DECAY * RD_DECAY * periods), DEFAULT_RD)
+
+    def to_dict(self):
+        return {'rating': round(self.rating), 'rd': round(self.rd), 'games': self.games}
+
+
+class RatingBook:
+    """1ゲーム分のプレイヤーごとのレーティング"""
+
+    def __init__(self):
+        self._ratings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ratings)
+
+    def get(self, player):
+        """プレイヤーのレーティング（未登録なら初期値、登録はしない）"""
+        return self._ratings.get(player) or Rating()
+
+    def forget(self, player):
+        with self._lock:
+            self._ratings.pop(player, None)
+
+    def record(self, first, second, outcome, now=None):
+        """1試合の結果を反映する。outcome は first から見た得点（勝ち 1.0、引き分け 0.5、負け 0.0）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            a = self._ratings.get(first) or Rating()
+            b = self._ratings.get(second) or Rating()
+            a_rd, b_rd = a.current_rd(now), b.current_rd(now)
+            self._ratings[first] = self._updated(a, a_rd, b.rating, b_rd, outcome, now)
+            self._ratings[second] = self._updated(b, b_rd, a.rating, a_rd, 1.0 - outcome, now)
+            return self._ratings[first], self._ratings[second]
+
+    @staticmethod
+    def _updated(player, rd, opponent_rating, opponent_rd, score, now):
+        g = _g(opponent_rd)
+        expected = expected_score(player.rating, opponent_rating, opponent_rd)
+        d_squared = 1 / (_Q * _Q * g * g * expected * (1 - expected))
+        precision = 1 / (rd * rd) + 1 / d_squared
+        rating = player.rating + _Q / precision * g * (score - expected)
+        new_rd = max(math.sqrt(1 / precision), MIN_RD)
+        return Rating(rating, new_rd, player.games + 1, now)
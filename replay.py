@@ -0,0 +1,372 @@
+"""対戦のリプレイ記録
+
+試合中は入力を (前の記録からの tick 数, プレイヤー番号, 入力) の varint の並びとして
+試合ごとの bytearray に追記するだけにし、試合が終わったら1ブロックにまとめて ReplayWriter に渡す。
+ファイルへの書き込みはバックグラウンドのスレッドがバッファ付きでまとめて行い、
+ファイルが max_bytes を超えたら次のファイルに切り替え、古いファイルは max_files 個まで残す。
+ファイルごとに索引（.idx、ブロックごとに リプレイ ID 8バイト + ファイル内の位置 8バイト）も書いておき、
+ID で探すときはブロック本体を読まずに索引だけを調べる。
+リプレイ ID の先頭4バイトは試合の開始時刻なので、試合より前に書き終わったファイルは調べない。
+
+各ゲームの replay(Replay) は記録した入力を同じゲームのロジックに流し直し、保存してある結果と一致するかを返す。
+待ち時間なしで tick を進めるので、実際の試合よりずっと速く再生できる。
+
+    ブロック
+        本文の長さ, 本文
+    本文
+        形式のバージョン（1バイト）, ゲーム（1バイト）, リプレイ ID（8バイト）, 開始時刻（UNIX 秒）,
+        パラメータ数, パラメータ..., プレイヤー数, [名前の長さ, 名前（UTF-8）]...,
+        結果の数, 結果..., 入力の数, [tick の差, プレイヤー番号, 入力]...
+
+使い方: python replay.py ディレクトリ [リプレイ ID]   （ID なしなら一覧）
+"""
+import logging
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import deque
+
+from protocol import write_varint, read_varint, ProtocolError
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+GAME_COLOR_RACE = 1
+GAME_RPS = 2
+GAME_NAMES = {GAME_COLOR_RACE: 'color_race', GAME_RPS: 'rps'}
+
+FILE_PREFIX = 'replays-'
+FILE_SUFFIX = '.bin'
+INDEX_SUFFIX = '.idx'
+INDEX_ENTRY = struct.Struct('!8sQ')    # リプレイ ID, ブロックの位置
+
+
+class ReplayError(ValueError):
+    pass
+
+
+class MatchRecord:
+    """1試合分の記録（試合中は入力を追記するだけ）"""
+
+    __slots__ = ('game', 'replay_id', 'started_at', 'params', 'players', 'inputs', 'count', 'last_tick')
+
+    def __init__(self, game, players, params=(), started_at=None):
+        self.game = game
+        self.started_at = int(started_at if started_at is not None else time.time())
+        # 開始時刻（4バイト）+ 乱数（4バイト）
+        self.replay_id = (self.started_at.to_bytes(4, 'big') + secrets.token_bytes(4)).hex()
+        self.params = list(params)
+        self.players = list(players)
+        self.inputs = bytearray()
+        self.count = 0
+        self.last_tick = 0
+
+    def add(self, tick, player, value):
+        """tick（試合開始からの tick・ラウンド数）に player 番目のプレイヤーが value を入力した"""
+        inputs = self.inputs
+        write_varint(inputs, tick - self.last_tick)
+        inputs.append(player)
+        write_varint(inputs, value)
+        self.last_tick = tick
+        self.count += 1
+
+    def encode(self, results):
+        """結果を添えて1ブロックのバイト列にする"""
+        body = bytearray((FORMAT_VERSION, self.game))
+        body += bytes.fromhex(self.replay_id)
+        write_varint(body, self.started_at)
+        write_varint(body, len(self.params))
+        for value in self.params:
+            write_varint(body, value)
+        write_varint(body, len(self.players))
+        for name in self.players:
+            encoded = name.encode('utf-8')
+            write_varint(body, len(encoded))
+            body += encoded
+        write_varint(body, len(results))
+        for value in results:
+            write_varint(body, value)
+        write_varint(body, self.count)
+        body += self.inputs
+
+        block = bytearray()
+        write_varint(block, len(body))
+        return bytes(block + body)
+
+
+class Replay:
+    """読み込んだ1試合分の記録。inputs は [(tick, プレイヤー番号, 入力), ...]"""
+
+    __slots__ = ('game', 'replay_id', 'started_at', 'params', 'players', 'results', 'inputs')
+
+    def __init__(self, game, replay_id, started_at, params, players, results, inputs):
+        self.game = game
+        self.replay_id = replay_id
+        self.started_at = started_at
+        self.params = params
+        self.players = players
+        self.results = results
+        self.inputs = inputs
+
+    def summary(self):
+        return {
+            'replay_id': self.replay_id,
+            'game': GAME_NAMES.get(self.game, self.game),
+            'started_at': self.started_at,
+            'players': self.players,
+            'inputs': len(self.inputs),
+        }
+
+
+def decode_block(data, offset=0):
+    """data の offset から1ブロック読み、(Replay, 次の位置) を返す"""
+    length, start = read_varint(data, offset)
+    end = start + length
+    if end > len(data) or length < 10:
+        raise ReplayError('truncated replay block')
+    body = memoryview(data)[start:end]
+    if body[0] != FORMAT_VERSION:
+        raise ReplayError(f'unsupported replay format {body[0]}')
+    game = body[1]
+    replay_id = bytes(body[2:10]).hex()
+    try:
+        started_at, pos = read_varint(body, 10)
+        count, pos = read_varint(body, pos)
+        params = []
+        for _ in range(count):
+            value, pos = read_varint(body, pos)
+            params.append(value)
+        count, pos = read_varint(body, pos)
+        players = []
+        for _ in range(count):
+            size, pos = read_varint(body, pos)
+            players.append(bytes(body[pos:pos + size]).decode('utf-8'))
+            pos += size
+        count, pos = read_varint(body, pos)
+        results = []
+        for _ in range(count):
+            value, pos = read_varint(body, pos)
+            results.append(value)
+        count, pos = read_varint(body, pos)
+        inputs = []
+        tick = 0
+        for _ in range(count):
+            delta, pos = read_varint(body, pos)
+            player = body[pos]
+            value, pos = read_varint(body, pos + 1)
+            tick += delta
+            inputs.append((tick, player, value))
+    except (ProtocolError, IndexError, UnicodeDecodeError) as e:
+        raise ReplayError(f'corrupt replay block: {e}') from None
+    return Replay(game, replay_id, started_at, params, players, results, inputs), end
+
+
+def iter_file(path):
+    """1ファイル分のリプレイを先頭から順に返す（書きかけの末尾のブロックは飛ばす）"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        try:
+            replay, offset = decode_block(data, offset)
+        except (ReplayError, ProtocolError):
+            logger.warning("リプレイファイルの %d バイト目以降を読めませんでした: %s", offset, path)
+            return
+        yield replay
+
+
+def replay_files(directory):
+    """古い順のリプレイファイルの一覧"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names
+                  if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX))
+
+
+def index_path(path):
+    return path[:-len(FILE_SUFFIX)] + INDEX_SUFFIX
+
+
+def read_block(path, offset):
+    """ファイルの offset にある1ブロックを読む"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(10)
+        length, start = read_varint(data, 0)
+        data += f.read(start + length - len(data))
+    return decode_block(data)[0]
+
+
+def find_in_file(path, replay_id):
+    """1ファイルの中をリプレイ ID で探す。なければ None"""
+    try:
+        with open(index_path(path), 'rb') as f:
+            index = f.read()
+    except FileNotFoundError:
+        # 索引のないファイルは先頭から読む
+        for replay in iter_file(path):
+            if replay.replay_id == replay_id:
+                return replay
+        return None
+    key = bytes.fromhex(replay_id)
+    found = index.find(key)
+    while found != -1 and found % INDEX_ENTRY.size:
+        found = index.find(key, found + 1)
+    if found == -1:
+        return None
+    _, offset = INDEX_ENTRY.unpack_from(index, found)
+    return read_block(path, offset)
+
+
+def find(directory, replay_id):
+    """リプレイ ID で探す（新しいファイルから、試合の開始より後に書き込まれたものだけ）。なければ None"""
+    started_at = int(replay_id[:8], 16)
+    for path in reversed(replay_files(directory)):
+        try:
+            if os.path.getmtime(path) < started_at:
+                break   # これより古いファイルは試合が始まる前に書き終わっている
+            replay = find_in_file(path, replay_id)
+        except (OSError, ReplayError, ProtocolError):
+            logger.warning("リプレイファイルを読めませんでした: %s", path, exc_info=True)
+            continue
+        if replay is not None:
+            return replay
+    return None
+
+
+def run(replay):
+    """ゲームのロジックで再生し、{'results': 再生した結果, 'verified': 保存した結果と一致するか, ...} を返す"""
+    if replay.game == GAME_COLOR_RACE:
+        from color_race import replay as game_replay
+    elif replay.game == GAME_RPS:
+        from rps import replay as game_replay
+    else:
+        raise ReplayError(f'unknown game {replay.game}')
+    outcome = game_replay(replay)
+    outcome['verified'] = outcome['results'] == replay.results
+    return outcome
+
+
+class ReplayWriter:
+    """完成した試合のブロックを、バックグラウンドのスレッドでファイルに追記する
+
+    submit() は deque に積むだけなので、ゲームのループ（イベントループ）を待たせない。
+    """
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024, max_files=50, flush_interval=1.0,
+                 buffer_size=256 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._queue = deque()          # append / popleft はスレッドセーフ
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()  # 書き込み用のスレッドと flush() を呼ぶスレッドの間で file を守る
+        self._file = None
+        self._index = None
+        self._file_size = 0
+        self._sequence = 0
+        self.blocks_written = 0
+        self.bytes_written = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def submit(self, block):
+        self._queue.append(block)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='replay-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                self.errors += 1
+                logger.exception("リプレイの書き込みに失敗しました")
+
+    def flush(self):
+        """溜まっているブロックを書き込んでファイルに反映する"""
+        queue = self._queue
+        if not queue:
+            return
+        with self._lock:
+            while queue:
+                block = queue.popleft()
+                if self._file is None or self._file_size + len(block) > self.max_bytes:
+                    self._rotate()
+                _, start = read_varint(block, 0)
+                self._index.write(INDEX_ENTRY.pack(block[start + 2:start + 10], self._file_size))
+                self._file.write(block)
+                self._file_size += len(block)
+                self.blocks_written += 1
+                self.bytes_written += len(block)
+            # 索引が指すブロックが先にファイルに出ているように、本体から書き出す
+            self._file.flush()
+            self._index.flush()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._index.close()
+            self.rotations += 1
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{FILE_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence:04d}{FILE_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        self._file = open(path, 'ab', buffering=self.buffer_size)
+        self._index = open(index_path(path), 'ab')
+        self._file_size = self._file.tell()
+        for old in replay_files(self.directory)[:-self.max_files]:
+            for remove in (old, index_path(old)):
+                try:
+                    os.remove(remove)
+                except OSError:
+                    pass
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._index.close()
+                self._file = self._index = None
+
+    def metrics(self):
+        return {
+            'pending': len(self._queue),
+            'blocks_written': self.blocks_written,
+            'bytes_written': self.bytes_written,
+            'files': len(replay_files(self.directory)),
+            'rotations': self.rotations,
+            'errors': self.errors,
+        }
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    if len(sys.argv) < 2:
+        sys.exit('使い方: python replay.py ディレクトリ [リプレイ ID]')
+    if len(sys.argv) == 2:
+        for path in replay_files(sys.argv[1]):
+            for replay in iter_file(path):
+                print(json.dumps(replay.summary(), ensure_ascii=False))
+    else:
+        replay = find(sys.argv[1], sys.argv[2])
+        if replay is None:
+            sys.exit('見つかりませんでした')
+        print(json.dumps(dict(replay.summary(), **run(replay)), ensure_ascii=False, indent=2))
@@ -0,0 +1,386 @@
+"""オンライン対戦じゃんけん
+
+レーティングの近い2人を組み合わせて、各ラウンドの手を制限時間内に集め、サーバーで勝敗を決めて両者に送る。
+先に WINS_NEEDED 勝した方が試合の勝者（最大 MAX_ROUNDS ラウンド）。試合後にレーティングを更新する。
+recorder（replay.ReplayWriter）を渡すと、試合ごとに (ラウンド, プレイヤー番号, 手) を記録し、replay() で再生できる。
+tournaments（tournament.TournamentDirector）を渡すと、{"type": "tournament"} でチェックインしたプレイヤーの
+トーナメントの試合を、両者がそろったところで始める。
+"""
+import asyncio
+import itertools
+import json
+import logging
+
+import ws
+from game_gateway import is_guest
+from replay import MatchRecord, ReplayError, GAME_RPS
+from matchmaking import Matchmaker
+from ratings import RatingBook
+
+logger = logging.getLogger(__name__)
+
+MOVES = ('rock', 'paper', 'scissors')
+BEATS = {'rock': 'scissors', 'paper': 'rock', 'scissors': 'paper'}
+ROUND_TIME = 10      # 1ラウンドの制限時間（秒）
+WINS_NEEDED = 2
+MAX_ROUNDS = 5
+SWEEP_INTERVAL = 1   # 待機中のプレイヤーの相手を探し直す間隔（秒）
+
+# 記録する入力: 1〜3 は MOVES の手、0 はラウンド中の切断、LEFT_BETWEEN_ROUNDS はラウンドの判定後の切断
+LEFT_DURING_ROUND = 0
+LEFT_BETWEEN_ROUNDS = len(MOVES) + 1
+
+
+def judge(first, second):
+    """0: 引き分け、1: first の勝ち、2: second の勝ち（時間切れで手がない方は負け）"""
+    if first == second:
+        return 0
+    if second is None or (first is not None and BEATS[first] == second):
+        return 1
+    return 2
+
+
+class RPSPlayer:
+    __slots__ = ('connection', 'name', 'match', 'rating')
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.match = None
+        self.rating = None
+
+    async def send(self, message):
+        try:
+            await self.connection.send(json.dumps(message, ensure_ascii=False))
+        except ws.ConnectionClosed:
+            pass
+
+
+class RPSMatch:
+    """1試合分の進行"""
+
+    def __init__(self, match_id, players, on_finish, recorder=None, tournament=None):
+        self.match_id = match_id
+        self.players = players
+        self.on_finish = on_finish
+        self.recorder = recorder
+        self.tournament = tournament     # トーナメントの試合なら (Tournament, TournamentMatch)
+        self.record = None if recorder is None else MatchRecord(
+            GAME_RPS, [p.name for p in players], [WINS_NEEDED, MAX_ROUNDS])
+        self.wins = [0, 0]
+        self.round = 0
+        self.moves = [None, None]
+        self.round_open = False
+        self.forfeited = None
+        self._round_done = asyncio.Event()
+
+    def play(self, player, move):
+        if not self.round_open or move not in MOVES:
+            return
+        index = self.players.index(player)
+        if self.moves[index] is None:
+            self.moves[index] = move
+            if self.record is not None:
+                self.record.add(self.round, index, MOVES.index(move) + 1)
+            if None not in self.moves:
+                self._round_done.set()
+
+    def leave(self, player):
+        """途中で切断したプレイヤーは負け"""
+        self.forfeited = self.players.index(player)
+        if self.record is not None:
+            self.record.add(self.round, self.forfeited,
+                            LEFT_DURING_ROUND if self.round_open else LEFT_BETWEEN_ROUNDS)
+        self._round_done.set()
+
+    async def _broadcast(self, build):
+        await asyncio.gather(*(player.send(build(index)) for index, player in enumerate(self.players)))
+
+    async def run(self):
+        try:
+            await self._broadcast(lambda i: {
+                'type': 'match', 'match': self.match_id,
+                'opponent': self.players[1 - i].name, 'opponent_rating': round(self.players[1 - i].rating),
+                'wins_needed': WINS_NEEDED,
+                'tournament': self._tournament_info()})
+            while not self.over:
+                await self._play_round()
+        finally:
+            for player in self.players:
+                player.match = None
+        await self._finish()
+
+    def _tournament_info(self):
+        if self.tournament is None:
+            return None
+        tournament, match = self.tournament
+        return {'id': tournament.tournament_id, 'name': tournament.name, 'round': match.round,
+                'rounds': tournament.round_count}
+
+    @property
+    def over(self):
+        return self.forfeited is not None or max(self.wins) >= WINS_NEEDED or self.round >= MAX_ROUNDS
+
+    def _judge_round(self):
+        """集まった手で勝敗を決めて勝ち数を更新し、judge() の結果を返す"""
+        outcome = judge(*self.moves)
+        if outcome:
+            self.wins[outcome - 1] += 1
+        return outcome
+
+    def winner(self):
+        """勝者の番号（引き分けなら None）"""
+        if self.forfeited is not None:
+            return 1 - self.forfeited
+        if self.wins[0] == self.wins[1]:
+            return None
+        return 0 if self.wins[0] > self.wins[1] else 1
+
+    def results(self):
+        """記録する結果: [勝ち数, 勝ち数, 切断したプレイヤーの番号 + 1（なければ 0）]"""
+        return [self.wins[0], self.wins[1], 0 if self.forfeited is None else self.forfeited + 1]
+
+    async def _play_round(self):
+        self.round += 1
+        self.moves = [None, None]
+        self._round_done.clear()
+        self.round_open = True
+        await self._broadcast(lambda i: {'type': 'round', 'round': self.round, 'time_limit': ROUND_TIME})
+        try:
+            await asyncio.wait_for(self._round_done.wait(), ROUND_TIME)
+        except asyncio.TimeoutError:
+            pass
+        self.round_open = False
+        if self.forfeited is not None:
+            return
+
+        outcome = self._judge_round()
+        labels = {0: 'draw', 1: 'win', 2: 'lose'}
+        await self._broadcast(lambda i: {
+            'type': 'result', 'round': self.round,
+            'you': self.moves[i], 'opponent': self.moves[1 - i],
+            'outcome': labels[outcome if i == 0 else (3 - outcome) % 3],
+            'score': [self.wins[i], self.wins[1 - i]]})
+
+    async def _finish(self):
+        winner = self.winner()
+        replay_id = None
+        if self.record is not None:
+            self.recorder.submit(self.record.encode(self.results()))
+            replay_id = self.record.replay_id
+        ratings = self.on_finish(self, winner)
+
+        def message(i):
+            outcome = 'draw' if winner is None else ('win' if winner == i else 'lose')
+            return {'type': 'match_end', 'outcome': outcome, 'score': [self.wins[i], self.wins[1 - i]],
+                    'forfeit': self.forfeited is not None,
+                    'rating': ratings[i].to_dict() if ratings else None, 'replay': replay_id}
+        await self._broadcast(message)
+
+
+class RPSLobby:
+    """対戦待ちのプレイヤーをレーティングの近い順に2人ずつ組み合わせる
+
+    ゲストのレーティングは接続中だけ保持する。
+    on_result(勝者名, 敗者名, 引き分けか) は試合が終わるたびに呼ばれる。
+    """
+
+    def __init__(self, ratings=None, matchmaker=None, on_result=None, recorder=None, tournaments=None):
+        self.ratings = ratings if ratings is not None else RatingBook()
+        self.matchmaker = matchmaker if matchmaker is not None else Matchmaker()
+        self.on_result = on_result
+        self.recorder = recorder
+        self.tournaments = tournaments
+        self.checked_in = {}         # {プレイヤー名: RPSPlayer} トーナメントの試合を待っている接続
+        self.matches = {}
+        self.matches_played = 0
+        self._match_ids = itertools.count(1)
+        self._sweeper = None
+        self._loop = None
+        if tournaments is not None:
+            tournaments.on_ready = self._tournament_ready
+
+    async def handle(self, connection, name):
+        if self._sweeper is None:
+            self._loop = asyncio.get_running_loop()
+            self._sweeper = self._loop.create_task(self._sweep_forever())
+        player = RPSPlayer(connection, name)
+        await player.send({'type': 'hello', 'player': name, 'rating': self.ratings.get(name).to_dict()})
+        try:
+            async for raw in connection:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    continue
+                kind = message.get('type') if isinstance(message, dict) else None
+                if kind == 'queue':
+                    await self.enqueue(player)
+                elif kind == 'move' and player.match is not None:
+                    player.match.play(player, message.get('move'))
+                elif kind == 'leave_queue':
+                    self.matchmaker.cancel(player)
+                elif kind == 'tournament' and self.tournaments is not None:
+                    await self.check_in(player)
+        finally:
+            self.matchmaker.cancel(player)
+            if self.checked_in.get(name) is player:
+                del self.checked_in[name]
+            if player.match is not None:
+                player.match.leave(player)
+            elif is_guest(name):
+                self.ratings.forget(name)
+
+    async def enqueue(self, player):
+        if player.match is not None or player in self.matchmaker:
+            return
+        if self.checked_in.get(player.name) is player:
+            # 普通の対戦を始めるならトーナメントのチェックインは取り消す
+            del self.checked_in[player.name]
+        player.rating = self.ratings.get(player.name).rating
+        pair = self.matchmaker.enqueue(player, player.rating)
+        if pair is None:
+            await player.send({'type': 'waiting'})
+        else:
+            self._start_match(*(ticket.player for ticket in pair))
+
+    async def check_in(self, player):
+        """トーナメントの試合を待つ。相手もチェックインしていればすぐに始める"""
+        if player.match is not None:
+            return
+        self.matchmaker.cancel(player)
+        self.checked_in[player.name] = player
+        tournament, match = self.tournaments.match_for(player.name)
+        if match is None:
+            await player.send({'type': 'tournament_idle'})
+        elif not self._start_tournament_match(tournament, match):
+            await player.send(self._tournament_wait(player.name, tournament, match))
+
+    def _tournament_wait(self, name, tournament, match):
+        return {'type': 'tournament_wait', 'tournament': tournament.tournament_id, 'name': tournament.name,
+                'round': match.round, 'opponent': match.players[1 - match.players.index(name)],
+                'no_show_timeout': self.tournaments.no_show_timeout}
+
+    def _start_tournament_match(self, tournament, match):
+        """両プレイヤーがチェックインしていて手が空いていれば試合を始める"""
+        if match.state != 'ready':
+            return False
+        players = [self.checked_in.get(name) for name in match.players]
+        if None in players or any(p.match is not None or p.connection.closed for p in players):
+            return False
+        for player in players:
+            player.rating = self.ratings.get(player.name).rating
+        self.tournaments.begin(tournament, match)
+        self._start_match(*players, tournament=(tournament, match))
+        return True
+
+    def _tournament_ready(self, tournament, matches):
+        """新しく組まれた試合を受け取る（Flask のスレッドから呼ばれることもある）"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._start_ready, tournament, matches)
+
+    def _start_ready(self, tournament, matches):
+        for match in matches:
+            if self._start_tournament_match(tournament, match):
+                continue
+            for name in match.players:
+                player = self.checked_in.get(name)
+                if player is not None and player.match is None:
+                    self._loop.create_task(player.send(self._tournament_wait(name, tournament, match)))
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            for pair in self.matchmaker.sweep():
+                self._start_match(*(ticket.player for ticket in pair))
+            if self.tournaments is not None:
+                try:
+                    self.tournaments.expire(lambda name: name in self.checked_in)
+                except Exception:
+                    logger.exception("トーナメントの不戦勝の処理に失敗しました")
+
+    def _start_match(self, first, second, tournament=None):
+        match = RPSMatch(next(self._match_ids), [first, second], self._finished, self.recorder, tournament)
+        first.match = second.match = match
+        self.matches[match.match_id] = match
+        asyncio.get_running_loop().create_task(match.run())
+
+    def _finished(self, match, winner):
+        """レーティングを更新し、両プレイヤーの新しいレーティングを返す"""
+        self.matches.pop(match.match_id, None)
+        self.matches_played += 1
+        first, second = match.players
+        if first.name == second.name:
+            # 同じユーザーの別接続同士の試合はレーティングに数えない
+            return None
+        outcome = 0.5 if winner is None else (1.0 if winner == 0 else 0.0)
+        ratings = self.ratings.record(first.name, second.name, outcome)
+        for player in match.players:
+            if player.connection.closed and is_guest(player.name):
+                self.ratings.forget(player.name)
+
+        if match.tournament is not None:
+            self._report_tournament(match, winner)
+
+        if self.on_result is not None:
+            names = [first.name, second.name]
+            try:
+                if winner is None:
+                    self.on_result(names[0], names[1], True)
+                else:
+                    self.on_result(names[winner], names[1 - winner], False)
+            except Exception:
+                logger.exception("対戦結果の記録に失敗しました")
+        return ratings
+
+    def _report_tournament(self, match, winner):
+        tournament, tournament_match = match.tournament
+        try:
+            self.tournaments.report(tournament, tournament_match, winner)
+        except Exception:
+            logger.exception("トーナメントの結果の反映に失敗しました")
+            return
+        for player in match.players:
+            if self.checked_in.get(player.name) is player and tournament.match_for(player.name) is None:
+                self._loop.create_task(player.send({
+                    'type': 'tournament_idle', 'tournament': tournament.tournament_id,
+                    'status': tournament.status, 'champion': tournament.champion}))
+
+    def metrics(self):
+        return dict(self.matchmaker.metrics(),
+                    active_matches=len(self.matches),
+                    matches_played=self.matches_played,
+                    tournament_checked_in=len(self.checked_in),
+                    rated_players=len(self.ratings))
+
+
+def replay(record):
+    """記録した手を RPSMatch の判定にラウンド順に流し直し、{'results': RPSMatch.results(), ...} を返す"""
+    if record.params != [WINS_NEEDED, MAX_ROUNDS]:
+        raise ReplayError(f'rps parameters changed since recording: {record.params}')
+    match = RPSMatch(0, list(record.players), None)
+    inputs = record.inputs
+    position = 0
+
+    def take(round_number, values):
+        nonlocal position
+        while (position < len(inputs) and inputs[position][0] == round_number
+               and inputs[position][2] in values):
+            yield inputs[position]
+            position += 1
+
+    move_values = range(1, len(MOVES) + 1)
+    while True:
+        for _, index, _ in take(match.round, (LEFT_BETWEEN_ROUNDS, )):
+            match.forfeited = index
+        if match.over:
+            break
+        match.round += 1
+        match.moves = [None, None]
+        for _, index, value in take(match.round, (LEFT_DURING_ROUND, *move_values)):
+            if value == LEFT_DURING_ROUND:
+                match.forfeited = index
+            else:
+                match.moves[index] = MOVES[value - 1]
+        if match.forfeited is None:
+            match._judge_round()
+    return {'results': match.results(), 'winner': match.winner(), 'rounds': match.round}
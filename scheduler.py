@@ -0,0 +1,152 @@
+"""バックグラウンドの定期ジョブを1本のスレッドで実行するスケジューラー
+
+ジョブは次回実行時刻をキーにした最小ヒープで管理する。
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """定期ジョブとその実行メトリクス"""
+
+    def __init__(self, name, func, interval, jitter):
+        self.name = name
+        self.func = func
+        self.interval = interval  # 秒数、または秒数を返す関数（設定を毎回読み直す）
+        self.jitter = jitter      # 0.1 なら間隔を ±10% ずらす
+        self.cancelled = False
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.last_error = None
+        self.next_run = None
+
+    def next_delay(self):
+        interval = self.interval() if callable(self.interval) else self.interval
+        interval = max(float(interval), 0.0)
+        if self.jitter:
+            interval *= 1 + random.uniform(-self.jitter, self.jitter)
+        return interval
+
+    def metrics(self):
+        return {
+            'name': self.name,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'avg_duration': self.total_duration / self.runs if self.runs else None,
+            'last_error': self.last_error,
+            'next_run_in': max(self.next_run - time.monotonic(), 0.0) if self.next_run else None,
+        }
+
+
+class Scheduler:
+    """最小ヒープで次に実行すべきジョブを選ぶスケジューラー"""
+
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self._heap = []  # [(次回実行時刻, 登録順, Job)]
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def register(self, name, func, interval, jitter=0.0, run_immediately=False):
+        """ジョブを登録する。同名のジョブは置き換える"""
+        job = Job(name, func, interval, jitter)
+        with self._condition:
+            previous = self._jobs.get(name)
+            if previous:
+                previous.cancelled = True
+            self._jobs[name] = job
+            self._schedule(job, 0.0 if run_immediately else job.next_delay())
+            self._condition.notify()
+        return job
+
+    def unregister(self, name):
+        with self._condition:
+            job = self._jobs.pop(name, None)
+            if job:
+                job.cancelled = True
+            return job is not None
+
+    def _schedule(self, job, delay):
+        job.next_run = time.monotonic() + delay
+        heapq.heappush(self._heap, (job.next_run, next(self._sequence), job))
+
+    def start(self):
+        with self._condition:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """実行中のジョブの完了を待ってスレッドを停止する"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._condition:
+            jobs = list(self._jobs.values())
+        return [job.metrics() for job in jobs]
+
+    def _next_due_job(self):
+        """実行時刻になったジョブを取り出す。停止要求があれば None"""
+        with self._condition:
+            while not self._stopping:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                next_run, _, job = self._heap[0]
+                if job.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = next_run - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                return job
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next_due_job()
+            if job is None:
+                return
+            started = time.monotonic()
+            try:
+                job.func()
+                job.last_error = None
+            except Exception as e:
+                job.failures += 1
+                job.last_error = repr(e)
+                logger.exception("ジョブ %s の実行に失敗しました", job.name)
+            job.last_duration = time.monotonic() - started
+            job.total_duration += job.last_duration
+            job.runs += 1
+            job.last_run = time.time()
+
+            with self._condition:
+                if not job.cancelled:
+                    try:
+                        delay = job.next_delay()
+                    except Exception:
+                        logger.exception("ジョブ %s の間隔を取得できません", job.name)
+                        delay = 60.0
+                    self._schedule(job, delay)
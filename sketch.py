@@ -0,0 +1,138 @@
+"""ストリーミング分位点スケッチ（KLL）
+
+全件を保存せずに「この値は全体の何%より上か」を近似的に答える。
+メモリは k にほぼ比例するだけで件数に依存せず、別プロセスのスケッチとマージできる。
+"""
+import bisect
+import math
+import random
+import threading
+
+
+class KLLSketch:
+    """KLLスケッチ（Karnin, Lang, Liberty）
+
+    高さ h のコンパクターに入っている値はそれぞれ 2**h 件分の重みを持つ。
+    コンパクターがあふれたら並べ替えて1つおきに上の段へ送る。
+    """
+
+    def __init__(self, k=200, c=2 / 3):
+        self.k = k
+        self.c = c
+        self.count = 0          # これまでに追加された件数
+        self._compactors = []
+        self._size = 0          # 保持している値の数
+        self._max_size = 0
+        self._lock = threading.Lock()
+        self._cdf = None        # (並べた値, 累積重み) のキャッシュ
+        self._cdf_count = 0
+        self._grow()
+
+    def _grow(self):
+        self._compactors.append([])
+        self._max_size = sum(self._capacity(h) for h in range(len(self._compactors)))
+
+    def _capacity(self, height):
+        depth = len(self._compactors) - height - 1
+        return int(math.ceil(self.c ** depth * self.k)) + 1
+
+    def _compress(self):
+        for height in range(len(self._compactors)):
+            compactor = self._compactors[height]
+            if len(compactor) < self._capacity(height):
+                continue
+            if height + 1 >= len(self._compactors):
+                self._grow()
+            compactor.sort()
+            # 奇数個なら最後の1つは残す
+            keep = compactor.pop() if len(compactor) % 2 else None
+            offset = random.randrange(2)
+            self._compactors[height + 1].extend(compactor[offset::2])
+            compactor.clear()
+            if keep is not None:
+                compactor.append(keep)
+            self._size = sum(len(c) for c in self._compactors)
+            if self._size < self._max_size:
+                break
+
+    def update(self, value):
+        with self._lock:
+            self._compactors[0].append(value)
+            self._size += 1
+            self.count += 1
+            if self._size >= self._max_size:
+                self._compress()
+
+    def merge(self, other):
+        """別のスケッチの内容を取り込む"""
+        with self._lock:
+            while len(self._compactors) < len(other._compactors):
+                self._grow()
+            for height, compactor in enumerate(other._compactors):
+                self._compactors[height].extend(compactor)
+            self.count += other.count
+            self._size = sum(len(c) for c in self._compactors)
+            while self._size >= self._max_size:
+                self._compress()
+            self._cdf = None
+
+    def to_dict(self):
+        """他のワーカーに送るための辞書表現"""
+        with self._lock:
+            return {'k': self.k, 'c': self.c, 'count': self.count,
+                    'compactors': [list(c) for c in self._compactors]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data['k'], c=data['c'])
+        sketch._compactors = [list(c) for c in data['compactors']] or [[]]
+        sketch._max_size = sum(sketch._capacity(h) for h in range(len(sketch._compactors)))
+        sketch._size = sum(len(c) for c in sketch._compactors)
+        sketch.count = data['count']
+        return sketch
+
+    def _weighted_cdf(self):
+        """累積分布を返す。前回から 0.5% 以上増えていなければキャッシュを使う"""
+        cdf = self._cdf
+        if cdf is not None and self.count - self._cdf_count <= max(16, self._cdf_count // 200):
+            return cdf
+        with self._lock:
+            weighted = sorted((value, 1 << height)
+                              for height, compactor in enumerate(self._compactors)
+                              for value in compactor)
+            values = []
+            cumulative = []
+            total = 0
+            for value, weight in weighted:
+                total += weight
+                values.append(value)
+                cumulative.append(total)
+            self._cdf = cdf = (values, cumulative)
+            self._cdf_count = self.count
+        return cdf
+
+    def fraction_below(self, value):
+        """value より小さい値の割合（0.0〜1.0）"""
+        values, cumulative = self._weighted_cdf()
+        if not values:
+            return 0.0
+        index = bisect.bisect_left(values, value)
+        return cumulative[index - 1] / cumulative[-1] if index else 0.0
+
+    def fraction_above(self, value):
+        """value より大きい値の割合（0.0〜1.0）"""
+        values, cumulative = self._weighted_cdf()
+        if not values:
+            return 0.0
+        index = bisect.bisect_right(values, value)
+        below_or_equal = cumulative[index - 1] if index else 0
+        return 1.0 - below_or_equal / cumulative[-1]
+
+    def quantile(self, q):
+        """q（0.0〜1.0）分位点の近似値"""
+        values, cumulative = self._weighted_cdf()
+        if not values:
+            return None
+        target = q * cumulative[-1]
+        index = bisect.bisect_left(cumulative, target)
+        return values[min(index, len(values) - 1)]
@@ -0,0 +1,57 @@
+"""観戦配信
+
+部屋の更新は部屋の側で1回だけシリアライズし、同じフレーム（ws.prepare 済みのバイト列）を
+全観戦者の接続にそのまま書く。観戦者ごとのエンコードはしない。
+観戦者には delay ティック遅らせて届ける（対戦中のプレイヤーに観戦画面から情報が漏れないように）。
+"""
+from collections import deque
+
+
+class SpectatorFeed:
+    """1部屋分の観戦配信（イベントループのスレッドからだけ使う）"""
+
+    __slots__ = ('delay_ticks', 'spectators', 'pending', 'intro', 'frames_sent', 'bytes_sent')
+
+    def __init__(self, delay_ticks):
+        self.delay_ticks = delay_ticks
+        self.spectators = set()
+        self.pending = deque()     # (配信するティック, フレーム, 種類, 途中参加者にも送るか)
+        self.intro = None          # 配信済みの最新の部屋の情報（途中から見始めた人に最初に送る）
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def __len__(self):
+        return len(self.spectators)
+
+    @property
+    def done(self):
+        """配信待ちのフレームが残っていない"""
+        return not self.pending
+
+    def add(self, connection):
+        self.spectators.add(connection)
+        if self.intro is not None:
+            connection.send_prepared(self.intro)
+
+    def discard(self, connection):
+        self.spectators.discard(connection)
+
+    def push(self, tick, frame, kind='control', intro=False):
+        """tick に作ったフレームを配信待ちに積む。intro なら途中参加者にも最初に送る"""
+        self.pending.append((tick + self.delay_ticks, frame, kind, intro))
+
+    def release(self, tick):
+        """遅延が過ぎたフレームを全観戦者に送る"""
+        pending = self.pending
+        while pending and pending[0][0] <= tick:
+            _, frame, kind, intro = pending.popleft()
+            if intro:
+                self.intro = frame
+            closed = []
+            for connection in self.spectators:
+                if not connection.send_prepared(frame, kind):
+                    closed.append(connection)
+            for connection in closed:
+                self.spectators.discard(connection)
+            self.frames_sent += 1
+            self.bytes_sent += len(frame) * len(self.spectators)
@@ -0,0 +1,133 @@
+"""ゲートウェイで受ける通常の HTTP リクエストと Server-Sent Events
+
+WebSocket へのアップグレードでないリクエストは HTTPRequest としてハンドラーに渡す。
+1リクエスト1接続（Connection: close）で、レスポンスは respond() で返すか、
+start_events() でイベントストリームに切り替えて prepare_event() で作ったフレームを流す。
+ページ（Flask）とはポートが違うので、同じホスト名からのリクエストにだけ CORS を許可する。
+"""
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+import ws
+
+MAX_BODY_SIZE = 4 * 1024
+
+STATUS_TEXT = {
+    200: 'OK', 202: 'Accepted', 204: 'No Content', 400: 'Bad Request', 403: 'Forbidden',
+    404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 429: 'Too Many Requests',
+}
+
+
+def prepare_event(data, event=None, event_id=None):
+    """同じイベントを大勢に送るとき用に、SSE の1件分のバイト列を一度だけ作る"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    lines.extend(f"data: {line}" for line in data.split('\n'))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class HTTPRequest:
+    """1件の HTTP リクエスト"""
+
+    def __init__(self, reader, writer, method, path, headers):
+        self.reader = reader
+        self.writer = writer
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.closed = False
+        self.outbox = None   # 送信キュー（fanout.SendQueue）。イベントストリームの送信はここを通す
+
+    @property
+    def query(self):
+        return ws.query_params(self.path)
+
+    def cookie(self, name):
+        return ws.parse_cookie(self.headers, name)
+
+    @property
+    def same_site(self):
+        """Origin がないか、ゲートウェイと同じホスト名（ポート違い）のページからのリクエストか"""
+        origin = self.headers.get('origin')
+        if not origin:
+            return True
+        host = self.headers.get('host', '').rsplit(':', 1)[0]
+        return urlsplit(origin).hostname == host
+
+    def _cors_headers(self):
+        origin = self.headers.get('origin')
+        if not origin or not self.same_site:
+            return ''
+        return f"Access-Control-Allow-Origin: {origin}\r\nAccess-Control-Allow-Credentials: true\r\nVary: Origin\r\n"
+
+    async def read_body(self, limit=MAX_BODY_SIZE):
+        """本文を読む（Content-Length がなければ空）。limit バイトを超えたら None"""
+        try:
+            length = int(self.headers.get('content-length', '0'))
+        except ValueError:
+            length = 0
+        if length > limit:
+            return None
+        if length <= 0:
+            return b''
+        return await self.reader.readexactly(length)
+
+    async def respond(self, status, body=None, headers=None):
+        """レスポンスを返す。body が dict / list なら JSON にする"""
+        content_type = 'text/plain; charset=utf-8'
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False)
+            content_type = 'application/json'
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        body = body or b''
+        extra = ''.join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        self.writer.write((
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n"
+            f"{self._cors_headers()}{extra}\r\n").encode('latin-1') + body)
+        await self.writer.drain()
+        self.closed = True
+
+    async def start_events(self, retry=3000):
+        """イベントストリーム（text/event-stream）のレスポンスを始める"""
+        self.writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream; charset=utf-8\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n"
+            f"{self._cors_headers()}\r\n"
+            f"retry: {retry}\n\n").encode('utf-8'))
+        await self.writer.drain()
+
+    def send_prepared(self, frame, kind='control'):
+        """prepare_event() で作ったフレームを送る（送信完了は待たない）。送れなければ False"""
+        if self.closed:
+            return False
+        outbox = self.outbox
+        if outbox is not None:
+            if outbox.transport.is_closing() or not outbox.put(frame, kind):
+                self.closed = True
+                return False
+            return True
+        if self.writer.is_closing():
+            return False
+        self.writer.write(frame)
+        return True
+
+    async def wait_closed(self):
+        """クライアントが接続を切るまで待つ（イベントストリームではクライアントからは何も来ない）"""
+        try:
+            while await self.reader.read(1024):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        self.closed = True
@@ -0,0 +1,289 @@
+"""リクエストスレッドとバックグラウンドスレッドで共有する状態
+
+モジュールレベルのグローバル変数を直接書き換えると更新が失われるため、
+ここにあるオブジェクト経由でアトミックに操作する。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+
+class AtomicCounter:
+    """ロックで保護された整数カウンター"""
+
+    def __init__(self, value=0):
+        self._value = value
+        self._lock = threading.Lock()
+
+    def increment(self, amount=1):
+        """加算して加算前の値を返す"""
+        with self._lock:
+            previous = self._value
+            self._value += amount
+            return previous
+
+    def reset(self, value=0):
+        with self._lock:
+            self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+
+class StripedDict:
+    """キーのハッシュでロックを分割（ストライプ化）した辞書
+
+    書き込みは該当ストライプのロックだけを取るので、
+    別々のキーを更新するリクエスト同士は待たされない。
+    """
+
+    def __init__(self, stripes=16):
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def __setitem__(self, key, value):
+        data, lock = self._stripe(key)
+        with lock:
+            data[key] = value
+
+    def __getitem__(self, key):
+        data, _ = self._stripe(key)
+        return data[key]
+
+    def __contains__(self, key):
+        data, _ = self._stripe(key)
+        return key in data
+
+    def __len__(self):
+        return sum(len(data) for data, _ in self._stripes)
+
+    def get(self, key, default=None):
+        data, _ = self._stripe(key)
+        return data.get(key, default)
+
+    def pop(self, key, default=None):
+        data, lock = self._stripe(key)
+        with lock:
+            return data.pop(key, default)
+
+    def update_value(self, key, func, default=None):
+        """func(現在の値) の結果をアトミックに書き戻して返す"""
+        data, lock = self._stripe(key)
+        with lock:
+            value = func(data.get(key, default))
+            data[key] = value
+            return value
+
+    def items(self):
+        """ストライプごとにコピーしたスナップショットを返す"""
+        result = []
+        for data, lock in self._stripes:
+            with lock:
+                result.extend(data.items())
+        return result
+
+    def prune(self, predicate):
+        """predicate(key, value) が真になる要素を削除し、削除件数を返す"""
+        removed = 0
+        for data, lock in self._stripes:
+            with lock:
+                stale = [key for key, value in data.items() if predicate(key, value)]
+                for key in stale:
+                    del data[key]
+                removed += len(stale)
+        return removed
+
+    def clear(self):
+        for data, lock in self._stripes:
+            with lock:
+                data.clear()
+
+
+class RateMeter:
+    """直近 window 秒間のイベント発生レート（1秒あたり）を数える
+
+    1秒ごとのバケットをリングバッファで持つので、メモリは window に比例するだけで済む。
+    """
+
+    def __init__(self, window=10):
+        self._window = window
+        self._counts = [0] * window
+        self._seconds = [0] * window
+        self._lock = threading.Lock()
+
+    def mark(self, now=None):
+        second = int(now if now is not None else time.time())
+        index = second % self._window
+        with self._lock:
+            if self._seconds[index] != second:
+                self._seconds[index] = second
+                self._counts[index] = 0
+            self._counts[index] += 1
+
+    def rate(self, now=None):
+        second = int(now if now is not None else time.time())
+        oldest = second - self._window
+        with self._lock:
+            total = sum(count for count, at in zip(self._counts, self._seconds) if at > oldest)
+        return total / self._window
+
+
+class UserStore:
+    """ユーザーデータベース
+
+    登録時の重複チェックとユーザー名変更は複数キーにまたがるため、
+    1つのロックでまとめて保護する。
+    """
+
+    def __init__(self, initial=None):
+        self._users = dict(initial or {})
+        self._lock = threading.Lock()
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, username, default=None):
+        return self._users.get(username, default)
+
+    def items(self):
+        with self._lock:
+            return list(self._users.items())
+
+    def values(self):
+        with self._lock:
+            return list(self._users.values())
+
+    def register(self, username, record):
+        """ユーザー名・ユーザーID・メールアドレスが未使用なら追加して True を返す"""
+        with self._lock:
+            if username in self._users:
+                return False
+            for existing in self._users.values():
+                if existing['user_id'] == record.get('user_id'):
+                    return False
+                if 'email' in record and existing.get('email') == record['email']:
+                    return False
+            self._users[username] = record
+            return True
+
+    def rename(self, old_username, new_username):
+        """ユーザー名を変更する。変更先が使用中なら False を返す"""
+        with self._lock:
+            if new_username in self._users or old_username not in self._users:
+                return False
+            self._users[new_username] = self._users.pop(old_username)
+            return True
+
+
+class SettingsStore:
+    """バージョン付きの不変スナップショットで保持するサーバー設定
+
+    読み取りはロックを取らずに現在のスナップショットを参照するだけで、
+    更新は新しいスナップショットを作って1回の代入で差し替える。
+    path を指定するとJSONファイルに保存し、ファイルが外部から書き換えられたら
+    reload_if_changed() で読み直す。ファイルの中身がオブジェクトでなければ今のスナップショットのまま、
+    既定値と型の合わない値はその項目だけ既定値を使う。
+    """
+
+    def __init__(self, initial, path=None):
+        self._defaults = dict(initial)
+        self._path = path
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._current = (1, MappingProxyType(dict(initial)))  # (バージョン, 設定)
+        if path and os.path.exists(path):
+            self.reload_if_changed()
+
+    def get(self, key, default=None):
+        return self._current[1].get(key, default)
+
+    def __getitem__(self, key):
+        return self._current[1][key]
+
+    @property
+    def version(self):
+        """更新のたびに増える番号（キャッシュの無効化に使う）"""
+        return self._current[0]
+
+    def snapshot(self):
+        """現在の設定を読み取り専用のマッピングで返す"""
+        return self._current[1]
+
+    def update(self, changes):
+        with self._lock:
+            version, current = self._current
+            updated = dict(current)
+            updated.update(changes)
+            self._swap(version + 1, updated)
+            self._save(updated)
+            return self._current[1]
+
+    def reload_if_changed(self):
+        """設定ファイルの更新時刻が変わっていれば読み直す。読み直したら True"""
+        if not self._path:
+            return False
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            try:
+                with open(self._path, encoding='utf-8') as f:
+                    loaded = json.load(f)
+            except (OSError, ValueError):
+                logger.exception("設定ファイル %s を読み込めません", self._path)
+                self._mtime = mtime  # 壊れたファイルを毎回読み直さない
+                return False
+            self._mtime = mtime
+            if not isinstance(loaded, dict):
+                logger.error("設定ファイル %s がJSONオブジェクトではありません", self._path)
+                return False
+            updated = dict(self._defaults)
+            for key, value in loaded.items():
+                if key not in self._defaults:
+                    continue
+                if _same_kind(self._defaults[key], value):
+                    updated[key] = value
+                else:
+                    logger.warning("設定ファイル %s の %s は型が違うので既定値を使います: %r", self._path, key, value)
+            if updated == dict(self._current[1]):
+                return False
+            self._swap(self._current[0] + 1, updated)
+            return True
+
+    def _swap(self, version, settings):
+        self._current = (version, MappingProxyType(settings))
+
+    def _save(self, settings):
+        if not self._path:
+            return
+        tmp_path = self._path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self._path)
+            self._mtime = os.stat(self._path).st_mtime_ns
+        except OSError:
+            logger.exception("設定ファイル %s に保存できません", self._path)
+
+
+def _same_kind(default, value):
+    """設定ファイルの値が既定値と同じ種類か（数値は int と float を区別しないが、bool は数値と区別する）"""
+    if isinstance(default, bool) or isinstance(value, bool):
+        return isinstance(default, bool) and isinstance(value, bool)
+    if isinstance(default, (int, float)):
+        return isinstance(value, (int, float))
+    return isinstance(value, type(default))
@@ -0,0 +1,561 @@
+"""トーナメント（シングルエリミネーションとスイス式）
+
+参加登録を締め切るとレーティングの高い順にシードを決め、対戦できるようになった試合を
+ready に積む。試合はオンライン対戦じゃんけんのゲートウェイ（rps.RPSLobby）が、両プレイヤーが
+チェックインしたところで始め、結果を report() で戻す。
+
+シングルエリミネーションは山を配列のヒープ（ノード i の子が 2i と 2i+1、葉がシード順の参加者）で持ち、
+結果1件で書き換えるのは勝者を上のノードに入れるところだけ（O(1)）。
+スイス式は結果1件で得点を足すだけで、ラウンドの全試合が終わったときに次のラウンドを組む。
+読む側には、変わった試合とラウンドだけ作り直してシリアライズ済みの JSON を返す。作り直しは、ロックの中で材料を写して
+（snapshot）ロックの外でシリアライズする（build_view）ので、その間も結果の反映は止まらない。
+"""
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+FORMATS = ('single_elimination', 'swiss')
+NO_SHOW_TIMEOUT = 120      # 試合が組まれてから相手がチェックインしないときに不戦勝にするまで（秒）
+MIN_PLAYERS = 2
+MAX_PLAYERS = 4096
+
+
+class TournamentError(ValueError):
+    pass
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def bracket_order(size):
+    """size 人の山で、左から順に何番シードを置くか（1番と2番シードが決勝まで当たらない並び）"""
+    order = [1]
+    while len(order) < size:
+        total = len(order) * 2 + 1
+        order = [seed for top in order for seed in (top, total - top)]
+    return order
+
+
+class TournamentMatch:
+    __slots__ = ('match_id', 'round', 'players', 'state', 'winner', 'ready_at', 'games', 'view')
+
+    def __init__(self, match_id, round_number, players=None):
+        self.match_id = match_id
+        self.round = round_number
+        self.players = players or [None, None]
+        self.state = 'pending'       # pending / ready / playing / done
+        self.winner = None           # 勝者の番号（0 / 1）。スイス式の引き分けは None のまま done
+        self.ready_at = None
+        self.games = 0               # 引き分けでやり直した分も含めた試合数
+        self.view = None             # シリアライズ済みの to_dict()（変わったら None）
+
+    def to_dict(self):
+        return {'id': self.match_id, 'players': list(self.players), 'state': self.state, 'winner': self.winner}
+
+
+class Tournament:
+    """参加登録から優勝者が決まるまで。サブクラスが組み合わせ方を決める
+
+    status は registration / running / finished。
+    """
+
+    format = None
+
+    def __init__(self, tournament_id, name, max_players=MAX_PLAYERS):
+        self.tournament_id = tournament_id
+        self.name = name
+        self.max_players = max_players
+        self.status = 'registration'
+        self.entrants = []          # 登録順（開始時にシード順に並べ直す）
+        self._registered = set()
+        self.seeds = {}             # {プレイヤー: シード番号（1から）}
+        self.matches = {}           # {試合番号: TournamentMatch}
+        self.current = {}           # {プレイヤー: 対戦待ち・対戦中の TournamentMatch}
+        self.ready = deque()        # (ready_at, TournamentMatch)。ready_at の古い順
+        self.round = 0
+        self.champion = None
+        self.results_reported = 0
+        self.created_at = time.time()
+        self._round_views = {}      # {ラウンド: シリアライズ済みの試合一覧}
+        self._view = None
+        self.version = 0            # 読む側に見える状態が変わるたびに増える
+
+    def __contains__(self, player):
+        return player in self._registered
+
+    def join(self, player):
+        if self.status != 'registration':
+            raise TournamentError('参加登録は締め切られています。')
+        if player in self._registered:
+            return False
+        if len(self.entrants) >= self.max_players:
+            raise TournamentError('定員に達しています。')
+        self._registered.add(player)
+        self.entrants.append(player)
+        self._invalidate()
+        return True
+
+    def leave(self, player):
+        if self.status != 'registration' or player not in self._registered:
+            return False
+        self._registered.discard(player)
+        self.entrants.remove(player)
+        self._invalidate()
+        return True
+
+    def start(self, rating_of, now=None):
+        """レーティングの高い順にシードを決めて最初のラウンドを組み、組めた試合を返す"""
+        if self.status != 'registration':
+            raise TournamentError('トーナメントはすでに始まっています。')
+        if len(self.entrants) < MIN_PLAYERS:
+            raise TournamentError(f'参加者が{MIN_PLAYERS}人以上必要です。')
+        order = {player: index for index, player in enumerate(self.entrants)}
+        # 同じレーティングなら先に登録した方が上
+        self.entrants.sort(key=lambda player: (-rating_of(player), order[player]))
+        self.seeds = {player: seed for seed, player in enumerate(self.entrants, 1)}
+        self.status = 'running'
+        self._invalidate()
+        return self._setup(time.time() if now is None else now)
+
+    def match_for(self, player):
+        """プレイヤーの対戦待ち・対戦中の試合（なければ None）"""
+        return self.current.get(player)
+
+    def begin(self, match):
+        """試合を始めたときに呼ぶ"""
+        match.state = 'playing'
+        match.games += 1
+        self._changed(match)
+
+    def report(self, match, winner, now=None):
+        """試合の結果を反映し、新しく対戦できるようになった試合を返す。winner は勝者の番号、引き分けなら None"""
+        if match.state not in ('ready', 'playing'):
+            return []
+        self.results_reported += 1
+        now = time.time() if now is None else now
+        return self._report(match, winner, now)
+
+    def overdue(self, now, timeout=NO_SHOW_TIMEOUT):
+        """組まれてから timeout 秒たっても始まっていない試合"""
+        ready = self.ready
+        limit = now - timeout
+        overdue = []
+        while ready and ready[0][0] <= limit:
+            ready_at, match = ready.popleft()
+            if match.state == 'ready' and match.ready_at == ready_at:
+                overdue.append(match)
+        return overdue
+
+    def _set_ready(self, match, now):
+        match.state = 'ready'
+        match.ready_at = now
+        self.ready.append((now, match))
+        for player in match.players:
+            self.current[player] = match
+        self._changed(match)
+
+    def _set_done(self, match, winner):
+        match.state = 'done'
+        match.winner = winner
+        for player in match.players:
+            if self.current.get(player) is match:
+                del self.current[player]
+        self._changed(match)
+
+    def _changed(self, match):
+        match.view = None
+        self._round_views.pop(match.round, None)
+        self._invalidate()
+
+    def _invalidate(self):
+        self.version += 1
+        self._view = None
+
+    def snapshot(self):
+        """view を作る材料の写し（ディレクターのロックの中で呼ぶ）
+
+        作り直すラウンドは (試合, シリアライズ済みの JSON か、変わった試合なら to_dict()) の一覧にしておく。
+        """
+        rounds = []
+        for r in range(1, self.round_count + 1):
+            part = self._round_views.get(r)
+            if part is None:
+                matches = self._round_matches(r)
+                if not matches:
+                    continue
+                part = [(match, match.view or match.to_dict()) for match in matches]
+            rounds.append((r, part))
+        return self.version, self.summary(), self._extra_snapshot(), rounds
+
+    def build_view(self, snapshot):
+        """snapshot から JSON を作る（ロックの外で呼べる）。(JSON, store_view に渡すキャッシュ) を返す"""
+        version, summary, extra, rounds = snapshot
+        parts = []
+        built = {}                   # {ラウンド: 作り直した JSON}
+        dumped = []                  # [(試合, 作り直した JSON)]
+        for r, part in rounds:
+            if not isinstance(part, bytes):
+                items = []
+                for match, item in part:
+                    if not isinstance(item, bytes):
+                        item = _dumps(item)
+                        dumped.append((match, item))
+                    items.append(item)
+                part = built[r] = b'[' + b','.join(items) + b']'
+            parts.append(part)
+        extra_view, computed = self._extra_view(extra)
+        head = _dumps(dict(summary, **extra_view))
+        view = head[:-1] + b',"matches":[' + b','.join(parts) + b']}'
+        return view, (built, dumped, computed)
+
+    def store_view(self, snapshot, view, cache):
+        """build_view の結果をキャッシュに入れる（ロックの中で呼ぶ）。作っている間に状態が変わっていたら捨てる"""
+        if snapshot[0] != self.version:
+            return
+        built, dumped, computed = cache
+        self._round_views.update(built)
+        for match, item in dumped:
+            match.view = item
+        self._store_extra(computed)
+        self._view = view
+
+    def view(self):
+        """読む側に返す JSON（シリアライズ済み）。変わった試合とラウンドだけ作り直す"""
+        view = self._view
+        if view is None:
+            snapshot = self.snapshot()
+            view, cache = self.build_view(snapshot)
+            self.store_view(snapshot, view, cache)
+        return view
+
+    def summary(self):
+        return {
+            'id': self.tournament_id,
+            'name': self.name,
+            'format': self.format,
+            'status': self.status,
+            'players': len(self.entrants),
+            'round': self.round,
+            'rounds': self.round_count,
+            'champion': self.champion,
+        }
+
+    def _extra_snapshot(self):
+        return None
+
+    def _extra_view(self, extra):
+        return {}, None
+
+    def _store_extra(self, computed):
+        pass
+
+
+class SingleElimination(Tournament):
+    """負けたら終わりのトーナメント。参加者が2の累乗に足りない分は上位シードが不戦勝（bye）"""
+
+    format = 'single_elimination'
+
+    def __init__(self, tournament_id, name, max_players=MAX_PLAYERS):
+        super().__init__(tournament_id, name, max_players)
+        self.size = 0
+        self.round_count = 0
+
+    def _setup(self, now):
+        count = len(self.entrants)
+        size = self.size = 1 << (count - 1).bit_length()
+        self.round_count = size.bit_length() - 1
+        # ノード i（1 〜 size-1）の試合は、子ノード 2i と 2i+1 の勝者同士。ノード 1 が決勝
+        for node in range(1, size):
+            self.matches[node] = TournamentMatch(node, self.round_count - (node.bit_length() - 1))
+        leaves = [self.entrants[seed - 1] if seed <= count else None for seed in bracket_order(size)]
+        self.round = 1
+        ready = []
+        for node in range(size // 2, size):
+            match = self.matches[node]
+            first, second = leaves[(node - size // 2) * 2], leaves[(node - size // 2) * 2 + 1]
+            match.players = [first, second]
+            if second is None:
+                # 不戦勝（上位シード側に bye が来るので、空くのは常に2人目）
+                self._set_done(match, 0)
+                ready.extend(self._advance(match, now))
+            else:
+                self._set_ready(match, now)
+                ready.append(match)
+        return ready
+
+    def _advance(self, match, now):
+        """勝者を上のノードに入れ、両方そろったら対戦待ちにする"""
+        node = match.match_id
+        winner = match.players[match.winner]
+        if node == 1:
+            self.champion = winner
+            self.status = 'finished'
+            self._invalidate()
+            return []
+        parent = self.matches[node >> 1]
+        parent.players[node & 1] = winner
+        self._changed(parent)
+        if None in parent.players:
+            return []
+        self.round = max(self.round, parent.round)
+        self._set_ready(parent, now)
+        return [parent]
+
+    def _report(self, match, winner, now):
+        if winner is None:
+            # 引き分けは決着がつくまでやり直す
+            self._set_ready(match, now)
+            return [match]
+        self._set_done(match, winner)
+        return self._advance(match, now)
+
+    def _round_matches(self, round_number):
+        # ラウンド r のノードは [2^(R-r), 2^(R-r+1))
+        start = 1 << (self.round_count - round_number)
+        return [self.matches[node] for node in range(start, start * 2)]
+
+
+class Swiss(Tournament):
+    """スイス式。毎ラウンド同じ得点どうしを（再戦を避けて）組み合わせ、合計得点で順位を決める
+
+    勝ち 1点、引き分け 0.5点、不戦勝（奇数人数の bye）1点。同点はブッフホルツ（対戦相手の得点の合計）で比べる。
+    """
+
+    format = 'swiss'
+
+    def __init__(self, tournament_id, name, max_players=MAX_PLAYERS, rounds=None):
+        super().__init__(tournament_id, name, max_players)
+        self.round_count = rounds or 0
+        self.scores = {}
+        self.opponents = {}          # {プレイヤー: 対戦した相手のタプル}（写しを取りやすいように書き換えずに作り直す）
+        self.byes = set()
+        self.remaining = 0           # 今のラウンドで結果待ちの試合数
+        self.rounds = {}             # {ラウンド: [TournamentMatch]}
+        self._match_ids = itertools.count(1)
+        self._standings = None
+
+    def _setup(self, now):
+        if not self.round_count:
+            # 全勝が1人に決まるラウンド数
+            self.round_count = max(1, (len(self.entrants) - 1).bit_length())
+        for player in self.entrants:
+            self.scores[player] = 0.0
+            self.opponents[player] = ()
+        return self._pair(now)
+
+    def _pair(self, now):
+        """次のラウンドを組む（ラウンドの全試合が終わったときだけ呼ばれる）"""
+        self.round += 1
+        self._standings = None
+        seeds = self.seeds
+        ranked = sorted(self.entrants, key=lambda player: (-self.scores[player], seeds[player]))
+        matches = self.rounds[self.round] = []
+        if len(ranked) % 2:
+            # 奇数人数なら、まだ bye のない一番下の人が不戦勝
+            bye = next((p for p in reversed(ranked) if p not in self.byes), ranked[-1])
+            ranked.remove(bye)
+            self.byes.add(bye)
+            self.scores[bye] += 1.0
+            match = TournamentMatch(next(self._match_ids), self.round, [bye, None])
+            self.matches[match.match_id] = match
+            matches.append(match)
+            self._set_done(match, 0)
+
+        unpaired = deque(ranked)
+        ready = []
+        while unpaired:
+            player = unpaired.popleft()
+            played = self.opponents[player]
+            # 上から順に、まだ当たっていない相手を探す（いなければすぐ下の人）
+            for index, candidate in enumerate(unpaired):
+                if candidate not in played:
+                    break
+            else:
+                index = 0
+            opponent = unpaired[index]
+            del unpaired[index]
+            match = TournamentMatch(next(self._match_ids), self.round, [player, opponent])
+            self.matches[match.match_id] = match
+            matches.append(match)
+            self.opponents[player] = played + (opponent,)
+            self.opponents[opponent] += (player,)
+            self._set_ready(match, now)
+            ready.append(match)
+        self.remaining = len(ready)
+        return ready
+
+    def _report(self, match, winner, now):
+        first, second = match.players
+        if winner is None:
+            self.scores[first] += 0.5
+            self.scores[second] += 0.5
+        else:
+            self.scores[match.players[winner]] += 1.0
+        self._set_done(match, winner)
+        self._standings = None
+        self.remaining -= 1
+        if self.remaining:
+            return []
+        if self.round >= self.round_count:
+            self.status = 'finished'
+            self.champion = self.standings()[0][0]
+            self._invalidate()
+            return []
+        return self._pair(now)
+
+    def standings(self):
+        """[(プレイヤー, 得点, ブッフホルツ), ...] の順位表（結果が変わったときだけ作り直す）"""
+        if self._standings is None:
+            self._standings = self._rank(self.scores, self.opponents)
+        return self._standings
+
+    def _rank(self, scores, opponents):
+        # 開始後の entrants と seeds は書き換わらないので、ロックの外からも読める
+        table = [(player, scores[player], sum(scores[o] for o in opponents[player]))
+                 for player in self.entrants]
+        table.sort(key=lambda row: (-row[1], -row[2], self.seeds[row[0]]))
+        return table
+
+    def _round_matches(self, round_number):
+        return self.rounds.get(round_number, [])
+
+    def _extra_snapshot(self):
+        if self.status == 'registration':
+            return None
+        if self._standings is not None:
+            return self._standings
+        return dict(self.scores), dict(self.opponents)
+
+    def _extra_view(self, extra):
+        if extra is None:
+            return {}, None
+        table = extra if isinstance(extra, list) else self._rank(*extra)
+        return {'standings': [[player, score, buchholz] for player, score, buchholz in table[:100]]}, table
+
+    def _store_extra(self, table):
+        if table is not None:
+            self._standings = table
+
+
+class TournamentDirector:
+    """開催中のトーナメントをまとめて持つ。Flask のスレッドとゲートウェイのスレッドの両方から呼ばれる
+
+    rating_of(プレイヤー) はシードを決めるときのレーティング。
+    """
+
+    def __init__(self, rating_of, no_show_timeout=NO_SHOW_TIMEOUT):
+        self.rating_of = rating_of
+        self.no_show_timeout = no_show_timeout
+        self.tournaments = {}
+        self.lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self.on_ready = None         # 新しく対戦できるようになった試合を受け取る関数（ゲートウェイが設定する）
+
+    def create(self, name, format='single_elimination', rounds=None, max_players=MAX_PLAYERS):
+        if format not in FORMATS:
+            raise TournamentError('不明な形式です。')
+        with self.lock:
+            tournament_id = next(self._ids)
+            if format == 'swiss':
+                tournament = Swiss(tournament_id, name, max_players, rounds)
+            else:
+                tournament = SingleElimination(tournament_id, name, max_players)
+            self.tournaments[tournament_id] = tournament
+            return tournament
+
+    def get(self, tournament_id):
+        return self.tournaments.get(tournament_id)
+
+    def join(self, tournament_id, player):
+        with self.lock:
+            return self._tournament(tournament_id).join(player)
+
+    def leave(self, tournament_id, player):
+        with self.lock:
+            return self._tournament(tournament_id).leave(player)
+
+    def start(self, tournament_id, now=None):
+        with self.lock:
+            tournament = self._tournament(tournament_id)
+            ready = tournament.start(self.rating_of, now)
+        self._notify(tournament, ready)
+        return tournament
+
+    def _tournament(self, tournament_id):
+        tournament = self.tournaments.get(tournament_id)
+        if tournament is None:
+            raise TournamentError('不明なトーナメントです。')
+        return tournament
+
+    def match_for(self, player):
+        """プレイヤーの対戦待ち・対戦中の (トーナメント, 試合)。なければ (None, None)"""
+        for tournament in self.tournaments.values():
+            if tournament.status == 'running':
+                match = tournament.current.get(player)
+                if match is not None:
+                    return tournament, match
+        return None, None
+
+    def begin(self, tournament, match):
+        with self.lock:
+            tournament.begin(match)
+
+    def report(self, tournament, match, winner, now=None):
+        with self.lock:
+            ready = tournament.report(match, winner, now)
+        self._notify(tournament, ready)
+
+    def expire(self, present, now=None):
+        """組まれてから来ない相手の試合を不戦勝にする。両方いなければ上位シードの勝ち
+
+        present(プレイヤー) はチェックインしているか。
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [(tournament, match) for tournament in self.tournaments.values()
+                       if tournament.status == 'running'
+                       for match in tournament.overdue(now, self.no_show_timeout)]
+        for tournament, match in expired:
+            first, second = (present(player) for player in match.players)
+            if first != second:
+                winner = 0 if first else 1
+            else:
+                winner = 0 if tournament.seeds[match.players[0]] < tournament.seeds[match.players[1]] else 1
+            self.report(tournament, match, winner, now)
+        return len(expired)
+
+    def _notify(self, tournament, ready):
+        if ready and self.on_ready is not None:
+            self.on_ready(tournament, ready)
+
+    def view(self, tournament_id):
+        """シリアライズ済みの JSON（なければ None）"""
+        tournament = self.tournaments.get(tournament_id)
+        if tournament is None:
+            return None
+        view = tournament._view
+        if view is None:
+            # シリアライズはロックの外でする（ゲートウェイの report() を待たせない）
+            with self.lock:
+                snapshot = tournament.snapshot()
+            view, cache = tournament.build_view(snapshot)
+            with self.lock:
+                tournament.store_view(snapshot, view, cache)
+        return view
+
+    def list(self, player=None):
+        """一覧。player を渡すと、そのプレイヤーが参加登録しているか（joined）も付ける"""
+        return [dict(tournament.summary(), joined=player is not None and player in tournament)
+                for tournament in self.tournaments.values()]
+
+    def metrics(self):
+        tournaments = list(self.tournaments.values())
+        return {
+            'tournaments': len(tournaments),
+            'running': sum(1 for t in tournaments if t.status == 'running'),
+            'waiting_matches': sum(len(t.current) for t in tournaments) // 2,
+            'results_reported': sum(t.results_reported for t in tournaments),
+        }
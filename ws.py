@@ -0,0 +1,268 @@
+"""asyncio 上の最小限の WebSocket 実装（RFC 6455）
+
+ゲームのリアルタイム通信に必要な分だけ（テキスト/バイナリ、ping/pong、close）を扱う。
+サーバー側の accept() と、負荷テスト用のクライアント connect() を提供する。
+ゲートウェイが同じポートで通常の HTTP も受けられるよう、リクエストの先頭の読み取り（read_request）は分けてある。
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+from urllib.parse import urlsplit, parse_qs
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class HandshakeError(Exception):
+    pass
+
+
+def _accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + GUID).digest()).decode()
+
+
+def _mask(data, mask):
+    """4バイトのマスクをかける（外す）"""
+    if not data:
+        return data
+    length = len(data)
+    repeated = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(opcode, payload, mask=None):
+    """1フレーム分のバイト列を作る（mask はクライアント送信時のみ）"""
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', length)
+    if mask:
+        return bytes(header) + mask + _mask(payload, mask)
+    return bytes(header) + payload
+
+
+def prepare(message):
+    """同じメッセージを大勢に送るとき用に、サーバーから送るフレームを一度だけ作る"""
+    if isinstance(message, str):
+        return encode_frame(OP_TEXT, message.encode('utf-8'))
+    return encode_frame(OP_BINARY, message)
+
+
+class WebSocket:
+    """1本の WebSocket 接続"""
+
+    def __init__(self, reader, writer, path, headers, is_client=False):
+        self.reader = reader
+        self.writer = writer
+        self.path = path
+        self.headers = headers
+        self.is_client = is_client
+        self.closed = False
+        self.outbox = None   # 送信キュー（fanout.SendQueue）。あればデータの送信はすべてここを通す
+
+    @property
+    def query(self):
+        return query_params(self.path)
+
+    def cookie(self, name):
+        return parse_cookie(self.headers, name)
+
+    async def _read_frame(self):
+        head = await self.reader.readexactly(2)
+        fin = head[0] & 0x80
+        opcode = head[0] & 0x0F
+        masked = head[1] & 0x80
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise ConnectionClosed('message too large')
+        mask = await self.reader.readexactly(4) if masked else None
+        payload = await self.reader.readexactly(length)
+        if mask:
+            payload = _mask(payload, mask)
+        return fin, opcode, payload
+
+    async def recv(self):
+        """次のメッセージ（str または bytes）を返す。切断されたら ConnectionClosed"""
+        fragments = []
+        message_opcode = None
+        try:
+            while True:
+                fin, opcode, payload = await self._read_frame()
+                if opcode == OP_PING:
+                    await self._send_frame(OP_PONG, payload)
+                    continue
+                if opcode == OP_PONG:
+                    continue
+                if opcode == OP_CLOSE:
+                    await self.close()
+                    raise ConnectionClosed()
+                if opcode != OP_CONTINUATION:
+                    message_opcode = opcode
+                fragments.append(payload)
+                if sum(len(f) for f in fragments) > MAX_MESSAGE_SIZE:
+                    raise ConnectionClosed('message too large')
+                if fin:
+                    data = b''.join(fragments)
+                    return data.decode('utf-8') if message_opcode == OP_TEXT else data
+        except (asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError) as e:
+            self.closed = True
+            raise ConnectionClosed() from e
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ConnectionClosed:
+            raise StopAsyncIteration
+
+    async def _send_frame(self, opcode, payload):
+        if self.closed:
+            raise ConnectionClosed()
+        mask = os.urandom(4) if self.is_client else None
+        try:
+            self.writer.write(encode_frame(opcode, payload, mask))
+            await self.writer.drain()
+        except ConnectionError as e:
+            self.closed = True
+            raise ConnectionClosed() from e
+
+    async def send(self, message):
+        if self.outbox is not None:
+            if not self.send_prepared(prepare(message)):
+                raise ConnectionClosed()
+            return
+        if isinstance(message, str):
+            await self._send_frame(OP_TEXT, message.encode('utf-8'))
+        else:
+            await self._send_frame(OP_BINARY, message)
+
+    def send_prepared(self, frame, kind='control'):
+        """prepare() で作ったフレームを送る（送信完了は待たない）。送れなければ False
+
+        kind は送信キューでの間引き方を決めるメッセージの種類（fanout.MESSAGE_POLICIES）。
+        """
+        if self.closed:
+            return False
+        outbox = self.outbox
+        if outbox is not None:
+            if outbox.transport.is_closing() or not outbox.put(frame, kind):
+                self.closed = True
+                return False
+            return True
+        if self.writer.is_closing():
+            return False
+        self.writer.write(frame)
+        return True
+
+    async def close(self, code=1000):
+        if self.closed:
+            return
+        try:
+            await self._send_frame(OP_CLOSE, struct.pack('!H', code))
+        except ConnectionClosed:
+            pass
+        self.closed = True
+        self.writer.close()
+
+
+async def _read_headers(reader):
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ('\r\n', '\n', ''):
+            break
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+    return request_line, headers
+
+
+def query_params(path):
+    return {k: v[0] for k, v in parse_qs(urlsplit(path).query).items()}
+
+
+def parse_cookie(headers, name):
+    for part in headers.get('cookie', '').split(';'):
+        key, _, value = part.strip().partition('=')
+        if key == name:
+            return value
+    return None
+
+
+def is_upgrade(headers):
+    return 'websocket' in headers.get('upgrade', '').lower()
+
+
+async def read_request(reader):
+    """HTTP リクエストの先頭を読んで (メソッド, パス, ヘッダー) を返す"""
+    request_line, headers = await _read_headers(reader)
+    parts = request_line.split()
+    if len(parts) < 3:
+        raise HandshakeError(request_line)
+    return parts[0], parts[1], headers
+
+
+async def accept(reader, writer, request=None):
+    """HTTP のアップグレード要求を受けて WebSocket を返す（request は読み取り済みの read_request() の結果）"""
+    method, path, headers = request or await read_request(reader)
+    key = headers.get('sec-websocket-key')
+    if method != 'GET' or not key or not is_upgrade(headers):
+        writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+        raise HandshakeError(f"{method} {path}")
+    writer.write((
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {_accept_key(key)}\r\n\r\n").encode())
+    await writer.drain()
+    return WebSocket(reader, writer, path, headers)
+
+
+async def connect(host, port, path='/', headers=None):
+    """WebSocket サーバーに接続する（負荷テスト・ボット用）"""
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    extra = ''.join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+    writer.write((
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n"
+        f"{extra}\r\n").encode())
+    await writer.drain()
+    status_line, response_headers = await _read_headers(reader)
+    if ' 101 ' not in status_line or response_headers.get('sec-websocket-accept') != _accept_key(key):
+        writer.close()
+        raise HandshakeError(status_line)
+    return WebSocket(reader, writer, path, response_headers, is_client=True)